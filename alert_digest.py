@@ -0,0 +1,127 @@
+# alert_digest.py
+# Alert rendering, digest coalescing and Telegram-size message splitting.
+
+import os
+import time
+from chains import explorer_url, chain_name
+
+# --- Configuration ---
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+DIGEST_WINDOW_SECONDS = float(os.getenv("DIGEST_WINDOW_SECONDS", "300")) # How often digest subscribers get a summary
+DIGEST_IMMEDIATE_SCORE = float(os.getenv("DIGEST_IMMEDIATE_SCORE", "80")) # Pools scoring at least this skip the digest
+ALERT_MODES = ('realtime', 'digest')
+
+DYOR_FOOTER = "🚨 *DYOR - Do Your Own Research! This is not financial advice.* 🚨"
+SYMBOL_MAX_LENGTH = 32
+
+def code_text(text):
+    """
+    Makes a token symbol safe inside a Markdown `code` span. Telegram's legacy Markdown can't
+    escape within code, so backticks (which would end the span) are replaced, and line breaks
+    (which would split a digest line) are flattened.
+    """
+    text = " ".join(str(text or "").replace("`", "'").split())[:SYMBOL_MAX_LENGTH]
+    return text or "???"
+
+def format_pool_alert(pool):
+    """Full single-pool alert (Markdown)."""
+    chain = pool.get('chain', 'ethereum')
+    token0_symbol = code_text(pool['token0_info']['symbol'])
+    token1_symbol = code_text(pool['token1_info']['symbol'])
+    venue = f"{chain_name(chain)} · {pool['dex']}" if pool.get('dex') else chain_name(chain)
+    total_pairs = f"📈 Total Pairs: `{pool['num_pairs_on_factory']}`\n" if pool.get('num_pairs_on_factory') is not None else ""
+    score = f"🎯 Score: `{pool['score']:.0f}/100`{format_score_details(pool.get('score_features'))}\n" if pool.get('score') is not None else ""
+    return (
+        "🔥 *NEW LIQUIDITY POOL DETECTED!* 🔥\n\n"
+        f"⛓ Chain: `{venue}`\n"
+        f"🔗 Pair Address: [`{pool['pair_address'][:6]}...`]({explorer_url(chain, 'address', pool['pair_address'])})\n"
+        f"💰 Tokens: `{token0_symbol}/{token1_symbol}`\n"
+        f"➡️ Token0: [`{pool['token0_address'][:6]}...`]({explorer_url(chain, 'address', pool['token0_address'])})\n"
+        f"➡️ Token1: [`{pool['token1_address'][:6]}...`]({explorer_url(chain, 'address', pool['token1_address'])})\n"
+        f"{total_pairs}"
+        f"{score}"
+        f"📦 {'Slot' if chain == 'solana' else 'Block'}: `{pool['block_number']}`\n"
+        f"📝 TX: [View Transaction]({explorer_url(chain, 'tx', pool['transaction_hash'])})\n\n"
+        f"{DYOR_FOOTER}"
+    )
+
+def format_score_details(features):
+    """' · liq `3.2` · LP locked `95%` · renounced' from the scorer's raw features (unknown ones are left out)."""
+    if not features:
+        return ""
+    details = []
+    if features.get('liquidity') is not None:
+        details.append(f"liq `{features['liquidity']:.2f}`")
+    if features.get('lp_locked') is not None:
+        details.append(f"LP locked `{features['lp_locked']:.0%}`")
+    if features.get('renounced') is not None:
+        details.append("renounced" if features['renounced'] else "owned")
+    return "".join(f" · {d}" for d in details)
+
+def format_pool_line(pool):
+    """One compact digest line per pool."""
+    chain = pool.get('chain', 'ethereum')
+    symbols = f"{code_text(pool['token0_info']['symbol'])}/{code_text(pool['token1_info']['symbol'])}"
+    score = f" · score `{pool['score']:.0f}`" if pool.get('score') is not None else ""
+    return (f"• `{symbols}` · {chain_name(chain)} · [pair]({explorer_url(chain, 'address', pool['pair_address'])}) · "
+            f"[tx]({explorer_url(chain, 'tx', pool['transaction_hash'])}) · block `{pool['block_number']}`{score}")
+
+def split_message(header, lines, footer="", limit=TELEGRAM_MAX_MESSAGE_LENGTH):
+    """
+    Packs lines into as few messages as possible, each at most `limit` characters. Messages only
+    break between lines, so Markdown links and code spans are never cut; a line that can't fit
+    even on its own is left out.
+    """
+    messages = []
+    current = header
+    for line in lines:
+        if len(header) + len(line) + 1 > limit:
+            continue
+        if len(current) + len(line) + 1 > limit:
+            messages.append(current)
+            current = header
+        current += line + "\n"
+    if footer and len(current) + len(footer) + 1 <= limit:
+        current += "\n" + footer
+    elif footer:
+        messages.append(current)
+        current = footer
+    messages.append(current)
+    return messages
+
+def render_pools(pools, title="🔥 *NEW LIQUIDITY POOLS DETECTED*"):
+    """One full alert for a single pool, otherwise a compact digest split at Telegram's limit."""
+    if not pools:
+        return []
+    if len(pools) == 1:
+        return [format_pool_alert(pools[0])]
+    return split_message(f"{title} ({len(pools)})\n\n", [format_pool_line(p) for p in pools], DYOR_FOOTER)
+
+def is_immediate(pool):
+    """Top-scored pools are pushed to everyone right away, digest mode or not."""
+    return (pool.get('score') or 0) >= DIGEST_IMMEDIATE_SCORE
+
+class DigestBuffer:
+    """Collects pools for digest subscribers and releases them once per window."""
+
+    def __init__(self, window=DIGEST_WINDOW_SECONDS):
+        self.window = window
+        self._pools = []
+        self._window_started_at = time.monotonic()
+
+    def add(self, pools):
+        self._pools.extend(pools)
+
+    def due(self):
+        return bool(self._pools) and time.monotonic() - self._window_started_at >= self.window
+
+    def drain(self):
+        pools, self._pools = self._pools, []
+        self._window_started_at = time.monotonic()
+        return pools
+
+    def render(self):
+        """Drains the buffer into digest messages."""
+        pools = self.drain()
+        minutes = max(1, round(self.window / 60))
+        return render_pools(pools, title=f"🗞 *ALPHA DIGEST — last {minutes} min*")
@@ -0,0 +1,158 @@
+# alert_outbox.py
+# Durable alert delivery: the alert loop writes messages + recipients to Postgres and returns
+# straight away; delivery workers drain the outbox, so a restart resumes mid-fan-out.
+
+import os
+import time
+import asyncio
+import logging
+from async_db_manager import enqueue_alerts, claim_alert_deliveries, complete_alert_deliveries, \
+                             get_alert_outbox_backlog, purge_alert_outbox
+from cluster import shard_for
+from metrics import ALERTS_SENT, ALERT_END_TO_END_SECONDS, ALERT_OUTBOX_ENQUEUED, ALERT_OUTBOX_OUTCOMES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+ALERT_OUTBOX_WORKERS = int(os.getenv("ALERT_OUTBOX_WORKERS", "2"))
+ALERT_OUTBOX_BATCH_SIZE = int(os.getenv("ALERT_OUTBOX_BATCH_SIZE", "200")) # Deliveries claimed per worker round-trip
+ALERT_OUTBOX_LEASE_SECONDS = float(os.getenv("ALERT_OUTBOX_LEASE_SECONDS", "120")) # Claimed rows come back after this if a worker dies
+ALERT_OUTBOX_MAX_ATTEMPTS = int(os.getenv("ALERT_OUTBOX_MAX_ATTEMPTS", "5"))
+ALERT_OUTBOX_RETRY_BASE_SECONDS = 30
+ALERT_OUTBOX_RETRY_MAX_SECONDS = 1800
+ALERT_OUTBOX_POLL_SECONDS = float(os.getenv("ALERT_OUTBOX_POLL_SECONDS", "2")) # Idle poll; in-process enqueues wake workers at once
+ALERT_OUTBOX_FLUSH_ROWS = 20 # Outcomes buffered before they are written back (bounds re-sends after a crash)
+ALERT_OUTBOX_STATS_SECONDS = 15
+ALERT_OUTBOX_RETENTION_SECONDS = float(os.getenv("ALERT_OUTBOX_RETENTION_SECONDS", str(7 * 24 * 3600)))
+ALERT_OUTBOX_PURGE_SECONDS = 3600
+
+class AlertOutbox:
+    """
+    Postgres-backed alert queue. `enqueue()` is one bulk insert; workers claim due deliveries
+    with FOR UPDATE SKIP LOCKED, send them through the AlertSender and write outcomes back in
+    small batches. Failed sends are retried with backoff up to ALERT_OUTBOX_MAX_ATTEMPTS.
+    Delivery is at-least-once: after a crash, at most the outcomes not yet written back
+    (ALERT_OUTBOX_FLUSH_ROWS per worker) are sent again once their lease expires.
+
+    Every delivery is stored with its chat's shard. `shards` = None claims everything
+    (single process); in cluster mode it is the list of shards this process owns, so each
+    chat is always sent from one process and its per-chat rate limit stays accurate.
+
+    With `history` set (a history_archive.HistoryArchive), every settled delivery is archived.
+    """
+
+    def __init__(self, sender, workers=ALERT_OUTBOX_WORKERS, batch_size=ALERT_OUTBOX_BATCH_SIZE,
+                 lease_seconds=ALERT_OUTBOX_LEASE_SECONDS, max_attempts=ALERT_OUTBOX_MAX_ATTEMPTS):
+        self.sender = sender
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.stats = {'enqueued': 0, 'sent': 0, 'failed': 0, 'blocked': 0, 'skipped': 0, 'retried': 0,
+                      'in_flight': 0, 'pending': 0, 'oldest_pending_seconds': 0.0}
+        self.shards = None
+        self.purge_settled = True # Only one process of a cluster needs to purge
+        self.history = None
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    async def enqueue(self, messages, chat_ids, kind, block_timestamp=None):
+        """Queues every message for every chat. Returns the number of deliveries queued; raises if the DB write fails."""
+        queued = await enqueue_alerts(kind, messages, chat_ids, block_timestamp,
+                                      shards=[shard_for(chat_id) for chat_id in chat_ids])
+        self.stats['enqueued'] += queued
+        ALERT_OUTBOX_ENQUEUED.labels(kind).inc(queued)
+        if queued:
+            self._wakeup.set()
+        return queued
+
+    def wake(self):
+        """Makes idle workers claim right away, e.g. when another process has enqueued (NOTIFY)."""
+        self._wakeup.set()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._monitor()))
+        logging.info(f"Alert outbox started with {self.workers} delivery worker(s).")
+        return self._tasks
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _send(self, row):
+        outcome = await self.sender.send_one(row['chat_id'], row['body'], parse_mode='Markdown', disable_web_page_preview=True)
+        ALERT_OUTBOX_OUTCOMES.labels(outcome).inc()
+        if outcome == 'sent':
+            ALERTS_SENT.labels(row['kind']).inc()
+            if row['block_timestamp']:
+                ALERT_END_TO_END_SECONDS.observe(max(0.0, time.time() - row['block_timestamp']))
+        elif outcome == 'failed' and row['attempts'] < self.max_attempts:
+            self.stats['retried'] += 1
+            return outcome
+        self.stats[outcome] += 1
+        if self.history is not None:
+            self.history.record_delivery(row, outcome)
+        return outcome
+
+    async def _flush(self, results):
+        batch = results[:]
+        results.clear() # No await in between, so concurrent sends never lose an outcome
+        await complete_alert_deliveries(batch, self.max_attempts, ALERT_OUTBOX_RETRY_BASE_SECONDS,
+                                        ALERT_OUTBOX_RETRY_MAX_SECONDS)
+
+    async def _deliver_batch(self, rows):
+        results = []
+
+        async def deliver(row):
+            outcome = await self._send(row)
+            results.append((row['message_id'], row['chat_id'], outcome))
+            if len(results) >= ALERT_OUTBOX_FLUSH_ROWS:
+                await self._flush(results)
+
+        self.stats['in_flight'] += len(rows)
+        try:
+            await asyncio.gather(*(deliver(row) for row in rows))
+        finally:
+            self.stats['in_flight'] -= len(rows)
+            await self._flush(results)
+
+    async def _worker(self, n):
+        while True:
+            try:
+                self._wakeup.clear() # Cleared before claiming, so an enqueue during the claim still wakes us
+                rows = await claim_alert_deliveries(self.batch_size, self.lease_seconds, shards=self.shards)
+                if not rows:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=ALERT_OUTBOX_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._deliver_batch(rows)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Alert outbox worker {n} error: {e}")
+                await asyncio.sleep(5)
+
+    async def _monitor(self):
+        """Refreshes the backlog stats (pending / oldest_pending_seconds) and purges settled messages."""
+        next_purge_at = time.monotonic() + ALERT_OUTBOX_PURGE_SECONDS
+        while True:
+            try:
+                backlog = await get_alert_outbox_backlog()
+                self.stats.update(backlog)
+                if backlog.get('oldest_pending_seconds', 0) > 5 * 60:
+                    logging.warning(f"Alert outbox backlog: {backlog['pending']} deliveries pending, "
+                                    f"oldest {backlog['oldest_pending_seconds']:.0f}s.")
+                if self.purge_settled and time.monotonic() >= next_purge_at:
+                    purged = await purge_alert_outbox(ALERT_OUTBOX_RETENTION_SECONDS)
+                    if purged:
+                        logging.info(f"Purged {purged} settled alert message(s) from the outbox.")
+                    next_purge_at = time.monotonic() + ALERT_OUTBOX_PURGE_SECONDS
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Alert outbox monitor error: {e}")
+            await asyncio.sleep(ALERT_OUTBOX_STATS_SECONDS)
@@ -0,0 +1,231 @@
+# alert_sender.py
+# Concurrent, rate-limit-aware Telegram alert fan-out for the AsyncTeleBot.
+
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+from telebot.asyncio_helper import ApiTelegramException
+from metrics import TELEGRAM_SEND_LATENCY, TELEGRAM_SEND_ERRORS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Delivery Configuration ---
+# Telegram allows roughly 30 messages/second overall and about 1 message/second per chat.
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_PER_CHAT_RATE = float(os.getenv("TELEGRAM_PER_CHAT_RATE", "1"))
+ALERT_SEND_CONCURRENCY = int(os.getenv("ALERT_SEND_CONCURRENCY", "30"))
+ALERT_SEND_MAX_RETRIES = int(os.getenv("ALERT_SEND_MAX_RETRIES", "4"))
+ALERT_SEND_MAX_RATE_LIMIT_WAIT_SECONDS = float(os.getenv("ALERT_SEND_MAX_RATE_LIMIT_WAIT_SECONDS", "300")) # Total 429 wait per message before giving up
+ALERT_SEND_BACKOFF_BASE_SECONDS = 0.5
+ALERT_SEND_BACKOFF_MAX_SECONDS = 30
+MAX_TRACKED_CHAT_BUCKETS = 50000 # Bounds memory used by per-chat token buckets
+
+# Telegram error descriptions meaning the chat will never accept messages from us.
+BLOCKED_ERROR_MARKERS = (
+    "bot was blocked by the user",
+    "user is deactivated",
+    "bot was kicked",
+    "chat not found",
+    "bot can't initiate conversation",
+    "have no rights to send a message",
+)
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def pause(self, seconds):
+        """Stops handing out tokens for `seconds` (used to honor Telegram's retry_after)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    @property
+    def idle(self):
+        """True once the bucket has refilled completely, i.e. it carries no state worth keeping."""
+        now = time.monotonic()
+        return now >= self._paused_until and self._tokens + (now - self._updated_at) * self.rate >= self.capacity
+
+class AlertSender:
+    """
+    Fans a message out to many chats concurrently while staying under Telegram's
+    global and per-chat limits. 429s pause sending for `retry_after` (up to
+    `max_rate_limit_wait` seconds per message), transient
+    errors are retried with bounded exponential backoff, and chats that blocked
+    the bot are remembered and skipped.
+    """
+
+    def __init__(self, bot, global_rate=TELEGRAM_GLOBAL_RATE, per_chat_rate=TELEGRAM_PER_CHAT_RATE,
+                 concurrency=ALERT_SEND_CONCURRENCY, max_retries=ALERT_SEND_MAX_RETRIES, on_blocked=None,
+                 max_rate_limit_wait=ALERT_SEND_MAX_RATE_LIMIT_WAIT_SECONDS):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.on_blocked = on_blocked # Optional callback(chat_id), e.g. to persist the block
+        self.blocked_chats = set()
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets = OrderedDict()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_TRACKED_CHAT_BUCKETS:
+                # Drop the oldest buckets that have fully refilled; they would behave like new ones anyway.
+                for old_id in list(self._chat_buckets)[:len(self._chat_buckets) // 10 or 1]:
+                    if self._chat_buckets[old_id].idle:
+                        del self._chat_buckets[old_id]
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, capacity=1)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def set_global_rate(self, rate):
+        """Changes the overall send rate, e.g. to this worker's share of the bot-wide limit in cluster mode."""
+        self._global_bucket.rate = rate
+        self._global_bucket.capacity = max(1.0, rate)
+
+    def mark_blocked(self, chat_id):
+        self.blocked_chats.add(chat_id)
+        self._chat_buckets.pop(chat_id, None)
+
+    def unmark_blocked(self, chat_id):
+        """Call when a chat talks to the bot again (e.g. /start after unblocking)."""
+        self.blocked_chats.discard(chat_id)
+
+    async def _notify_blocked(self, chat_id):
+        if self.on_blocked is None:
+            return
+        try:
+            result = self.on_blocked(chat_id)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logging.error(f"on_blocked callback failed for {chat_id}: {e}")
+
+    @staticmethod
+    def _backoff(attempt):
+        delay = min(ALERT_SEND_BACKOFF_MAX_SECONDS, ALERT_SEND_BACKOFF_BASE_SECONDS * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2) # Jitter so retries don't arrive in lockstep
+
+    async def send_one(self, chat_id, text, stats=None, **kwargs):
+        """
+        Sends one message, retrying as needed.
+        Returns 'sent', 'blocked', 'skipped' or 'failed'.
+        """
+        stats = stats if stats is not None else {}
+        if chat_id in self.blocked_chats:
+            return 'skipped'
+        chat_bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        rate_limit_wait = 0.0
+        while True:
+            await chat_bucket.acquire()
+            await self._global_bucket.acquire()
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    try:
+                        await self.bot.send_message(chat_id, text, **kwargs)
+                    finally:
+                        TELEGRAM_SEND_LATENCY.observe(time.perf_counter() - started)
+                return 'sent'
+            except ApiTelegramException as e:
+                TELEGRAM_SEND_ERRORS.labels(str(e.error_code)).inc()
+                description = (e.description or "").lower()
+                if e.error_code == 429:
+                    retry_after = ((e.result_json or {}).get('parameters') or {}).get('retry_after', 1)
+                    stats['rate_limited'] = stats.get('rate_limited', 0) + 1
+                    rate_limit_wait += retry_after
+                    if rate_limit_wait > self.max_rate_limit_wait:
+                        logging.error(f"Failed to send alert to {chat_id}: still rate limited after waiting {rate_limit_wait - retry_after:.0f}s.")
+                        return 'failed'
+                    logging.warning(f"Telegram 429 while sending to {chat_id}; pausing {retry_after}s.")
+                    self._global_bucket.pause(retry_after)
+                    chat_bucket.pause(retry_after)
+                    # 429s have their own budget (total wait), not the retry count: Telegram told us when to come back.
+                    continue
+                if e.error_code in (400, 403) and any(marker in description for marker in BLOCKED_ERROR_MARKERS):
+                    logging.info(f"Chat {chat_id} is unreachable ({e.description}); skipping it from now on.")
+                    self.mark_blocked(chat_id)
+                    await self._notify_blocked(chat_id)
+                    return 'blocked'
+                if e.error_code < 500 or attempt >= self.max_retries:
+                    logging.error(f"Failed to send alert to {chat_id}: {e}")
+                    return 'failed'
+                error = e
+            except Exception as e:
+                TELEGRAM_SEND_ERRORS.labels(type(e).__name__).inc()
+                if attempt >= self.max_retries:
+                    logging.error(f"Failed to send alert to {chat_id} after {attempt + 1} attempts: {e}")
+                    return 'failed'
+                error = e
+            delay = self._backoff(attempt)
+            attempt += 1
+            stats['retries'] = stats.get('retries', 0) + 1
+            logging.warning(f"Retrying send to {chat_id} in {delay:.1f}s (attempt {attempt}/{self.max_retries}): {error}")
+            await asyncio.sleep(delay)
+
+    async def send_batch(self, chat_ids, text, **kwargs):
+        """
+        Sends `text` to every chat in `chat_ids` concurrently.
+        Returns a report dict with per-outcome counts, throughput and time to the last recipient.
+        """
+        started = time.monotonic()
+        stats = {'retries': 0, 'rate_limited': 0}
+        last_delivery = {'at': started}
+
+        async def deliver(chat_id):
+            outcome = await self.send_one(chat_id, text, stats=stats, **kwargs)
+            if outcome == 'sent':
+                last_delivery['at'] = max(last_delivery['at'], time.monotonic())
+            return outcome
+
+        outcomes = await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids))
+        elapsed = time.monotonic() - started
+        sent = outcomes.count('sent')
+        report = {
+            'recipients': len(outcomes),
+            'sent': sent,
+            'failed': outcomes.count('failed'),
+            'blocked': outcomes.count('blocked'),
+            'skipped': outcomes.count('skipped'),
+            'retries': stats['retries'],
+            'rate_limited': stats['rate_limited'],
+            'elapsed_seconds': round(elapsed, 3),
+            'time_to_last_recipient_seconds': round(last_delivery['at'] - started, 3),
+            'throughput_per_second': round(sent / elapsed, 2) if elapsed > 0 else float(sent),
+        }
+        logging.info(
+            f"Alert batch: {report['sent']}/{report['recipients']} sent, {report['failed']} failed, "
+            f"{report['blocked']} newly blocked, {report['skipped']} skipped, {report['retries']} retries, "
+            f"{report['rate_limited']} rate-limited; last recipient after {report['time_to_last_recipient_seconds']}s "
+            f"({report['throughput_per_second']} msg/s)."
+        )
+        return report
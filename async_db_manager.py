@@ -0,0 +1,850 @@
+# async_db_manager.py
+# Natively async (asyncpg) version of db_manager, for use from the AsyncTeleBot event loop.
+# Function names and return shapes match db_manager.
+
+import os
+import time
+import asyncio
+import logging
+import asyncpg
+from entitlements import EntitlementCache
+from metrics import timed_db
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# --- Connection Pool Configuration (shared with db_manager) ---
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_CHECKOUT_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT_SECONDS", "10"))
+DB_POOL_MAX_IDLE_SECONDS = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")) # Set to 0 behind pgbouncer in transaction mode
+DB_COMMAND_TIMEOUT_SECONDS = float(os.getenv("DB_COMMAND_TIMEOUT_SECONDS", "15"))
+ACTIVE_SET_RESYNC_SECONDS = float(os.getenv("ACTIVE_SET_RESYNC_SECONDS", "600")) # Full reload of the premium set, catches out-of-band writes
+
+# Subscriber rows and the active premium set, kept in sync by every write below.
+entitlements = EntitlementCache()
+_digest_chat_ids = set() # Subscribers with alert_mode = 'digest'
+_digest_loaded_at = None
+
+_pool = None
+_pool_lock = None
+
+async def get_db_pool():
+    """Returns the process-wide asyncpg pool, creating it on first use."""
+    global _pool, _pool_lock
+    if _pool is not None:
+        return _pool
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            if not DATABASE_URL:
+                logging.error("DATABASE_URL environment variable is not set.")
+                raise ValueError("DATABASE_URL is required for database operations.")
+            try:
+                _pool = await asyncpg.create_pool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=DB_POOL_MAX_IDLE_SECONDS,
+                    statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                    command_timeout=DB_COMMAND_TIMEOUT_SECONDS,
+                )
+                logging.info(f"Async database pool created (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}).")
+            except Exception as e:
+                logging.error(f"Error connecting to the database: {e}")
+                raise
+    return _pool
+
+async def close_db_pool():
+    """Closes the shared asyncpg pool."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+def _expiry_ts(subscribed_until):
+    return subscribed_until.timestamp() if subscribed_until else None
+
+def _cache_subscriber(row):
+    record = dict(row)
+    entitlements.put(record['chat_id'], record['status'], _expiry_ts(record['subscribed_until']), record=record)
+    return record
+
+def get_db_pool_stats():
+    """Returns pool occupancy (empty if the pool was never used)."""
+    if _pool is None:
+        return {}
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {'size': size, 'idle': idle, 'in_use': size - idle,
+            'min_size': _pool.get_min_size(), 'max_size': _pool.get_max_size()}
+
+@timed_db
+async def initialize_db():
+    """
+    Ensures the 'subscribers' table exists.
+    """
+    try:
+        pool = await get_db_pool()
+        async with pool.acquire(timeout=DB_POOL_CHECKOUT_TIMEOUT_SECONDS) as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    chat_id BIGINT PRIMARY KEY,
+                    username TEXT,
+                    status TEXT DEFAULT 'free', -- 'free', 'pending_payment', 'premium'
+                    subscribed_until TIMESTAMP WITH TIME ZONE,
+                    last_payment_tx TEXT,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                );
+            """)
+            # Per-subscriber delivery preference: 'realtime' or 'digest'.
+            await conn.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS alert_mode TEXT NOT NULL DEFAULT 'realtime';")
+            # Referral program (same rules as the SQLite store): a free trial at database.REFERRALS_FOR_TRIAL.
+            await conn.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS referrals INTEGER NOT NULL DEFAULT 0;")
+            await conn.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS trial_used BOOLEAN NOT NULL DEFAULT FALSE;")
+            # Lets the expiry scheduler fetch just the next window of premium expiries.
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_subscribers_premium_expiry
+                ON subscribers (subscribed_until) WHERE status = 'premium';
+            """)
+            # One row per (tx hash, claimant). A tx can be claimed by several chats (only the one whose
+            # invoice it pays can be verified), but verified at most once: that is the replay protection.
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS payments (
+                    tx_hash TEXT NOT NULL,
+                    chat_id BIGINT NOT NULL,
+                    chain TEXT NOT NULL, -- 'eth', 'sol'
+                    status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'verified', 'rejected'
+                    amount_usd NUMERIC,
+                    reason TEXT,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                    settled_at TIMESTAMP WITH TIME ZONE,
+                    PRIMARY KEY (tx_hash, chat_id)
+                );
+            """)
+            # Tables created before claims were per claimant had tx_hash alone as the primary key.
+            await conn.execute("""
+                DO $$ BEGIN
+                    IF (SELECT COUNT(*) FROM information_schema.key_column_usage
+                        WHERE table_name = 'payments' AND constraint_name = 'payments_pkey') = 1 THEN
+                        ALTER TABLE payments DROP CONSTRAINT payments_pkey, ADD PRIMARY KEY (tx_hash, chat_id);
+                    END IF;
+                END $$;
+            """)
+            await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_verified_tx ON payments (tx_hash) WHERE status = 'verified';")
+            # Open invoice per subscriber. `tag` is encoded in the low digits of every quoted amount, so a
+            # transfer on-chain identifies the invoice (and chat) it pays.
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS payment_invoices (
+                    chat_id BIGINT PRIMARY KEY,
+                    tag INTEGER NOT NULL UNIQUE,
+                    usd_micro BIGINT NOT NULL, -- USDC/USDT amount, 6 decimals
+                    eth_wei NUMERIC, -- NULL when no ETH quote was available
+                    sol_lamports BIGINT, -- NULL when no SOL quote was available
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+                );
+            """)
+            # Alert outbox: one row per rendered message, one per (message, recipient) delivery.
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS alert_messages (
+                    id BIGSERIAL PRIMARY KEY,
+                    kind TEXT NOT NULL, -- 'realtime', 'immediate', 'digest'
+                    body TEXT NOT NULL,
+                    block_timestamp DOUBLE PRECISION, -- Earliest pool block time, for end-to-end latency
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                );
+            """)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS alert_deliveries (
+                    message_id BIGINT NOT NULL REFERENCES alert_messages (id) ON DELETE CASCADE,
+                    chat_id BIGINT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'sent', 'failed', 'blocked', 'skipped'
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(), -- Also the claim lease while sending
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                    PRIMARY KEY (message_id, chat_id)
+                );
+            """)
+            # Workers only ever scan pending rows, oldest message first.
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_alert_deliveries_pending
+                ON alert_deliveries (message_id, chat_id) WHERE status = 'pending';
+            """)
+            # Delivery shard (hash of chat_id); in cluster mode each worker only claims the shards it owns.
+            await conn.execute("ALTER TABLE alert_deliveries ADD COLUMN IF NOT EXISTS shard INTEGER NOT NULL DEFAULT 0;")
+            # Live bot processes in cluster mode; a worker is gone once its heartbeat is older than the TTL.
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS cluster_members (
+                    worker_id TEXT PRIMARY KEY,
+                    is_leader BOOLEAN NOT NULL DEFAULT FALSE,
+                    owned_shards INTEGER NOT NULL DEFAULT 0,
+                    started_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                    heartbeat_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+                );
+            """)
+            # Scan state shared by every node in cluster mode, so a new leader resumes where the old one stopped.
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS scanner_checkpoints (
+                    source TEXT PRIMARY KEY, -- SCAN_SOURCES name, e.g. 'ethereum:uniswap_v2'
+                    last_processed_block BIGINT NOT NULL, -- Slot for Solana sources
+                    block_hash TEXT, -- Last signature for Solana sources
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                );
+            """)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS seen_pools (
+                    pool_key TEXT PRIMARY KEY, -- seen_pools.pool_key(): chain + pair address
+                    block_number BIGINT,
+                    first_seen_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                );
+            """)
+        logging.info("Database initialized successfully: 'subscribers', 'payments', alert outbox and cluster tables checked/created.")
+    except Exception as e:
+        logging.error(f"Error initializing database: {e}")
+        raise
+
+@timed_db
+async def get_subscriber(chat_id):
+    """Retrieves a subscriber's information."""
+    cached = entitlements.get(chat_id)
+    if cached is not None and cached['record'] is not None:
+        return dict(cached['record'])
+    try:
+        pool = await get_db_pool()
+        row = await pool.fetchrow("SELECT * FROM subscribers WHERE chat_id = $1", chat_id)
+        return dict(_cache_subscriber(row)) if row else None
+    except Exception as e:
+        logging.error(f"Error getting subscriber {chat_id}: {e}")
+        return None
+
+@timed_db
+async def create_or_update_subscriber(chat_id, username):
+    """Creates a new subscriber or updates an existing one's username."""
+    try:
+        pool = await get_db_pool()
+        row = await pool.fetchrow("""
+            INSERT INTO subscribers (chat_id, username, updated_at)
+            VALUES ($1, $2, NOW())
+            ON CONFLICT (chat_id) DO UPDATE SET username = EXCLUDED.username, updated_at = NOW()
+            RETURNING *;
+        """, chat_id, username)
+        _cache_subscriber(row)
+        logging.info(f"Subscriber {chat_id} ({username}) created or updated.")
+    except Exception as e:
+        logging.error(f"Error creating/updating subscriber {chat_id}: {e}")
+
+@timed_db
+async def update_subscription_status(chat_id, status, duration_days=None, tx_hash=None):
+    """
+    Updates a subscriber's status and expiry.
+    Status can be 'free', 'pending_payment', 'premium'.
+    """
+    try:
+        params = [status]
+        subscribed_until_clause = ""
+        if status == 'premium' and duration_days:
+            # Extend current subscription or set a new one
+            params.append(int(duration_days))
+            subscribed_until_clause = f", subscribed_until = GREATEST(COALESCE(subscribed_until, NOW()), NOW()) + make_interval(days => ${len(params)})"
+        elif status == 'free':
+            subscribed_until_clause = ", subscribed_until = NULL" # Remove expiry for free users
+
+        tx_hash_clause = ""
+        if tx_hash:
+            params.append(tx_hash)
+            tx_hash_clause = f", last_payment_tx = ${len(params)}"
+        params.append(chat_id)
+
+        pool = await get_db_pool()
+        row = await pool.fetchrow(f"""
+            UPDATE subscribers SET status = $1 {subscribed_until_clause} {tx_hash_clause}, updated_at = NOW()
+            WHERE chat_id = ${len(params)}
+            RETURNING *;
+        """, *params)
+        if row:
+            _cache_subscriber(row)
+        else:
+            entitlements.invalidate(chat_id)
+        logging.info(f"Subscription status for {chat_id} updated to '{status}'.")
+    except Exception as e:
+        logging.error(f"Error updating subscription status for {chat_id}: {e}")
+
+@timed_db
+async def get_active_premium_subscribers():
+    """Retrieves all chat_ids of active premium subscribers."""
+    if entitlements.active_loaded(max_age=ACTIVE_SET_RESYNC_SECONDS):
+        return entitlements.active_ids() # Kept current by writes; expired users drop out on their own
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("SELECT chat_id, subscribed_until FROM subscribers WHERE status = 'premium' AND subscribed_until > NOW();")
+        entitlements.load_active({row['chat_id']: _expiry_ts(row['subscribed_until']) for row in rows})
+        return [row['chat_id'] for row in rows]
+    except Exception as e:
+        logging.error(f"Error getting active premium subscribers: {e}")
+        return []
+
+@timed_db
+async def expire_due_subscriptions():
+    """Sets every expired premium subscriber back to 'free' in one statement. Returns their chat_ids."""
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("""
+            UPDATE subscribers
+            SET status = 'free', subscribed_until = NULL, updated_at = NOW()
+            WHERE status = 'premium' AND subscribed_until <= NOW()
+            RETURNING chat_id;
+        """)
+        expired = [row['chat_id'] for row in rows]
+        entitlements.expire(expired)
+        if expired:
+            logging.info(f"Updated {len(expired)} expired premium subscriptions to 'free'.")
+        return expired
+    except Exception as e:
+        logging.error(f"Error checking and updating expired subscriptions: {e}")
+        return []
+
+async def check_and_update_expired_subscriptions():
+    """Sets expired premium subscribers back to 'free' status. Returns how many were downgraded."""
+    return len(await expire_due_subscriptions())
+
+@timed_db
+async def get_upcoming_expiries(within_seconds):
+    """Returns [(chat_id, subscribed_until)] for premium subscriptions ending within `within_seconds` (or already ended)."""
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("""
+            SELECT chat_id, subscribed_until FROM subscribers
+            WHERE status = 'premium' AND subscribed_until <= NOW() + make_interval(secs => $1)
+            ORDER BY subscribed_until;
+        """, float(within_seconds))
+        return [(row['chat_id'], row['subscribed_until']) for row in rows]
+    except Exception as e:
+        logging.error(f"Error getting upcoming expiries: {e}")
+        return []
+
+@timed_db
+async def expire_subscriptions(chat_ids):
+    """
+    Downgrades the given subscribers to 'free' in one statement, skipping any whose
+    subscription was renewed in the meantime. Returns the chat_ids actually downgraded.
+    """
+    if not chat_ids:
+        return []
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("""
+            UPDATE subscribers
+            SET status = 'free', subscribed_until = NULL, updated_at = NOW()
+            WHERE chat_id = ANY($1::bigint[]) AND status = 'premium' AND subscribed_until <= NOW()
+            RETURNING chat_id;
+        """, list(chat_ids))
+        expired = [row['chat_id'] for row in rows]
+        entitlements.expire(expired)
+        if expired:
+            logging.info(f"Downgraded {len(expired)} expired premium subscription(s) to 'free'.")
+        return expired
+    except Exception as e:
+        logging.error(f"Error expiring subscriptions {list(chat_ids)[:10]}: {e}")
+        return []
+
+# --- Bulk subscriber operations (one round trip whatever the number of subscribers) ---
+
+@timed_db
+async def get_subscribers(chat_ids):
+    """{chat_id: subscriber dict} for the given chat_ids that exist; cached rows are not re-read."""
+    found = {}
+    missing = []
+    for chat_id in set(chat_ids):
+        cached = entitlements.get(chat_id)
+        if cached is not None and cached['record'] is not None:
+            found[chat_id] = dict(cached['record'])
+        else:
+            missing.append(chat_id)
+    if not missing:
+        return found
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("SELECT * FROM subscribers WHERE chat_id = ANY($1::bigint[])", missing)
+        for row in rows:
+            found[row['chat_id']] = dict(_cache_subscriber(row))
+    except Exception as e:
+        logging.error(f"Error getting {len(missing)} subscriber(s): {e}")
+    return found
+
+@timed_db
+async def upsert_subscribers(rows):
+    """
+    Creates missing subscribers and sets usernames for [(chat_id, username)] in one statement
+    (a None username keeps the old one). Raises on database errors.
+    """
+    usernames = dict(rows) # One row per chat_id; ON CONFLICT can't update a row twice
+    if not usernames:
+        return
+    pool = await get_db_pool()
+    updated = await pool.fetch("""
+        INSERT INTO subscribers (chat_id, username, updated_at)
+        SELECT chat_id, username, NOW() FROM unnest($1::bigint[], $2::text[]) AS r(chat_id, username)
+        ON CONFLICT (chat_id) DO UPDATE SET username = COALESCE(EXCLUDED.username, subscribers.username), updated_at = NOW()
+        RETURNING *;
+    """, list(usernames), list(usernames.values()))
+    for row in updated:
+        _cache_subscriber(row)
+
+@timed_db
+async def extend_subscriptions(chat_ids, seconds):
+    """
+    Makes the given chat_ids premium for `seconds` more (from now if not premium), creating
+    missing subscribers, in one statement. Returns {chat_id: subscribed_until}. Raises on
+    database errors.
+    """
+    chat_ids = list(set(chat_ids))
+    if not chat_ids:
+        return {}
+    pool = await get_db_pool()
+    rows = await pool.fetch("""
+        INSERT INTO subscribers (chat_id, status, subscribed_until, updated_at)
+        SELECT chat_id, 'premium', NOW() + make_interval(secs => $2), NOW() FROM unnest($1::bigint[]) AS r(chat_id)
+        ON CONFLICT (chat_id) DO UPDATE
+        SET status = 'premium',
+            subscribed_until = GREATEST(CASE WHEN subscribers.status = 'premium' THEN subscribers.subscribed_until END, NOW())
+                               + make_interval(secs => $2),
+            updated_at = NOW()
+        RETURNING *;
+    """, chat_ids, float(seconds))
+    logging.info(f"Extended {len(rows)} subscription(s) by {seconds / 86400:g} day(s).")
+    return {row['chat_id']: _cache_subscriber(row)['subscribed_until'] for row in rows}
+
+@timed_db
+async def add_referral(chat_id, referrals_for_trial, trial_seconds):
+    """Counts a referral for `chat_id` and grants the one-time free trial at `referrals_for_trial`. Returns True if granted."""
+    pool = await get_db_pool()
+    async with pool.acquire(timeout=DB_POOL_CHECKOUT_TIMEOUT_SECONDS) as conn:
+        async with conn.transaction():
+            row = await conn.fetchrow("""
+                INSERT INTO subscribers (chat_id, referrals, updated_at) VALUES ($1, 1, NOW())
+                ON CONFLICT (chat_id) DO UPDATE SET referrals = subscribers.referrals + 1, updated_at = NOW()
+                RETURNING *;
+            """, chat_id)
+            granted = row['referrals'] >= referrals_for_trial and not row['trial_used']
+            if granted:
+                row = await conn.fetchrow("""
+                    UPDATE subscribers
+                    SET trial_used = TRUE, status = 'premium',
+                        subscribed_until = GREATEST(CASE WHEN status = 'premium' THEN subscribed_until END, NOW())
+                                           + make_interval(secs => $2),
+                        updated_at = NOW()
+                    WHERE chat_id = $1
+                    RETURNING *;
+                """, chat_id, float(trial_seconds))
+    _cache_subscriber(row)
+    return granted
+
+def _invoice(row):
+    invoice = dict(row)
+    invoice['eth_wei'] = int(invoice['eth_wei']) if invoice['eth_wei'] is not None else None
+    invoice['created_at'] = invoice['created_at'].timestamp()
+    invoice['expires_at'] = invoice['expires_at'].timestamp()
+    return invoice
+
+@timed_db
+async def get_payment_invoice(chat_id):
+    """The subscriber's invoice (open or expired) as a dict with epoch-second times, or None."""
+    pool = await get_db_pool()
+    row = await pool.fetchrow("SELECT * FROM payment_invoices WHERE chat_id = $1;", chat_id)
+    return _invoice(row) if row else None
+
+@timed_db
+async def create_payment_invoice(chat_id, tag, usd_micro, eth_wei, sol_lamports, ttl_seconds):
+    """
+    Issues a new invoice unless the subscriber still has an open one (which is returned instead).
+    Invoices that expired more than `ttl_seconds` ago are deleted first, freeing their tags.
+    Returns None if `tag` is taken by another open invoice, so the caller can pick another.
+    """
+    pool = await get_db_pool()
+    async with pool.acquire(timeout=DB_POOL_CHECKOUT_TIMEOUT_SECONDS) as conn:
+        await conn.execute("DELETE FROM payment_invoices WHERE expires_at < NOW() - make_interval(secs => $1);",
+                           float(ttl_seconds))
+        try:
+            row = await conn.fetchrow("""
+                INSERT INTO payment_invoices (chat_id, tag, usd_micro, eth_wei, sol_lamports, expires_at)
+                VALUES ($1, $2, $3, $4, $5, NOW() + make_interval(secs => $6))
+                ON CONFLICT (chat_id) DO UPDATE
+                SET tag = EXCLUDED.tag, usd_micro = EXCLUDED.usd_micro, eth_wei = EXCLUDED.eth_wei,
+                    sol_lamports = EXCLUDED.sol_lamports, created_at = NOW(), expires_at = EXCLUDED.expires_at
+                WHERE payment_invoices.expires_at <= NOW()
+                RETURNING *;
+            """, chat_id, tag, usd_micro, eth_wei, sol_lamports, float(ttl_seconds))
+        except asyncpg.UniqueViolationError:
+            return None
+        if row is None: # Still open: keep quoting the same amounts
+            row = await conn.fetchrow("SELECT * FROM payment_invoices WHERE chat_id = $1;", chat_id)
+    return _invoice(row)
+
+@timed_db
+async def record_payment_claim(tx_hash, chat_id, chain):
+    """
+    Stores a claim of `tx_hash` by `chat_id`. Returns True if it should be verified: a new claim,
+    or the same claimant re-submitting a pending or rejected one (which is reset to 'pending').
+    Returns False if the tx was already verified for anyone (a replay). Raises on database errors
+    so the caller can ask the user to retry.
+    """
+    pool = await get_db_pool()
+    row = await pool.fetchrow("""
+        INSERT INTO payments (tx_hash, chat_id, chain)
+        SELECT $1, $2, $3 WHERE NOT EXISTS (SELECT 1 FROM payments WHERE tx_hash = $1 AND status = 'verified')
+        ON CONFLICT (tx_hash, chat_id) DO UPDATE
+        SET status = 'pending', amount_usd = NULL, reason = NULL, settled_at = NULL
+        WHERE payments.status <> 'verified'
+        RETURNING tx_hash;
+    """, tx_hash, chat_id, chain)
+    return row is not None
+
+@timed_db
+async def is_payment_verified(tx_hash):
+    """True if some claim of `tx_hash` was verified."""
+    pool = await get_db_pool()
+    return await pool.fetchval("SELECT EXISTS (SELECT 1 FROM payments WHERE tx_hash = $1 AND status = 'verified');", tx_hash)
+
+@timed_db
+async def settle_payment_claim(tx_hash, chat_id, status, amount_usd=None, reason=None):
+    """
+    Marks a pending claim 'verified' or 'rejected'; a verified claim also closes the claimant's invoice.
+    Returns 'settled' once committed, 'replay' if the tx was verified for another claim (nothing is
+    changed), or 'failed' on a database error (the claim is left pending, to be settled again).
+    """
+    try:
+        pool = await get_db_pool()
+        async with pool.acquire(timeout=DB_POOL_CHECKOUT_TIMEOUT_SECONDS) as conn:
+            async with conn.transaction():
+                result = await conn.execute("""
+                    UPDATE payments SET status = $3, amount_usd = $4, reason = $5, settled_at = NOW()
+                    WHERE tx_hash = $1 AND chat_id = $2 AND status = 'pending';
+                """, tx_hash, chat_id, status, amount_usd, reason)
+                if result == "UPDATE 0":
+                    current = await conn.fetchval("SELECT status FROM payments WHERE tx_hash = $1 AND chat_id = $2;", tx_hash, chat_id)
+                    # Already in this state: an earlier attempt committed but its reply was lost (reported 'failed').
+                    return 'settled' if current == status else 'replay'
+                if status == 'verified':
+                    await conn.execute("DELETE FROM payment_invoices WHERE chat_id = $1;", chat_id)
+        return 'settled'
+    except asyncpg.UniqueViolationError:
+        logging.warning(f"Payment tx {tx_hash} was already verified for another claim; not crediting {chat_id}.")
+        return 'replay'
+    except Exception as e:
+        logging.error(f"Error settling payment claim {tx_hash}: {e}")
+        return 'failed'
+
+@timed_db
+async def get_pending_payment_claims():
+    """Returns claims left 'pending' (e.g. by a restart) as dicts, with the claimant's username and invoice."""
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("""
+            SELECT p.tx_hash, p.chat_id, p.chain, s.username, i.chat_id AS invoice_chat_id, i.tag, i.usd_micro,
+                   i.eth_wei, i.sol_lamports, i.created_at, i.expires_at
+            FROM payments p
+            LEFT JOIN subscribers s ON s.chat_id = p.chat_id
+            LEFT JOIN payment_invoices i ON i.chat_id = p.chat_id
+            WHERE p.status = 'pending' ORDER BY p.created_at;
+        """)
+        claims = []
+        for row in rows:
+            invoice = None
+            if row['invoice_chat_id'] is not None:
+                invoice = _invoice({key: row[key] for key in ('tag', 'usd_micro', 'eth_wei', 'sol_lamports', 'created_at', 'expires_at')})
+                invoice['chat_id'] = row['chat_id']
+            claims.append({'tx_hash': row['tx_hash'], 'chat_id': row['chat_id'], 'chain': row['chain'],
+                           'username': row['username'], 'invoice': invoice})
+        return claims
+    except Exception as e:
+        logging.error(f"Error getting pending payment claims: {e}")
+        return []
+
+@timed_db
+async def set_payment_pending(chat_id, pending):
+    """
+    Flags a subscriber as awaiting payment verification (pending=True), or clears that flag
+    (pending=False). Never touches a running premium subscription.
+    """
+    try:
+        pool = await get_db_pool()
+        if pending:
+            row = await pool.fetchrow("""
+                UPDATE subscribers SET status = 'pending_payment', updated_at = NOW()
+                WHERE chat_id = $1 AND status <> 'premium'
+                RETURNING *;
+            """, chat_id)
+        else:
+            row = await pool.fetchrow("""
+                UPDATE subscribers SET status = 'free', updated_at = NOW()
+                WHERE chat_id = $1 AND status = 'pending_payment'
+                RETURNING *;
+            """, chat_id)
+        if row:
+            _cache_subscriber(row)
+    except Exception as e:
+        logging.error(f"Error updating payment status for {chat_id}: {e}")
+
+@timed_db
+async def set_alert_mode(chat_id, mode):
+    """Sets a subscriber's alert delivery mode ('realtime' or 'digest'). Returns True if the subscriber exists."""
+    try:
+        pool = await get_db_pool()
+        row = await pool.fetchrow("""
+            UPDATE subscribers SET alert_mode = $2, updated_at = NOW()
+            WHERE chat_id = $1
+            RETURNING *;
+        """, chat_id, mode)
+        if not row:
+            return False
+        _cache_subscriber(row)
+        if mode == 'digest':
+            _digest_chat_ids.add(chat_id)
+        else:
+            _digest_chat_ids.discard(chat_id)
+        logging.info(f"Alert mode for {chat_id} set to '{mode}'.")
+        return True
+    except Exception as e:
+        logging.error(f"Error setting alert mode for {chat_id}: {e}")
+        return False
+
+@timed_db
+async def get_digest_subscribers():
+    """Returns the set of chat_ids that chose digest delivery (cached, resynced like the premium set)."""
+    global _digest_chat_ids, _digest_loaded_at
+    if _digest_loaded_at is not None and time.monotonic() - _digest_loaded_at < ACTIVE_SET_RESYNC_SECONDS:
+        return _digest_chat_ids
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("SELECT chat_id FROM subscribers WHERE alert_mode = 'digest';")
+        _digest_chat_ids = {row['chat_id'] for row in rows}
+        _digest_loaded_at = time.monotonic()
+    except Exception as e:
+        logging.error(f"Error getting digest subscribers: {e}")
+    return _digest_chat_ids
+
+# --- Alert outbox ---
+
+ALERT_OUTBOX_CHANNEL = 'alert_outbox' # NOTIFY channel; lets delivery workers in other processes wake up at once
+
+@timed_db
+async def enqueue_alerts(kind, messages, chat_ids, block_timestamp=None, shards=None):
+    """
+    Stores rendered alert messages plus a pending delivery per (message, recipient) in one
+    statement and notifies ALERT_OUTBOX_CHANNEL. `shards` runs parallel to `chat_ids` (all 0
+    if omitted). Returns the number of deliveries queued. Raises on database errors so the
+    caller can fall back to sending directly.
+    """
+    if not messages or not chat_ids:
+        return 0
+    shards = list(shards) if shards is not None else [0] * len(chat_ids)
+    pool = await get_db_pool()
+    return await pool.fetchval("""
+        WITH new_messages AS (
+            INSERT INTO alert_messages (kind, body, block_timestamp)
+            SELECT $1, body, $3 FROM unnest($2::text[]) WITH ORDINALITY AS m(body, position) ORDER BY position
+            RETURNING id
+        ), new_deliveries AS (
+            INSERT INTO alert_deliveries (message_id, chat_id, shard)
+            SELECT new_messages.id, r.chat_id, r.shard
+            FROM new_messages CROSS JOIN unnest($4::bigint[], $5::int[]) AS r(chat_id, shard)
+            RETURNING 1
+        )
+        SELECT COUNT(*) FROM new_deliveries, (SELECT pg_notify($6, '')) AS notified;
+    """, kind, list(messages), block_timestamp, list(chat_ids), shards, ALERT_OUTBOX_CHANNEL)
+
+@timed_db
+async def claim_alert_deliveries(limit, lease_seconds, shards=None):
+    """
+    Claims up to `limit` due deliveries (oldest message first) for this worker, only from
+    `shards` if given. Concurrent workers skip each other's locked rows, and a claim pushes
+    next_attempt_at out by `lease_seconds`, so rows held by a crashed worker become due again
+    once the lease ends.
+    """
+    if shards is not None and not shards:
+        return []
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("""
+            WITH due AS (
+                SELECT message_id, chat_id FROM alert_deliveries
+                WHERE status = 'pending' AND next_attempt_at <= NOW() AND ($3::int[] IS NULL OR shard = ANY($3::int[]))
+                ORDER BY message_id, chat_id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE alert_deliveries d
+            SET attempts = d.attempts + 1, next_attempt_at = NOW() + make_interval(secs => $2), updated_at = NOW()
+            FROM due, alert_messages m
+            WHERE d.message_id = due.message_id AND d.chat_id = due.chat_id AND m.id = d.message_id
+            RETURNING d.message_id, d.chat_id, d.attempts, m.kind, m.body, m.block_timestamp;
+        """, limit, float(lease_seconds), list(shards) if shards is not None else None)
+        return sorted((dict(row) for row in rows), key=lambda row: (row['message_id'], row['chat_id']))
+    except Exception as e:
+        logging.error(f"Error claiming alert deliveries: {e}")
+        return []
+
+@timed_db
+async def complete_alert_deliveries(results, max_attempts, retry_base_seconds, retry_max_seconds):
+    """
+    Records [(message_id, chat_id, outcome)] in one statement. 'failed' deliveries go back to
+    'pending' with exponential backoff until they have used `max_attempts`.
+    """
+    if not results:
+        return
+    message_ids, chat_ids, outcomes = zip(*results)
+    try:
+        pool = await get_db_pool()
+        await pool.execute("""
+            UPDATE alert_deliveries d
+            SET status = CASE WHEN r.outcome = 'failed' AND d.attempts < $4 THEN 'pending' ELSE r.outcome END,
+                next_attempt_at = NOW() + make_interval(secs => LEAST($6, $5 * power(2, d.attempts - 1))),
+                updated_at = NOW()
+            FROM unnest($1::bigint[], $2::bigint[], $3::text[]) AS r(message_id, chat_id, outcome)
+            WHERE d.message_id = r.message_id AND d.chat_id = r.chat_id;
+        """, list(message_ids), list(chat_ids), list(outcomes), max_attempts, float(retry_base_seconds), float(retry_max_seconds))
+    except Exception as e:
+        logging.error(f"Error recording {len(results)} alert delivery outcome(s): {e}")
+
+@timed_db
+async def get_alert_outbox_backlog():
+    """Returns {'pending': n, 'oldest_pending_seconds': age} for the outbox."""
+    try:
+        pool = await get_db_pool()
+        row = await pool.fetchrow("""
+            SELECT COUNT(*) AS pending,
+                   COALESCE(EXTRACT(EPOCH FROM NOW() - MIN(m.created_at)), 0)::float AS oldest_pending_seconds
+            FROM alert_deliveries d JOIN alert_messages m ON m.id = d.message_id
+            WHERE d.status = 'pending';
+        """)
+        return dict(row)
+    except Exception as e:
+        logging.error(f"Error reading alert outbox backlog: {e}")
+        return {}
+
+@timed_db
+async def purge_alert_outbox(older_than_seconds):
+    """Deletes fully settled messages (and their deliveries) older than `older_than_seconds`. Returns the count."""
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("""
+            DELETE FROM alert_messages m
+            WHERE m.created_at < NOW() - make_interval(secs => $1)
+              AND NOT EXISTS (SELECT 1 FROM alert_deliveries d WHERE d.message_id = m.id AND d.status = 'pending')
+            RETURNING m.id;
+        """, float(older_than_seconds))
+        return len(rows)
+    except Exception as e:
+        logging.error(f"Error purging alert outbox: {e}")
+        return 0
+
+# --- Cluster membership ---
+
+async def open_session():
+    """
+    Opens a dedicated connection outside the pool, for session-scoped state (advisory locks,
+    LISTEN). Needs a direct or session-mode connection; pgbouncer in transaction mode breaks both.
+    """
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL is required for database operations.")
+    return await asyncpg.connect(DATABASE_URL, command_timeout=DB_COMMAND_TIMEOUT_SECONDS)
+
+@timed_db
+async def try_advisory_lock(conn, key):
+    """Takes session-level advisory lock `key` on `conn` if nobody holds it. Returns True if this session now holds it."""
+    return await conn.fetchval("SELECT pg_try_advisory_lock($1)", key)
+
+@timed_db
+async def heartbeat_cluster_member(worker_id, owned_shards, is_leader, ttl_seconds):
+    """
+    Records a heartbeat for `worker_id` and returns the sorted ids of every live member
+    (heartbeat within `ttl_seconds`), this one included. Raises on database errors.
+    """
+    pool = await get_db_pool()
+    rows = await pool.fetch("""
+        WITH me AS (
+            INSERT INTO cluster_members (worker_id, owned_shards, is_leader, heartbeat_at)
+            VALUES ($1, $2, $3, NOW())
+            ON CONFLICT (worker_id) DO UPDATE
+            SET owned_shards = EXCLUDED.owned_shards, is_leader = EXCLUDED.is_leader, heartbeat_at = NOW()
+            RETURNING worker_id
+        )
+        SELECT worker_id FROM cluster_members WHERE heartbeat_at > NOW() - make_interval(secs => $4)
+        UNION SELECT worker_id FROM me
+        ORDER BY worker_id;
+    """, worker_id, owned_shards, is_leader, float(ttl_seconds))
+    return [row['worker_id'] for row in rows]
+
+@timed_db
+async def remove_cluster_member(worker_id):
+    """Deletes a member on clean shutdown, so the others take over its shards at their next heartbeat."""
+    try:
+        pool = await get_db_pool()
+        await pool.execute("DELETE FROM cluster_members WHERE worker_id = $1;", worker_id)
+    except Exception as e:
+        logging.error(f"Error removing cluster member {worker_id}: {e}")
+
+@timed_db
+async def prune_cluster_members(older_than_seconds):
+    """Deletes members whose last heartbeat is older than `older_than_seconds`. Returns their ids."""
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch("""
+            DELETE FROM cluster_members WHERE heartbeat_at < NOW() - make_interval(secs => $1)
+            RETURNING worker_id;
+        """, float(older_than_seconds))
+        return [row['worker_id'] for row in rows]
+    except Exception as e:
+        logging.error(f"Error pruning cluster members: {e}")
+        return []
+
+# --- Shared scan state (cluster mode) ---
+
+@timed_db
+async def load_scanner_checkpoint(source):
+    """Returns {'last_processed_block', 'block_hash'} for a scan source, or None. Raises on database errors."""
+    pool = await get_db_pool()
+    row = await pool.fetchrow("SELECT last_processed_block, block_hash FROM scanner_checkpoints WHERE source = $1;", source)
+    return dict(row) if row else None
+
+@timed_db
+async def save_scanner_checkpoint(source, block_number, block_hash):
+    """Raises on database errors, like a failed checkpoint file write."""
+    pool = await get_db_pool()
+    await pool.execute("""
+        INSERT INTO scanner_checkpoints (source, last_processed_block, block_hash, updated_at)
+        VALUES ($1, $2, $3, NOW())
+        ON CONFLICT (source) DO UPDATE
+        SET last_processed_block = EXCLUDED.last_processed_block, block_hash = EXCLUDED.block_hash, updated_at = NOW();
+    """, source, block_number, block_hash)
+
+@timed_db
+async def get_seen_pool_keys(keys):
+    """Returns the subset of `keys` already in seen_pools. Raises on database errors."""
+    pool = await get_db_pool()
+    rows = await pool.fetch("SELECT pool_key FROM seen_pools WHERE pool_key = ANY($1::text[]);", list(keys))
+    return {row['pool_key'] for row in rows}
+
+@timed_db
+async def add_seen_pools(entries):
+    """Inserts (pool_key, block_number) pairs in one statement. Returns how many were new; raises on database errors."""
+    pool = await get_db_pool()
+    keys = [key for key, _ in entries]
+    blocks = [block for _, block in entries]
+    rows = await pool.fetch("""
+        INSERT INTO seen_pools (pool_key, block_number)
+        SELECT * FROM unnest($1::text[], $2::bigint[])
+        ON CONFLICT (pool_key) DO NOTHING
+        RETURNING pool_key;
+    """, keys, blocks)
+    return len(rows)
+
+@timed_db
+async def count_seen_pools():
+    pool = await get_db_pool()
+    return await pool.fetchval("SELECT COUNT(*) FROM seen_pools;")
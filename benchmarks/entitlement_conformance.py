@@ -0,0 +1,281 @@
+# benchmarks/entitlement_conformance.py
+# Consistency checks for entitlements.EntitlementCache: the cache on its own (LRU bound, TTL, active set,
+# expiry heap), a randomized run against a plain-dict model, and both data layers, whose cached answers
+# must match what a fresh query of the table says after every write.
+#
+#   python -m benchmarks.entitlement_conformance                                  # cache + SQLite (temp file)
+#   python -m benchmarks.entitlement_conformance --database-url postgresql://localhost/icebench
+#
+# WARNING: rows for the test chat ids (980000001...) are deleted from the given Postgres database.
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+
+from benchmarks.store_conformance import ConformanceError, expect
+
+FIRST_CHAT_ID = 980_000_001
+
+# --- The cache on its own ---
+
+def check_cache():
+    """Deterministic checks of one EntitlementCache. Returns the names of the checks passed."""
+    from entitlements import EntitlementCache
+    passed = []
+    now = time.time()
+
+    cache = EntitlementCache(max_entries=100, ttl=60)
+    expect(cache.get(1) is None and cache.is_premium(1) is None, "unknown users are a miss, not a 'free' answer")
+    cache.put(1, 'premium', now + 100, record={'chat_id': 1})
+    cache.put(2, 'free', None)
+    cache.put(3, 'premium', now - 1) # Ended but not swept yet
+    cache.put(4, 'pending_payment', now + 100)
+    expect(cache.is_premium(1) is True and cache.get(1)['record'] == {'chat_id': 1}, "a premium put is read back")
+    expect(cache.is_premium(2) is False and cache.is_premium(3) is False, "free and ended users are not premium")
+    expect(cache.is_premium(4) is False, "only status 'premium' counts, whatever the expiry")
+    expect(cache.is_premium(1, now=now + 101) is False, "premium ends at the precomputed expiry")
+    expect(sorted(cache.active_ids()) == [1], f"only running premium users are active, got {cache.active_ids()}")
+    passed.append('put/get')
+
+    cache.put(1, 'free', None)
+    expect(cache.is_premium(1) is False and cache.active_ids() == [], "a downgrade leaves the active set at once")
+    cache.put(1, 'premium', now + 100)
+    cache.invalidate(1)
+    expect(cache.get(1) is None, "invalidate() forgets the entry")
+    expect(cache.active_ids() == [1], "invalidate() keeps the active set (only put()/expire() change it)")
+    cache.expire([1, 99])
+    expect(cache.get(1) is None and cache.active_ids() == [], "expire() drops the entry and the active membership")
+    passed.append('writes')
+
+    cache.put(5, 'premium', now + 10)
+    cache.put(5, 'premium', now + 50) # Renewal: the (now + 10) heap entry is superseded
+    cache.put(6, 'premium', now + 20)
+    expect(sorted(cache.active_ids(now=now + 15)) == [5, 6], "a superseded expiry does not remove a renewed user")
+    expect(cache.active_ids(now=now + 30) == [5], "users drop out of the active set as their expiry passes")
+    expect(cache.active_ids(now=now + 60) == [], "the active set empties once every expiry has passed")
+    passed.append('expiry heap')
+
+    cache.load_active({7: now + 100, 8: now + 5})
+    expect(cache.active_loaded() and cache.active_loaded(max_age=60), "load_active() marks the set loaded")
+    expect(not cache.active_loaded(max_age=0), "an old load is reported stale")
+    expect(sorted(cache.active_ids(now=now + 1)) == [7, 8], "load_active() replaces the active set")
+    expect(cache.active_ids(now=now + 10) == [7], "loaded expiries are honoured")
+    cache.put(9, 'premium', now + 100)
+    cache.expire([7])
+    expect(cache.active_ids() == [9], "writes after a load keep the set current without a reload")
+    passed.append('active set')
+
+    for user_id in range(1000, 1500):
+        cache.put(user_id, 'premium', now + 1000)
+    stats = cache.stats()
+    expect(stats['entries'] == 100, f"the per-user map is capped at max_entries, holds {stats['entries']}")
+    expect(cache.get(1000) is None and cache.get(1499) is not None, "the least recently used entries go first")
+    expect(stats['active'] == 501, f"evicting an entry keeps its active membership, active = {stats['active']}")
+    cache.get(1400)
+    cache.put(2000, 'free', None)
+    expect(cache.get(1400) is not None and cache.get(1401) is None, "a read refreshes an entry's LRU position")
+    passed.append('lru bound')
+
+    for _ in range(20):
+        for user_id in range(1000, 1500):
+            cache.put(user_id, 'premium', now + 1000 + random.random()) # Renewals pile up superseded heap entries
+        cache.active_ids()
+    expect(len(cache._expiry_heap) <= 2 * len(cache._active) + 1024,
+           f"superseded heap entries are compacted, heap holds {len(cache._expiry_heap)}")
+    passed.append('heap bound')
+
+    short = EntitlementCache(max_entries=10, ttl=0.2)
+    short.put(1, 'premium', now + 100)
+    time.sleep(0.3)
+    expect(short.get(1) is None, "entries older than the TTL are re-read")
+    expect(short.active_ids() == [1], "the TTL only bounds per-user staleness, not the active set")
+    expect(short.stats()['misses'] == 1, "a TTL miss is counted")
+    passed.append('ttl')
+    return passed
+
+def check_model(operations, seed):
+    """Random puts/invalidates/expires/clock steps against a dict model; every answer must agree."""
+    from entitlements import EntitlementCache
+    rng = random.Random(seed)
+    cache = EntitlementCache(max_entries=64, ttl=3600)
+    model = {} # user_id -> (status, expires_at)
+    clock = time.time()
+    for step in range(operations):
+        clock += rng.random() * 5 # Only moves forward, like the wall clock active_ids() prunes against
+        user_id = rng.randrange(200)
+        action = rng.random()
+        if action < 0.5:
+            status = rng.choice(['premium', 'premium', 'free', 'pending_payment'])
+            expires_at = clock + rng.uniform(-50, 500) if status != 'free' else None
+            cache.put(user_id, status, expires_at)
+            model[user_id] = (status, expires_at)
+        elif action < 0.6:
+            cache.invalidate(user_id)
+        elif action < 0.75:
+            user_ids = rng.sample(range(200), rng.randrange(1, 10))
+            cache.expire(user_ids)
+            for expired in user_ids:
+                model[expired] = ('free', None)
+        for probe in (user_id, rng.randrange(200)):
+            answer = cache.is_premium(probe, now=clock)
+            status, expires_at = model.get(probe, ('free', None))
+            truth = status == 'premium' and expires_at is not None and expires_at > clock
+            expect(answer is None or answer == truth, f"step {step}: is_premium({probe}) = {answer}, model says {truth}")
+        if step % 10 == 0:
+            active = sorted(cache.active_ids(now=clock))
+            truth = sorted(uid for uid, (status, expires_at) in model.items()
+                           if status == 'premium' and expires_at is not None and expires_at > clock)
+            expect(active == truth, f"step {step}: active set {active[:10]}... differs from the model {truth[:10]}...")
+        expect(cache.stats()['entries'] <= 64, f"step {step}: the LRU grew past max_entries")
+    return {'operations': operations, 'seed': seed, 'stats': cache.stats()}
+
+# --- SQLite data layer (database.py) ---
+
+def check_sqlite(users):
+    """After each write, check_vip() (cached) must agree with a fresh SELECT."""
+    import database
+    database.init_db()
+    conn = database.get_connection()
+
+    def agree(label, user_ids):
+        now = int(time.time())
+        for user_id in user_ids:
+            row = conn.execute("SELECT expires_at FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            truth = bool(row and row[0] is not None and row[0] > now)
+            expect(database.check_vip(user_id) == truth, f"{label}: check_vip({user_id}) disagrees with the table")
+
+    user_ids = list(range(1, users + 1))
+    agree('unknown users', user_ids) # Also caches every user as 'free'
+    for user_id in user_ids[::2]:
+        database.add_sub(user_id, 24)
+    agree('add_sub', user_ids)
+    for _ in range(database.REFERRALS_FOR_TRIAL):
+        database.do_referral(user_ids[1])
+    agree('referral trial', user_ids)
+    database.extend_users(user_ids[:10], 3600)
+    agree('extend_users', user_ids)
+    ending = [users + 1, users + 2] # New users, so nothing running is stacked on top of the short grants
+    user_ids += ending
+    database.add_sub(ending[0], 2 / 3600) # Ends in two seconds
+    database.extend_users([ending[1]], 2)
+    agree('short grants', user_ids)
+    time.sleep(2.5)
+    agree('ended before the sweep', user_ids)
+    expired = database.expire_users()
+    expect(sorted(expired) == ending, f"expire_users() should clear exactly the ended grants, got {expired}")
+    agree('after expire_users', user_ids)
+    database.add_sub(ending[0], 1)
+    agree('re-subscribe after expiry', user_ids)
+    return ['unknown users', 'add_sub', 'referral trial', 'extend_users', 'expiry']
+
+# --- Postgres data layer (async_db_manager.py) ---
+
+async def check_postgres(users):
+    """After each write, the cached subscriber rows and active set must match the table."""
+    import async_db_manager as db
+    await db.initialize_db()
+    pool = await db.get_db_pool()
+    chat_ids = list(range(FIRST_CHAT_ID, FIRST_CHAT_ID + users))
+    await pool.execute("DELETE FROM subscribers WHERE chat_id = ANY($1::bigint[])", chat_ids)
+    for chat_id in chat_ids:
+        db.entitlements.invalidate(chat_id)
+    db.entitlements.expire(chat_ids)
+
+    async def agree(label):
+        rows = {row['chat_id']: dict(row) for row in
+                await pool.fetch("SELECT * FROM subscribers WHERE chat_id = ANY($1::bigint[])", chat_ids)}
+        for chat_id in chat_ids:
+            cached = await db.get_subscriber(chat_id)
+            truth = rows.get(chat_id)
+            if truth is None:
+                expect(cached is None, f"{label}: get_subscriber({chat_id}) returned a row the table doesn't have")
+                continue
+            expect(cached is not None and (cached['status'], cached['subscribed_until']) ==
+                   (truth['status'], truth['subscribed_until']),
+                   f"{label}: get_subscriber({chat_id}) = {cached and cached['status']}, table has {truth['status']}")
+        active = set(await db.get_active_premium_subscribers()) & set(chat_ids)
+        truth = {row['chat_id'] for row in await pool.fetch("""
+            SELECT chat_id FROM subscribers WHERE chat_id = ANY($1::bigint[])
+            AND status = 'premium' AND subscribed_until > NOW()""", chat_ids)}
+        expect(active == truth, f"{label}: active set has {sorted(active - truth)} extra, {sorted(truth - active)} missing")
+
+    await db.get_active_premium_subscribers() # Load the active set once; every check after this is served from it
+    await agree('unknown users')
+    for chat_id in chat_ids:
+        await db.create_or_update_subscriber(chat_id, f"user{chat_id}")
+    await agree('create_or_update_subscriber')
+    for chat_id in chat_ids[::2]:
+        await db.update_subscription_status(chat_id, 'premium', duration_days=30, tx_hash=f"0x{chat_id:064x}")
+    await agree('upgrade')
+    await db.update_subscription_status(chat_ids[0], 'premium', duration_days=30)
+    await db.update_subscription_status(chat_ids[2], 'free')
+    await db.update_subscription_status(chat_ids[4], 'pending_payment')
+    await db.update_subscription_status(chat_ids[1], 'pending_payment')
+    await agree('renew, downgrade and pending')
+
+    # Ends in two seconds; written out of band, so a read has to refresh the cache like any other read would
+    ending = [chat_ids[6], chat_ids[8]] # Both premium
+    await pool.execute("UPDATE subscribers SET subscribed_until = NOW() + interval '2 seconds' WHERE chat_id = ANY($1::bigint[])", ending)
+    for chat_id in ending:
+        db.entitlements.invalidate(chat_id)
+    await agree('short grants')
+    await asyncio.sleep(2.5)
+    await agree('ended before the sweep')
+    expired = await db.expire_subscriptions(ending + [chat_ids[12]])
+    expect(sorted(expired) == ending, f"expire_subscriptions() should only downgrade ended rows, got {expired}")
+    await agree('after expire_subscriptions')
+    await pool.execute("UPDATE subscribers SET subscribed_until = NOW() - interval '1 second' WHERE chat_id = $1", chat_ids[10])
+    db.entitlements.invalidate(chat_ids[10])
+    await db.get_subscriber(chat_ids[10])
+    expect(chat_ids[10] in await db.expire_due_subscriptions(), "expire_due_subscriptions() missed an ended row")
+    await agree('after expire_due_subscriptions')
+    stats = db.entitlements.stats()
+    await pool.execute("DELETE FROM subscribers WHERE chat_id = ANY($1::bigint[])", chat_ids)
+    db.entitlements.expire(chat_ids)
+    await db.close_db_pool()
+    return {'passed': ['unknown users', 'create_or_update_subscriber', 'upgrade', 'renew, downgrade and pending', 'expiry'],
+            'stats': stats}
+
+# --- Runner ---
+
+def run(args):
+    results = {'cache': check_cache(), 'model': check_model(args.operations, args.seed), 'sqlite': check_sqlite(args.users)}
+    if args.database_url:
+        results['postgres'] = asyncio.run(check_postgres(args.users))
+    else:
+        logging.warning("No --database-url given; skipping the Postgres data layer.")
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url', help="Postgres with the bot's schema (test chat ids are deleted)")
+    parser.add_argument('--sqlite-path', help="SQLite file (default: a new temp file)")
+    parser.add_argument('--users', type=int, default=20, help="Users written through each data layer")
+    parser.add_argument('--operations', type=int, default=20_000, help="Random operations in the model check")
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    # Both data layers read their settings at import, so set them before anything imports them
+    os.environ['SQLITE_DB_PATH'] = args.sqlite_path or os.path.join(tempfile.mkdtemp(prefix="iceentitle-"), "store.db")
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        results = run(args)
+    except ConformanceError as e:
+        print(f"Conformance check failed: {e}")
+        return 1
+    print(json.dumps(results, indent=2, sort_keys=True))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
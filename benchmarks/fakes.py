@@ -0,0 +1,345 @@
+# benchmarks/fakes.py
+# Local stand-ins for the Telegram Bot API, an Ethereum JSON-RPC node and DexScreener,
+# so the bot can be benchmarked with no network access and no real users.
+
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import deque, Counter
+from urllib.parse import parse_qsl
+from aiohttp import web
+from eth_abi import encode, decode
+
+PAIR_CREATED_TOPIC = "0x0d3648bd0f6ba80134a33ba9275ac585d9d315f0ad8355cddefde31afa28d0e9"
+AGGREGATE3_SELECTOR = "82ad56cb"
+WETH_ADDRESS = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
+SELECTOR_SYMBOL, SELECTOR_NAME, SELECTOR_DECIMALS = "95d89b41", "06fdde03", "313ce567"
+SELECTOR_BALANCE_OF, SELECTOR_OWNER, SELECTOR_TOTAL_SUPPLY = "70a08231", "8da5cb5b", "18160ddd"
+
+def _address(*parts):
+    return "0x" + hashlib.sha256(":".join(map(str, parts)).encode()).hexdigest()[:40]
+
+def _hash(*parts):
+    return "0x" + hashlib.sha256(":".join(map(str, parts)).encode()).hexdigest()
+
+class BackgroundServer:
+    """Runs an aiohttp app on its own event loop in a daemon thread (so fakes don't compete with the bot's loop)."""
+
+    def __init__(self, app, host='127.0.0.1', port=0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        runner = web.AppRunner(self.app, access_log=None)
+        self._loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        host, port = runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+        self._started.wait(10)
+        return self.url
+
+    def run_coroutine(self, coro):
+        """Schedules `coro` on the server's loop from another thread; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+# --- Fake Telegram Bot API (+ DexScreener boosts feed) ---
+
+class FakeTelegram:
+    """
+    Answers /bot<token>/<method> like api.telegram.org. sendMessage takes `latency` (+/- jitter)
+    seconds, returns 429 with retry_after once more than `rate_limit` messages arrived in the
+    last second (or at random with `error_429_probability`), and 403s chats in the blocked percentile.
+    """
+
+    def __init__(self, latency=0.04, jitter=0.02, rate_limit=30, per_chat_rate_limit=0, error_429_probability=0.0,
+                 blocked_percent=0, boosts=50, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.per_chat_rate_limit = per_chat_rate_limit
+        self.error_429_probability = error_429_probability
+        self.blocked_percent = blocked_percent
+        self.boosts = [{'url': f"https://dexscreener.com/ethereum/{_address('boost', i)}", 'chainId': 'ethereum',
+                        'tokenAddress': _address('boost', i), 'header': f"BENCH{i}", 'amount': 10, 'totalAmount': 100}
+                       for i in range(boosts)]
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.deliveries = [] # (received_at, chat_id, text)
+        self.updates = [] # Served to getUpdates until acknowledged through its offset
+        self.responses = Counter()
+        self._recent = deque()
+        self._last_per_chat = {}
+        self._message_id = 0
+
+    def app(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self._handle)
+        app.router.add_get('/dexscreener/token-boosts/latest/v1', self._boosts)
+        return app
+
+    async def _params(self, request):
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            elif request.method == 'GET': # post() ignores GET bodies; telebot sends getUpdates that way
+                params.update(parse_qsl(await request.text()))
+            else:
+                params.update({k: v for k, v in (await request.post()).items() if isinstance(v, str)})
+        return params
+
+    def _reply(self, status, result=None, description=None, retry_after=None):
+        self.responses[status] += 1
+        if status == 200:
+            return web.json_response({'ok': True, 'result': result})
+        body = {'ok': False, 'error_code': status, 'description': description}
+        if retry_after is not None:
+            body['parameters'] = {'retry_after': retry_after}
+        return web.json_response(body, status=status)
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = await self._params(request)
+        if method == 'getMe':
+            return self._reply(200, {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'})
+        if method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            if not self.updates:
+                await asyncio.sleep(min(float(params.get('timeout') or 0), 0.1)) # Short long-poll so queued updates go out fast
+            return self._reply(200, self.updates)
+        if method != 'sendMessage':
+            return self._reply(200, True)
+
+        chat_id = int(params.get('chat_id', 0))
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 1:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit or self.random.random() < self.error_429_probability:
+            return self._reply(429, description="Too Many Requests: retry after 1", retry_after=1)
+        if self.per_chat_rate_limit and now - self._last_per_chat.get(chat_id, -1e9) < 1 / self.per_chat_rate_limit:
+            return self._reply(429, description="Too Many Requests: retry after 1", retry_after=1)
+        if abs(chat_id) % 100 < self.blocked_percent:
+            return self._reply(403, description="Forbidden: bot was blocked by the user")
+        self._recent.append(now)
+        self._last_per_chat[chat_id] = now
+
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        self._message_id += 1
+        text = params.get('text', '')
+        self.deliveries.append((time.time(), chat_id, text))
+        return self._reply(200, {'message_id': self._message_id, 'date': int(time.time()),
+                                 'chat': {'id': chat_id, 'type': 'private'}, 'text': text})
+
+    async def _boosts(self, request):
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        return web.json_response(self.boosts)
+
+# --- Fake Ethereum JSON-RPC node ---
+
+class FakeEthNode:
+    """
+    A chain that mines one block every `block_time` seconds (wall clock) and emits
+    `pools_per_block` synthetic Uniswap V2 PairCreated logs per block. Supports what the
+    scanner, token resolver and scorer use: eth_blockNumber, eth_getBlockByNumber, eth_getLogs,
+    eth_getTransactionByHash, eth_getTransactionCount, eth_call to Multicall3 aggregate3 (token
+    metadata plus seeded-random balances/owners/supplies), plus JSON-RPC batches. `/ws` accepts eth_subscribe
+    ('newHeads' or 'logs') and pushes notifications as blocks are mined; `drop_ws_connections()`
+    kills every socket to exercise reconnect/backfill.
+    """
+
+    def __init__(self, block_time=2.0, pools_per_block=2, weth_ratio=0.3, start_block=19_000_000,
+                 factory="0x5c69bee701ef814a2b6a3edd4b1652cb9cc5aa6f", latency=0.0):
+        self.block_time = block_time
+        self.pools_per_block = pools_per_block
+        self.weth_ratio = weth_ratio
+        self.start_block = start_block
+        self.factory = factory.lower()
+        self.latency = latency
+        self.genesis = time.time()
+        self.calls = Counter()
+        self.pair_timestamps = {} # pair address (lower) -> block timestamp, for end-to-end latency
+        self._sockets = set()
+
+    @property
+    def head(self):
+        return self.start_block + int((time.time() - self.genesis) / self.block_time)
+
+    def block_timestamp(self, number):
+        return int(self.genesis + (number - self.start_block) * self.block_time)
+
+    def logs_for_block(self, number):
+        rng = random.Random(number)
+        logs = []
+        for i in range(self.pools_per_block):
+            token0 = WETH_ADDRESS if rng.random() < self.weth_ratio else _address('token', number, i, 0)
+            token1 = _address('token', number, i, 1)
+            pair = _address('pair', number, i)
+            self.pair_timestamps[pair] = self.block_timestamp(number)
+            logs.append({
+                'address': self.factory,
+                'topics': [PAIR_CREATED_TOPIC, "0x" + "00" * 12 + token0[2:], "0x" + "00" * 12 + token1[2:]],
+                'data': "0x" + "00" * 12 + pair[2:] + (number * 10 + i).to_bytes(32, 'big').hex(),
+                'blockNumber': hex(number),
+                'blockHash': _hash('block', number),
+                'transactionHash': _hash('tx', number, i),
+                'transactionIndex': hex(i),
+                'logIndex': hex(i),
+                'removed': False,
+            })
+        return logs
+
+    def _block(self, number):
+        return {
+            'number': hex(number), 'hash': _hash('block', number), 'parentHash': _hash('block', number - 1),
+            'timestamp': hex(self.block_timestamp(number)), 'miner': "0x" + "00" * 20,
+            'gasLimit': hex(30_000_000), 'gasUsed': hex(0), 'transactions': [], 'uncles': [],
+            'difficulty': '0x0', 'extraData': '0x', 'size': hex(1000), 'nonce': '0x' + '00' * 8,
+            'logsBloom': '0x' + '00' * 256, 'sha3Uncles': _hash('uncles'), 'stateRoot': _hash('state', number),
+            'transactionsRoot': _hash('txs', number), 'receiptsRoot': _hash('receipts', number),
+            'baseFeePerGas': hex(10 ** 9),
+        }
+
+    def _token_call(self, target, calldata):
+        selector = calldata[:4].hex()
+        if selector == SELECTOR_SYMBOL:
+            return encode(['string'], ["B" + target[2:6].upper()])
+        if selector == SELECTOR_NAME:
+            return encode(['string'], [f"Bench Token {target[2:8]}"])
+        if selector == SELECTOR_DECIMALS:
+            return encode(['uint8'], [18])
+        rng = random.Random(target + calldata.hex()) # Same answer every time for the same call
+        if selector == SELECTOR_TOTAL_SUPPLY:
+            return encode(['uint256'], [10 ** 24])
+        if selector == SELECTOR_BALANCE_OF:
+            return encode(['uint256'], [int(rng.random() ** 3 * 10 ** 20)]) # 0-100 ETH of pool liquidity, skewed low
+        if selector == SELECTOR_OWNER:
+            return encode(['address'], ["0x" + "00" * 20 if rng.random() < 0.4 else _address('owner', target)])
+        return None
+
+    def _eth_call(self, tx):
+        data = bytes.fromhex(tx['data'][2:])
+        if data[:4].hex() == AGGREGATE3_SELECTOR:
+            calls = decode(['(address,bool,bytes)[]'], data[4:])[0]
+            results = []
+            for target, _, calldata in calls:
+                output = self._token_call(target.lower(), calldata)
+                results.append((output is not None, output or b""))
+            return "0x" + encode(['(bool,bytes)[]'], [results]).hex()
+        output = self._token_call(tx['to'].lower(), data)
+        if output is None:
+            raise ValueError("execution reverted")
+        return "0x" + output.hex()
+
+    def _dispatch(self, method, params):
+        self.calls[method] += 1
+        if method == 'web3_clientVersion':
+            return "FakeEthNode/v1"
+        if method == 'eth_chainId':
+            return "0x1"
+        if method == 'net_version':
+            return "1"
+        if method == 'eth_blockNumber':
+            return hex(self.head)
+        if method == 'eth_getBlockByNumber':
+            tag = params[0]
+            number = self.head if tag in ('latest', 'safe', 'finalized', 'pending') else int(tag, 16)
+            return self._block(number) if number <= self.head else None
+        if method == 'eth_getLogs':
+            query = params[0]
+            topic0 = (query.get('topics') or [None])[0]
+            if topic0 is not None and PAIR_CREATED_TOPIC not in (topic0 if isinstance(topic0, list) else [topic0]):
+                return [] # Only PairCreated logs exist on the fake chain
+            from_block = int(query['fromBlock'], 16)
+            to_block = min(int(query['toBlock'], 16), self.head)
+            logs = []
+            for number in range(from_block, to_block + 1):
+                logs.extend(self.logs_for_block(number))
+            return logs
+        if method == 'eth_getTransactionByHash':
+            return {'hash': params[0], 'from': _address('deployer', params[0][:8]), 'nonce': '0x0'} # Few deployers, many pools
+        if method == 'eth_getTransactionCount':
+            return hex(random.Random(params[0]).randrange(0, 500))
+        if method == 'eth_call':
+            return self._eth_call(params[0])
+        raise NotImplementedError(method)
+
+    def _answer(self, item):
+        try:
+            return {'jsonrpc': '2.0', 'id': item.get('id'), 'result': self._dispatch(item['method'], item.get('params', []))}
+        except NotImplementedError as e:
+            return {'jsonrpc': '2.0', 'id': item.get('id'), 'error': {'code': -32601, 'message': f"method not found: {e}"}}
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': item.get('id'), 'error': {'code': -32000, 'message': str(e)}}
+
+    async def _push_subscription(self, ws, subscription_id, kind):
+        last = self.head
+        while not ws.closed:
+            await asyncio.sleep(min(0.05, self.block_time / 10))
+            head = self.head
+            for number in range(last + 1, head + 1):
+                items = [self._block(number)] if kind == 'newHeads' else self.logs_for_block(number)
+                for item in items:
+                    await ws.send_json({'jsonrpc': '2.0', 'method': 'eth_subscription',
+                                        'params': {'subscription': subscription_id, 'result': item}})
+            last = head
+
+    async def _websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._sockets.add(ws)
+        pushers = []
+        try:
+            async for msg in ws:
+                item = json.loads(msg.data)
+                if item.get('method') == 'eth_subscribe':
+                    self.calls['eth_subscribe'] += 1
+                    subscription_id = hex(random.getrandbits(64))
+                    await ws.send_json({'jsonrpc': '2.0', 'id': item.get('id'), 'result': subscription_id})
+                    pushers.append(asyncio.ensure_future(self._push_subscription(ws, subscription_id, item['params'][0])))
+                else:
+                    await ws.send_json(self._answer(item))
+        finally:
+            for task in pushers:
+                task.cancel()
+            self._sockets.discard(ws)
+        return ws
+
+    async def drop_ws_connections(self):
+        for ws in list(self._sockets):
+            await ws.close()
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+
+        async def handle(request):
+            payload = json.loads(await request.read())
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if isinstance(payload, list):
+                return web.json_response([self._answer(item) for item in payload])
+            return web.json_response(self._answer(payload))
+
+        app.router.add_post('/', handle)
+        app.router.add_get('/ws', self._websocket)
+        return app
@@ -0,0 +1,120 @@
+# benchmarks/history_archive_bench.py
+# Fills a throwaway history archive with synthetic pools and deliveries spread over many days, then
+# times compaction, column-pruned queries and a threshold backtest, with the peak RSS of each step.
+# Shows that millions of archived rows are analyzed without loading the archive into memory.
+#
+#   python -m benchmarks.history_archive_bench --pools 2000000 --days 60
+
+import os
+import sys
+import json
+import logging
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+import history_archive
+from benchmarks.run_benchmarks import reset_peak_rss, peak_rss_mb
+
+CHAINS = ['ethereum', 'base', 'bsc', 'arbitrum', 'solana']
+ROUTES = ['drop', 'vip', 'public']
+KINDS = ['realtime', 'immediate', 'digest', 'vip_channel']
+OUTCOMES = ['sent'] * 20 + ['blocked', 'failed', 'skipped']
+
+def synthetic_pool(rng, detected_at, n):
+    features = {'liquidity': rng.lognormvariate(-1, 2), 'lp_locked': rng.random(), 'renounced': float(rng.random() < 0.3),
+                'deployer_nonce': float(rng.randrange(500)), 'deployer_share': rng.random() * 0.6,
+                'deployer': f"0x{rng.getrandbits(160):040x}"}
+    return {'chain': rng.choice(CHAINS), 'dex': 'uniswap_v2', 'source': 'bench', 'block_number': 20_000_000 + n,
+            'block_timestamp': detected_at - rng.random() * 15, 'pair_address': f"0x{rng.getrandbits(160):040x}",
+            'token0_address': f"0x{rng.getrandbits(160):040x}", 'token1_address': f"0x{rng.getrandbits(160):040x}",
+            'token0_info': {'symbol': f"TKN{n % 9973}"}, 'token1_info': {'symbol': 'WETH'},
+            'transaction_hash': f"0x{rng.getrandbits(256):064x}", 'score': round(rng.random() * 100, 1),
+            'route': rng.choice(ROUTES), 'score_features': features}
+
+def fill(archive, args):
+    """Appends pools (and ~2 deliveries per pool) in detection order, flushing like the live flush loop would."""
+    rng = random.Random(args.seed)
+    start = time.time() - args.days * 86400
+    step = args.days * 86400 / args.pools
+    for n in range(args.pools):
+        detected_at = start + n * step
+        archive.append('pools', history_archive.pool_record(synthetic_pool(rng, detected_at, n), detected_at))
+        for message_id in (2 * n, 2 * n + 1):
+            row = {'message_id': message_id, 'chat_id': rng.randrange(1, 100_000), 'kind': rng.choice(KINDS),
+                   'attempts': 1, 'block_timestamp': detected_at - 10}
+            archive.append('deliveries', history_archive.delivery_record(row, rng.choice(OUTCOMES), detected_at + rng.random() * 5))
+        if n % args.flush_rows == args.flush_rows - 1:
+            archive.flush()
+    archive.flush()
+
+def timed(results, name, function):
+    reset_peak_rss()
+    started = time.perf_counter()
+    value = function()
+    results[name] = {'seconds': round(time.perf_counter() - started, 3), 'peak_rss_mb': peak_rss_mb()}
+    return value
+
+def directory_mb(path):
+    return round(sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) / 2**20, 1)
+
+def run(args):
+    root = args.dir or tempfile.mkdtemp(prefix="icehistory-")
+    archive = history_archive.HistoryArchive(root, flush_rows=args.flush_rows)
+    results = {'pools': args.pools, 'deliveries': 2 * args.pools, 'days': args.days}
+
+    timed(results, 'append_and_flush', lambda: fill(archive, args))
+    results['append_and_flush']['rows_per_second'] = round(3 * args.pools / results['append_and_flush']['seconds'])
+    results['segments_before_compaction'] = archive.stats['segments_written']
+    results['disk_mb'] = directory_mb(root)
+    compacted = timed(results, 'compact', lambda: archive.compact_due(time.time() + 2 * 86400)) # Every day is finished
+    results['compact']['days'] = compacted
+
+    def route_counts():
+        counts = {}
+        for chunk in archive.scan('pools', ['route']):
+            for route, n in zip(*np.unique(chunk['route'], return_counts=True)):
+                counts[route.decode()] = counts.get(route.decode(), 0) + int(n)
+        return counts
+
+    def last_week_on_base():
+        columns = archive.read('pools', ['pair_address', 'score'], start=time.time() - 7 * 86400, where={'chain': 'base'})
+        return len(columns['score'])
+
+    counts = timed(results, 'query_route_counts_all_days', route_counts)
+    expect(sum(counts.values()) == args.pools, f"route counts cover {sum(counts.values())} of {args.pools} pools")
+    rows = timed(results, 'query_last_week_base', last_week_on_base)
+    results['query_last_week_base']['rows'] = rows
+    timed(results, 'delivery_stats', lambda: history_archive.summarize(archive))
+    backtest = timed(results, 'backtest', lambda: history_archive.replay(archive, alert_min=40, public_min=80, blocked=[]))
+    expect(backtest['pools'] == args.pools, f"backtest replayed {backtest['pools']} of {args.pools} pools")
+    results['backtest']['transitions'] = backtest['transitions']
+
+    if not args.dir:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+def expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pools', type=int, default=1_000_000, help="Pools archived (plus two deliveries each)")
+    parser.add_argument('--days', type=int, default=60, help="Days the pools are spread over")
+    parser.add_argument('--flush-rows', type=int, default=5000, help="Pools per flush (HISTORY_FLUSH_ROWS)")
+    parser.add_argument('--dir', help="Archive root to fill and keep (default: a temp directory, removed afterwards)")
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING) # One compaction line per day would bury the results
+    print(json.dumps(run(args), indent=2, sort_keys=True))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
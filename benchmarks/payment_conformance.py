@@ -0,0 +1,302 @@
+# benchmarks/payment_conformance.py
+# End-to-end checks for payment_verifier against stub Ethereum/Solana JSON-RPC nodes and a stub price
+# feed: /subscribe invoices, accepted and rejected claims, retries that run out, failed settles,
+# restarts and replays.
+#
+#   python -m benchmarks.payment_conformance --database-url postgresql://localhost/icebench
+#
+# WARNING: rows for the test chat ids (990000001...) are deleted from the given database.
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from aiohttp import web
+
+from benchmarks.fakes import BackgroundServer, _hash, _address
+from benchmarks.store_conformance import ConformanceError, expect
+
+ETH_WALLET = _address('payments', 'eth')
+SOL_WALLET = "Ice1111111111111111111111111111111111111111"
+USDC = "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+PRICES = {'ethereum': {'usd': 2500.0}, 'solana': {'usd': 150.0}}
+PLAN_PRICE_USD = 25
+FIRST_CHAT_ID = 990_000_001
+
+class StubChain:
+    """Ethereum + Solana JSON-RPC and a CoinGecko-style price endpoint, serving whatever txs the checks add."""
+
+    def __init__(self):
+        self.head = 1000
+        self.eth_txs = {} # hash -> (tx, receipt)
+        self.block_times = {} # number -> timestamp
+        self.sol_txs = {} # signature -> getTransaction result
+
+    def add_eth(self, sender, block_time, value=0, usdc=None, confirmations=5):
+        """Mines a tx paying `value` wei (and/or `usdc` micro-dollars) to our wallet at `block_time`."""
+        tx_hash = _hash('eth', len(self.eth_txs), sender)
+        self.head += 1
+        number = hex(self.head)
+        self.block_times[number] = int(block_time)
+        logs = []
+        if usdc is not None:
+            logs.append({'address': USDC, 'topics': [TRANSFER_TOPIC, "0x" + sender[2:].rjust(64, '0'),
+                                                     "0x" + ETH_WALLET[2:].rjust(64, '0')], 'data': hex(usdc)})
+        tx = {'hash': tx_hash, 'from': sender, 'to': USDC if usdc is not None else ETH_WALLET, 'value': hex(value)}
+        receipt = {'transactionHash': tx_hash, 'status': '0x1', 'blockNumber': number, 'logs': logs}
+        self.eth_txs[tx_hash] = (tx, receipt)
+        self.head += confirmations
+        return tx_hash
+
+    def add_sol(self, block_time, lamports, via_instruction=True):
+        """A confirmed tx sending `lamports` to our wallet; via_instruction=False only moves the balance."""
+        signature = "5" + "Z" * 20 + "".join("abcdefghij"[int(d)] for d in str(len(self.sol_txs))).rjust(67, 'k') # Base58
+        instructions = []
+        if via_instruction:
+            instructions.append({'program': 'system', 'parsed': {'type': 'transfer', 'info': {
+                'source': "Payer11111111111111111111111111111111111111", 'destination': SOL_WALLET, 'lamports': lamports}}})
+        self.sol_txs[signature] = {
+            'blockTime': int(block_time),
+            'meta': {'err': None, 'preBalances': [10**10, 0], 'postBalances': [10**10 - lamports, lamports], 'innerInstructions': []},
+            'transaction': {'message': {'accountKeys': [{'pubkey': "Payer11111111111111111111111111111111111111"},
+                                                        {'pubkey': SOL_WALLET}], 'instructions': instructions}},
+        }
+        return signature
+
+    def _eth(self, item):
+        method, params = item['method'], item.get('params') or []
+        if method == 'eth_blockNumber':
+            result = hex(self.head)
+        elif method == 'eth_getTransactionByHash':
+            result = self.eth_txs.get(params[0], (None, None))[0]
+        elif method == 'eth_getTransactionReceipt':
+            result = self.eth_txs.get(params[0], (None, None))[1]
+        elif method == 'eth_getBlockByNumber':
+            timestamp = self.block_times.get(params[0])
+            result = {'number': params[0], 'timestamp': hex(timestamp)} if timestamp is not None else None
+        else:
+            return {'jsonrpc': '2.0', 'id': item.get('id'), 'error': {'code': -32601, 'message': method}}
+        return {'jsonrpc': '2.0', 'id': item.get('id'), 'result': result}
+
+    def app(self):
+        async def eth(request):
+            payload = await request.json()
+            return web.json_response([self._eth(item) for item in payload] if isinstance(payload, list) else self._eth(payload))
+
+        async def sol(request):
+            payload = await request.json()
+            return web.json_response({'jsonrpc': '2.0', 'id': payload.get('id'), 'result': self.sol_txs.get(payload['params'][0])})
+
+        async def price(request):
+            return web.json_response(PRICES)
+
+        app = web.Application()
+        app.router.add_post('/eth', eth)
+        app.router.add_post('/sol', sol)
+        app.router.add_get('/price', price)
+        return app
+
+# --- Checks ---
+
+class Settlements:
+    """Collects on_settled callbacks so checks can wait for a given claim's outcome."""
+
+    def __init__(self):
+        self.outcomes = {}
+        self.changed = asyncio.Event()
+
+    async def on_settled(self, claim, status, amount_usd, reason):
+        self.outcomes[(claim['tx_hash'], claim['chat_id'])] = (status, amount_usd, reason, claim.get('username'))
+        self.changed.set()
+
+    async def wait(self, tx_hash, chat_id, timeout=10):
+        deadline = time.monotonic() + timeout
+        while (tx_hash, chat_id) not in self.outcomes:
+            self.changed.clear()
+            remaining = deadline - time.monotonic()
+            expect(remaining > 0, f"claim {tx_hash[:12]}... from {chat_id} never settled")
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        return self.outcomes.pop((tx_hash, chat_id))
+
+async def payment_row(tx_hash, chat_id):
+    import async_db_manager
+    pool = await async_db_manager.get_db_pool()
+    return await pool.fetchrow("SELECT status, amount_usd FROM payments WHERE tx_hash = $1 AND chat_id = $2;", tx_hash, chat_id)
+
+async def check_conformance(chain, urls):
+    import async_db_manager
+    from payment_verifier import PaymentVerifier, VERIFIED, REJECTED, STALLED
+
+    settlements = Settlements()
+
+    def make_verifier():
+        return PaymentVerifier(settlements.on_settled, PLAN_PRICE_USD, eth_rpc=urls['eth'], sol_rpc=urls['sol'],
+                               eth_wallet=ETH_WALLET, sol_wallet=SOL_WALLET, workers=2, price_url=urls['price'],
+                               retry_delay=0.05, max_attempts=3)
+
+    async def invoice_for(n):
+        chat_id = FIRST_CHAT_ID + n
+        await async_db_manager.create_or_update_subscriber(chat_id, f"payer{n}")
+        return chat_id, await verifier.create_invoice(chat_id)
+
+    async def settle(chat_id, tx_hash):
+        expect(await verifier.submit(chat_id, tx_hash, username=f"payer{chat_id - FIRST_CHAT_ID}") == 'queued',
+               f"claim {tx_hash[:12]}... from {chat_id} should be queued")
+        return await settlements.wait(tx_hash.lower() if tx_hash.startswith('0x') else tx_hash, chat_id)
+
+    verifier = make_verifier()
+    await verifier.start()
+    passed = []
+
+    chat_id, invoice = await invoice_for(1)
+    expect(invoice['usd_micro'] % 10**6 == invoice['tag'], "the stablecoin amount carries the invoice tag")
+    expect(invoice['eth_wei'] % 10**14 == invoice['tag'] * 10**9, "the ETH amount carries the invoice tag")
+    expect((await verifier.create_invoice(chat_id))['tag'] == invoice['tag'], "an open invoice is reused")
+    tx_hash = chain.add_eth(_address('payer', 1), invoice['created_at'] + 1, value=invoice['eth_wei'])
+    status, amount_usd, _, username = await settle(chat_id, tx_hash)
+    expect(status == VERIFIED and abs(amount_usd - PLAN_PRICE_USD) < 0.01, f"exact ETH payment should verify, got {status}")
+    expect(username == 'payer1', "the claimant's username is passed through")
+    expect((await payment_row(tx_hash, chat_id))['status'] == 'verified', "verified claims are stored")
+    expect(await async_db_manager.get_payment_invoice(chat_id) is None, "a verified payment closes the invoice")
+    passed.append('accept eth')
+
+    chat_id, invoice = await invoice_for(2)
+    status, _, _, _ = await settle(chat_id, chain.add_eth(_address('payer', 2), invoice['created_at'] + 1, usdc=invoice['usd_micro']))
+    expect(status == VERIFIED, f"exact USDC payment should verify, got {status}")
+    chat_id, invoice = await invoice_for(3)
+    status, _, _, _ = await settle(chat_id, chain.add_sol(invoice['created_at'] + 1, invoice['sol_lamports']))
+    expect(status == VERIFIED, f"exact SOL transfer should verify, got {status}")
+    passed.append('accept usdc/sol')
+
+    chat_id, invoice = await invoice_for(4)
+    untagged = chain.add_eth(_address('payer', 4), invoice['created_at'] + 1, usdc=PLAN_PRICE_USD * 10**6)
+    status, _, reason, _ = await settle(chat_id, untagged)
+    expect(status == REJECTED and 'Amount' in reason, f"a payment without the invoice's amount is rejected, got {status}: {reason}")
+    status, _, _, _ = await settle(chat_id, chain.add_eth(_address('payer', 4), invoice['created_at'] - 3600, usdc=invoice['usd_micro']))
+    expect(status == REJECTED, "a transfer mined before the invoice was issued is rejected")
+    status, _, _, _ = await settle(chat_id, chain.add_sol(invoice['created_at'] + 1, invoice['sol_lamports'], via_instruction=False))
+    expect(status == REJECTED, "a SOL balance change without a transfer to our wallet is rejected")
+    status, _, _, _ = await settle(chat_id, untagged)
+    expect(status == REJECTED, "a rejected claim can be re-submitted by its claimant (and is re-verified)")
+    subscriber = await async_db_manager.get_subscriber(chat_id)
+    expect(subscriber['status'] == 'free', "only the claimant's own records change on rejection")
+    passed.append('reject')
+
+    # A watcher copies a payer's hash and claims it first: it doesn't pay the watcher's invoice
+    watcher_id, _ = await invoice_for(5)
+    payer_id, invoice = await invoice_for(6)
+    tx_hash = chain.add_eth(_address('payer', 6), invoice['created_at'] + 1, value=invoice['eth_wei'])
+    status, _, _, _ = await settle(watcher_id, tx_hash)
+    expect(status == REJECTED, f"a front-run claim of someone else's payment is rejected, got {status}")
+    status, _, _, _ = await settle(payer_id, tx_hash)
+    expect(status == VERIFIED, f"the real payer still gets verified after a front-run, got {status}")
+    expect(await verifier.submit(payer_id, tx_hash) == 'replay', "a verified tx can't be claimed again by its payer")
+    expect(await verifier.submit(watcher_id, tx_hash) == 'replay', "a verified tx can't be claimed by anyone else")
+    passed.append('replay')
+
+    # A settle that fails (rolled back, or committed with the reply lost) is retried, and credited exactly once
+    import payment_verifier
+    real_settle = payment_verifier.settle_payment_claim
+    for n, commits in ((10, False), (11, True)):
+        failures = [commits]
+
+        async def flaky_settle(*args, **kwargs):
+            if not failures:
+                return await real_settle(*args, **kwargs)
+            if failures.pop():
+                await real_settle(*args, **kwargs)
+            return 'failed'
+
+        payment_verifier.settle_payment_claim = flaky_settle
+        try:
+            chat_id, invoice = await invoice_for(n)
+            tx_hash = chain.add_eth(_address('payer', n), invoice['created_at'] + 1, value=invoice['eth_wei'])
+            status, _, _, _ = await settle(chat_id, tx_hash)
+        finally:
+            payment_verifier.settle_payment_claim = real_settle
+        expect(status == VERIFIED, f"a claim whose settle failed is verified on retry, got {status}")
+        await asyncio.sleep(0.3)
+        expect((tx_hash, chat_id) not in settlements.outcomes, "a claim whose settle failed is only credited once")
+        expect((await payment_row(tx_hash, chat_id))['status'] == 'verified', "the retried settle is stored")
+        expect(await verifier.submit(chat_id, tx_hash) == 'replay', "a claim settled on retry can't be claimed again")
+    passed.append('settle failure')
+
+    chat_id, invoice = await invoice_for(7)
+    await async_db_manager.set_payment_pending(chat_id, True)
+    pending_signature = "4" + "Q" * 20 + "pending".rjust(67, 'k')
+    status, _, _, _ = await settle(chat_id, pending_signature)
+    expect(status == STALLED, f"a tx that never shows up stalls after the retries, got {status}")
+    expect((await payment_row(pending_signature, chat_id))['status'] == 'pending', "a stalled claim stays pending")
+    expect((await async_db_manager.get_subscriber(chat_id))['status'] == 'pending_payment', "a stall doesn't reset the subscriber")
+    chain.sol_txs[pending_signature] = chain.sol_txs[chain.add_sol(invoice['created_at'] + 1, invoice['sol_lamports'])]
+    status, _, _, _ = await settle(chat_id, pending_signature)
+    expect(status == VERIFIED, f"re-submitting a stalled claim once the tx confirms verifies it, got {status}")
+    passed.append('retry')
+
+    # Claims pending at shutdown are resumed by the next run, with the claimant's username
+    chat_id, invoice = await invoice_for(8)
+    tx_hash = chain.add_eth(_address('payer', 8), invoice['created_at'] + 1, usdc=invoice['usd_micro'])
+    await async_db_manager.record_payment_claim(tx_hash, chat_id, 'eth')
+    await verifier.close()
+    first_run = verifier.stats
+    verifier = make_verifier()
+    await verifier.start()
+    status, _, _, username = await settlements.wait(tx_hash, chat_id)
+    expect(status == VERIFIED and username == 'payer8', f"resumed claims verify with their username, got {status}, {username}")
+
+    premium_id, _ = await invoice_for(9)
+    await async_db_manager.update_subscription_status(premium_id, 'premium', duration_days=30)
+    await async_db_manager.set_payment_pending(premium_id, True)
+    await async_db_manager.set_payment_pending(premium_id, False)
+    subscriber = await async_db_manager.get_subscriber(premium_id)
+    expect(subscriber['status'] == 'premium' and subscriber['subscribed_until'] is not None,
+           "opening or rejecting a payment never touches a running premium subscription")
+    passed.append('restart')
+
+    await verifier.close()
+    return passed, {name: count + verifier.stats[name] for name, count in first_run.items()}
+
+async def run(args):
+    import async_db_manager
+    chain = StubChain()
+    server = BackgroundServer(chain.app())
+    base = server.start()
+    urls = {'eth': f"{base}/eth", 'sol': f"{base}/sol", 'price': f"{base}/price"}
+    await async_db_manager.initialize_db()
+    pool = await async_db_manager.get_db_pool()
+    for table in ('payments', 'payment_invoices', 'subscribers'):
+        await pool.execute(f"DELETE FROM {table} WHERE chat_id >= $1 AND chat_id < $2;", FIRST_CHAT_ID, FIRST_CHAT_ID + 100)
+    try:
+        passed, stats = await check_conformance(chain, urls)
+    finally:
+        await async_db_manager.close_db_pool()
+        server.stop()
+    return {'passed': passed, 'stats': stats}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url', required=True, help="Throwaway Postgres (test chat ids are wiped)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    os.environ['DATABASE_URL'] = args.database_url # Read by async_db_manager at import
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        results = asyncio.run(run(args))
+    except ConformanceError as e:
+        print(f"Conformance check failed: {e}")
+        return 1
+    print(json.dumps(results, indent=2, sort_keys=True))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,671 @@
+# benchmarks/run_benchmarks.py
+# Offline benchmark harness: drives the real bot code against local fakes and reports
+# throughput, p50/p99 latency and peak memory, writing a baseline JSON for comparisons.
+#
+#   python -m benchmarks.run_benchmarks --database-url postgresql://localhost/icebench --subscribers 100000
+#   python -m benchmarks.run_benchmarks --database-url ... --compare benchmarks/baselines/<sha>.json
+#   python -m benchmarks.run_benchmarks --database-url ... --scenarios cluster --cluster-workers 1,2,4 --cluster-kill-leader
+#   python -m benchmarks.run_benchmarks --database-url ... --scenarios coldstart
+#   python -m benchmarks.run_benchmarks --database-url ... --scenarios abuse
+#
+# WARNING: the Postgres database given with --database-url is wiped (subscribers/payments) and reseeded.
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fakes import BackgroundServer, FakeTelegram, FakeEthNode
+
+BENCH_BOT_TOKEN = "123456789:BENCHMARKbenchmarkBENCHMARKbenchmark00"
+PAIR_ADDRESS_RE = re.compile(r"/(?:address|account)/(\w+)")
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+# Runs whale_main in a child process with the Bot API pointed at the fake Telegram (argv[1])
+BOT_PROCESS_BOOT = (
+    "import sys, runpy\n"
+    "from telebot import asyncio_helper\n"
+    "asyncio_helper.API_URL = sys.argv[1] + '/bot{0}/{1}'\n"
+    "runpy.run_module('whale_main', run_name='__main__')\n"
+)
+# Metric -> True if bigger is better; used by --compare
+COMPARED_METRICS = {'p50_ms': False, 'p99_ms': False, 'throughput_per_second': True, 'peak_rss_mb': False}
+
+# --- Measurement helpers ---
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def latency_summary(seconds, elapsed):
+    return {
+        'samples': len(seconds),
+        'p50_ms': round(percentile(seconds, 50) * 1000, 2) if seconds else None,
+        'p99_ms': round(percentile(seconds, 99) * 1000, 2) if seconds else None,
+        'max_ms': round(max(seconds) * 1000, 2) if seconds else None,
+        'throughput_per_second': round(len(seconds) / elapsed, 2) if elapsed > 0 else None,
+    }
+
+def reset_peak_rss():
+    """Resets the kernel's peak-RSS counter (Linux) so each scenario reports its own peak."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+# --- Environment (must be set before the bot modules are imported) ---
+
+def configure_environment(args, rpc_url, tg_url, workdir):
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': BENCH_BOT_TOKEN,
+        'ETHEREUM_RPC': rpc_url,
+        'ADMIN_ID': '1',
+        'ETH_MAIN': '0x' + '11' * 20,
+        'SOL_MAIN': 'BenchSolWallet1111111111111111111111111111',
+        'BOT_MODE': 'polling',
+        'SCAN_CONFIRMATIONS': str(args.confirmations),
+        'SCAN_SOURCES': 'ethereum:uniswap_v2',
+        'ETHEREUM_SCAN_INTERVAL_SECONDS': str(args.scan_interval),
+        'SCANNER_CHECKPOINT_FILE': os.path.join(workdir, 'scanner_checkpoint.json'),
+        'TOKEN_CACHE_FILE': '',
+        'TELEGRAM_GLOBAL_RATE': str(args.tg_rate_limit),
+        'DIGEST_WINDOW_SECONDS': str(args.digest_window),
+        'SQLITE_DB_PATH': args.sqlite_path or os.path.join(workdir, 'bench_business.db'),
+        'SEEN_POOLS_DB_PATH': os.path.join(workdir, 'seen_pools.db'),
+        'HISTORY_DIR': os.path.join(workdir, 'history'),
+        'PROFILE_HOT_LOOPS': 'false',
+    })
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    if args.ws:
+        os.environ['ETHEREUM_WS_RPC'] = rpc_url.replace("http://", "ws://") + "/ws"
+        os.environ['HEAD_SUBSCRIPTION'] = args.ws
+
+# --- Seeding ---
+
+async def seed_postgres(args):
+    import async_db_manager
+    await async_db_manager.initialize_db()
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    records = []
+    for chat_id in range(1, args.subscribers + 1):
+        premium = rng.random() < args.premium_ratio
+        records.append((chat_id, f"bench{chat_id}", 'premium' if premium else 'free',
+                        now + timedelta(days=rng.randint(1, 30)) if premium else None,
+                        'digest' if rng.random() < args.digest_ratio else 'realtime'))
+    pool = await async_db_manager.get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("TRUNCATE subscribers, payments, alert_messages, alert_deliveries")
+        await conn.copy_records_to_table('subscribers', records=records,
+                                         columns=['chat_id', 'username', 'status', 'subscribed_until', 'alert_mode'])
+        await conn.execute("ANALYZE subscribers")
+    premium = sum(1 for r in records if r[2] == 'premium')
+    logging.info(f"Seeded Postgres with {len(records)} subscribers ({premium} premium).")
+    return premium
+
+def seed_sqlite(args):
+    import database
+    database.init_db()
+    rng = random.Random(args.seed)
+    now = int(time.time())
+    rows = [(user_id, now + rng.randint(3600, 30 * 86400) if rng.random() < args.premium_ratio else None)
+            for user_id in range(1, args.subscribers + 1)]
+    with database.write_transaction() as conn:
+        conn.execute("DELETE FROM users")
+        conn.executemany("INSERT INTO users (user_id, expires_at) VALUES (?, ?)", rows)
+    logging.info(f"Seeded SQLite ({os.environ['SQLITE_DB_PATH']}) with {len(rows)} users.")
+
+# --- Scenarios ---
+
+async def _drop_websockets_periodically(rpc_server, node, every):
+    while True:
+        await asyncio.sleep(every)
+        logging.info("Dropping head subscription sockets to exercise reconnect/backfill.")
+        rpc_server.run_coroutine(node.drop_ws_connections())
+
+async def bench_scan_fanout(args, telegram, node, rpc_server):
+    """Runs whale_main's scanner/alert loop for --duration seconds against the fake chain and Telegram."""
+    import whale_main
+    whale_main.load_scanner_stack()
+    premium = await seed_postgres(args)
+    telegram.reset()
+    fanout_times = []
+    original_process = whale_main.process_new_pools
+
+    async def timed_process(new_pools):
+        started = time.perf_counter()
+        try:
+            await original_process(new_pools)
+        finally:
+            fanout_times.append(time.perf_counter() - started)
+
+    whale_main.process_new_pools = timed_process
+    registry = whale_main.scanner_registry
+    reset_peak_rss()
+    started = time.perf_counter()
+    if whale_main.seen_pool_index is not None:
+        await asyncio.to_thread(whale_main.seen_pool_index.open)
+    registry.start()
+    tasks = registry._tasks + whale_main.alert_outbox.start() + \
+            [asyncio.create_task(whale_main.background_scanner_and_manager_loop())]
+    if whale_main.history is not None:
+        tasks.append(asyncio.create_task(whale_main.history.run())) # Archive writes are part of the cost
+    if whale_main.head_watcher is not None:
+        tasks.append(asyncio.create_task(whale_main.head_watcher.run()))
+        if args.ws_drop_every:
+            tasks.append(asyncio.create_task(_drop_websockets_periodically(rpc_server, node, args.ws_drop_every)))
+    await asyncio.sleep(args.duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    whale_main.process_new_pools = original_process
+
+    end_to_end = []
+    for received_at, _, text in telegram.deliveries:
+        for pair in PAIR_ADDRESS_RE.findall(text):
+            block_ts = node.pair_timestamps.get(pair.lower())
+            if block_ts is not None:
+                end_to_end.append(received_at - block_ts)
+    deliveries = [d[0] for d in telegram.deliveries]
+    return {
+        'premium_subscribers': premium,
+        'alert_fanout': latency_summary(fanout_times, elapsed),
+        'scan_sources': {name: dict(status) for name, status in registry.status.items()},
+        'alert_outbox': dict(whale_main.alert_outbox.stats),
+        'alert_end_to_end': latency_summary(end_to_end, elapsed),
+        'messages_delivered': len(deliveries),
+        'throughput_per_second': round(len(deliveries) / elapsed, 2),
+        'telegram_responses': {str(k): v for k, v in telegram.responses.items()},
+        'rpc_calls': dict(node.calls),
+        'head_watcher': dict(whale_main.head_watcher.stats) if whale_main.head_watcher is not None else None,
+        'history_archive': dict(whale_main.history.stats) if whale_main.history is not None else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def _message_json(chat_id, text, message_id):
+    return {
+        'message_id': message_id, 'date': int(time.time()), 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench', 'username': f"bench{chat_id}"},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}],
+    }
+
+def _telebot_message(chat_id, text, message_id):
+    from telebot import types
+    return types.Message.de_json(_message_json(chat_id, text, message_id))
+
+async def _run_requests(count, concurrency, make_call):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await make_call(i)
+            except Exception as e:
+                errors += 1
+                logging.debug(f"Request {i} failed: {e}")
+                return
+            latencies.append(time.perf_counter() - started)
+
+    reset_peak_rss()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    summary = latency_summary(latencies, time.perf_counter() - started)
+    summary['errors'] = errors
+    summary['peak_rss_mb'] = peak_rss_mb()
+    return summary
+
+async def bench_handlers(args, telegram):
+    """Calls whale_main's /start and /status handlers for random seeded users at --handler-concurrency."""
+    import whale_main
+    rng = random.Random(args.seed)
+    results = {}
+    for command, handler in (('/start', whale_main.send_welcome), ('/status', whale_main.status_command)):
+        telegram.reset()
+        users = [rng.randint(1, args.subscribers) for _ in range(args.handler_requests)]
+        results[command] = await _run_requests(args.handler_requests, args.handler_concurrency,
+                                               lambda i: handler(_telebot_message(users[i], command, i + 1)))
+    return results
+
+async def _bench_abuse_round(args, telegram, throttling):
+    """Legitimate /starts at a steady rate while hammering users and a raid of fresh accounts flood the bot."""
+    import whale_main
+    from telebot import types
+    from throttling import Throttler, TelebotThrottlingMiddleware
+    throttler = Throttler(enabled=throttling) # Fresh windows and counters for each round
+    whale_main.throttler = throttler
+    for middleware in whale_main.bot.middlewares:
+        if isinstance(middleware, TelebotThrottlingMiddleware):
+            middleware.throttler = throttler
+    telegram.reset()
+    rng = random.Random(args.seed)
+    legit_users = rng.sample(range(1, args.subscribers + 1), min(args.subscribers, args.abuse_legit_requests))
+    hammerers = [900_000_100 + i for i in range(args.abuse_hammerers)]
+    raiders = range(910_000_000, 910_000_000 + args.abuse_raid_accounts)
+    update_ids = iter(range(1, 10**9))
+    abuse_sent = 0
+    done = asyncio.Event()
+
+    async def feed(chat_id):
+        update_id = next(update_ids)
+        await whale_main.bot.process_new_updates([types.Update.de_json({'update_id': update_id,
+                                                                        'message': _message_json(chat_id, '/start', update_id)})])
+
+    async def hammer(chat_id):
+        nonlocal abuse_sent
+        while not done.is_set():
+            abuse_sent += 1
+            await feed(chat_id)
+            await asyncio.sleep(0)
+
+    async def raid():
+        nonlocal abuse_sent
+        interval = args.abuse_legit_requests / args.abuse_legit_rate / max(1, args.abuse_raid_accounts)
+        pending = set()
+        for chat_id in raiders:
+            if done.is_set():
+                break
+            abuse_sent += 1
+            pending.add(asyncio.create_task(feed(chat_id)))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*pending)
+
+    latencies = []
+
+    async def legit(chat_id):
+        started = time.perf_counter()
+        await feed(chat_id)
+        latencies.append(time.perf_counter() - started)
+
+    abusers = [asyncio.create_task(hammer(chat_id)) for chat_id in hammerers for _ in range(args.abuse_hammer_concurrency)]
+    abusers.append(asyncio.create_task(raid()))
+    started = time.perf_counter()
+    legit_tasks = []
+    for chat_id in legit_users:
+        legit_tasks.append(asyncio.create_task(legit(chat_id)))
+        await asyncio.sleep(1 / args.abuse_legit_rate)
+    await asyncio.gather(*legit_tasks)
+    elapsed = time.perf_counter() - started
+    done.set()
+    await asyncio.gather(*abusers)
+
+    summary = latency_summary(latencies, elapsed)
+    legit_allowed = sum(throttler.user_stats(chat_id)['allowed'] for chat_id in legit_users)
+    summary['legit_throttled'] = sum(throttler.user_stats(chat_id)['throttled'] for chat_id in legit_users)
+    summary['abuse_updates'] = abuse_sent
+    summary['abuse_handled'] = throttler.stats['allowed'] - legit_allowed if throttling else abuse_sent # A disabled throttler records nothing
+    summary['throttler'] = dict(throttler.stats)
+    return summary
+
+async def bench_abuse(args, telegram):
+    """Legitimate /start latency during an abuse spike, without and with the throttling middleware."""
+    logging.getLogger('TeleBot').setLevel(logging.WARNING) # process_new_updates logs every call
+    return {'unthrottled': await _bench_abuse_round(args, telegram, False),
+            'throttled': await _bench_abuse_round(args, telegram, True)}
+
+async def bench_alpha(args, telegram, tg_url):
+    """Feeds 'alpha' callback-query updates for seeded SQLite users through main.py's aiogram dispatcher."""
+    try:
+        import main
+        import dexscreener as dexscreener_module
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+    except ImportError as e:
+        logging.warning(f"Skipping alpha benchmark: {e}")
+        return {'skipped': str(e)}
+    seed_sqlite(args)
+    main.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(tg_url))
+    main.throttler.enabled = False # Measures the handler path; the abuse scenario covers throttling
+    dexscreener_module.DEXSCREENER_BOOSTS_URL = f"{tg_url}/dexscreener/token-boosts/latest/v1"
+    telegram.reset()
+    rng = random.Random(args.seed)
+    users = [rng.randint(1, args.subscribers) for _ in range(args.handler_requests)]
+
+    def update(i):
+        user = {'id': users[i], 'is_bot': False, 'first_name': 'Bench'}
+        return {'update_id': i + 1, 'callback_query': {
+            'id': str(i + 1), 'from': user, 'chat_instance': '1', 'data': 'alpha',
+            'message': {'message_id': i + 1, 'date': int(time.time()), 'text': 'menu',
+                        'chat': {'id': users[i], 'type': 'private'}},
+        }}
+
+    try:
+        return await _run_requests(args.handler_requests, args.handler_concurrency,
+                                   lambda i: main.dp.feed_raw_update(main.bot, update(i)))
+    finally:
+        await main.bot.session.close()
+        await main.dexscreener.close()
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+async def _wait_for(check, timeout, interval=0.2):
+    """Polls the async `check()` until it returns something truthy; returns that, or None after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = await check()
+        if result:
+            return result
+        await asyncio.sleep(interval)
+    return None
+
+async def _bench_cluster_round(args, telegram, tg_url, workdir, workers, premium_ids):
+    import async_db_manager
+    from cluster import shard_for, CLUSTER_SHARDS
+    pool = await async_db_manager.get_db_pool()
+    await pool.execute("TRUNCATE alert_messages, alert_deliveries, cluster_members")
+    telegram.reset()
+    env = dict(os.environ, CLUSTER_ENABLED='true', CLUSTER_HEARTBEAT_SECONDS='1', CLUSTER_MEMBER_TTL_SECONDS='3',
+               ALERT_OUTBOX_LEASE_SECONDS='5', ALERT_SEND_CONCURRENCY=str(args.cluster_send_concurrency),
+               SCAN_SOURCES='') # Deliveries only; the scan scenario covers the scanner
+    env.pop('ETHEREUM_WS_RPC', None)
+    processes = {}
+    for n in range(workers):
+        worker_id = f"bench-{workers}-{n}"
+        log = open(os.path.join(workdir, f"{worker_id}.log"), "w")
+        processes[worker_id] = subprocess.Popen([sys.executable, "-c", BOT_PROCESS_BOOT, tg_url], stdout=log,
+                                                stderr=subprocess.STDOUT,
+                                                env=dict(env, CLUSTER_WORKER_ID=worker_id, PORT=str(_free_port()),
+                                                         METRICS_PORT=str(_free_port())))
+
+    async def live_members():
+        return await pool.fetch("SELECT worker_id, is_leader, owned_shards FROM cluster_members "
+                                "WHERE heartbeat_at > NOW() - interval '3 seconds' ORDER BY worker_id")
+
+    async def settled():
+        # owned_shards lags one heartbeat, so a full sum means every worker has seen the final membership
+        members = await live_members()
+        return members if len(members) == workers and sum(m['owned_shards'] for m in members) == CLUSTER_SHARDS \
+            and sum(m['is_leader'] for m in members) == 1 else None
+
+    async def drained():
+        return await pool.fetchval("SELECT COUNT(*) FROM alert_deliveries WHERE status = 'pending'") == 0
+
+    async def third_delivered():
+        return len(telegram.deliveries) >= result['deliveries_queued'] // 3
+
+    result = {'workers': workers}
+    try:
+        members = await _wait_for(settled, timeout=120)
+        if members is None:
+            raise RuntimeError(f"{workers} cluster worker(s) did not come up; see the logs in {workdir}")
+        result['owned_shards'] = {m['worker_id']: m['owned_shards'] for m in members}
+        messages = [f"Bench cluster alert {m}" for m in range(args.cluster_messages)]
+        started = time.perf_counter()
+        result['deliveries_queued'] = await async_db_manager.enqueue_alerts(
+            'bench', messages, premium_ids, shards=[shard_for(chat_id) for chat_id in premium_ids])
+
+        if args.cluster_kill_leader and workers > 1:
+            await _wait_for(third_delivered, timeout=120)
+            leader = next(m['worker_id'] for m in await live_members() if m['is_leader'])
+            processes[leader].kill()
+            killed_at = time.perf_counter()
+            logging.info(f"Killed cluster leader {leader}.")
+
+            async def new_leader():
+                return [m for m in await live_members() if m['is_leader'] and m['worker_id'] != leader]
+            result['leader_failover_seconds'] = round(time.perf_counter() - killed_at, 2) \
+                if await _wait_for(new_leader, timeout=60) else None
+
+        if not await _wait_for(drained, timeout=600):
+            logging.warning(f"Cluster of {workers} did not drain the outbox within 600s.")
+        elapsed = time.perf_counter() - started
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in processes.values():
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    sends = Counter((chat_id, text) for _, chat_id, text in telegram.deliveries)
+    outcomes = await pool.fetch("SELECT status, COUNT(*) AS n FROM alert_deliveries GROUP BY status")
+    result.update({
+        'messages_delivered': len(telegram.deliveries),
+        'duplicates': sum(count - 1 for count in sends.values()),
+        'outcomes': {row['status']: row['n'] for row in outcomes},
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_per_second': round(len(telegram.deliveries) / elapsed, 2),
+        'telegram_responses': {str(k): v for k, v in telegram.responses.items()},
+    })
+    return result
+
+async def bench_cold_start(args, telegram, tg_url, workdir):
+    """
+    Starts whale_main --profile-startup --cold-start-runs times with a /start already waiting in
+    getUpdates, and times process start to the reply. Startup profiles go to coldstart-<n>.log.
+    """
+    import async_db_manager
+    await async_db_manager.initialize_db() # Schema in place, like any restart after the first deploy
+    answered, ready = [], []
+    for run in range(args.cold_start_runs):
+        telegram.reset()
+        chat_id = 900_000_050 + run # Clear of the fake's blocked percentile
+        telegram.updates.append({'update_id': run + 1, 'message': {
+            'message_id': 1, 'date': int(time.time()), 'text': '/start',
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Cold', 'username': f"cold{run}"},
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}})
+        log = open(os.path.join(workdir, f"coldstart-{run}.log"), "w")
+        started = time.time()
+        process = subprocess.Popen([sys.executable, "-c", BOT_PROCESS_BOOT, tg_url, "--profile-startup"], stdout=log,
+                                   stderr=subprocess.STDOUT, env=dict(os.environ, PORT=str(_free_port()), METRICS_PORT=str(_free_port())))
+
+        async def replied():
+            return next((received_at for received_at, chat, _ in telegram.deliveries if chat == chat_id), None)
+
+        async def scanning():
+            with open(log.name) as f:
+                return "Scanner registry started" in f.read()
+        try:
+            received_at = await _wait_for(replied, timeout=60, interval=0.01)
+            if received_at is None:
+                raise RuntimeError(f"whale_main never answered /start; see {log.name}")
+            answered.append(received_at - started)
+            if await _wait_for(scanning, timeout=60, interval=0.05):
+                ready.append(time.time() - started)
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return {
+        'first_start_answered': latency_summary(answered, sum(answered)),
+        'scanning_started': latency_summary(ready, sum(ready)),
+        'profiles': os.path.join(workdir, "coldstart-*.log"),
+    }
+
+async def bench_cluster(args, telegram, tg_url, workdir):
+    """
+    For each --cluster-workers count, starts that many whale_main processes in cluster mode,
+    queues --cluster-messages alerts for every premium subscriber and times the drain,
+    counting double-sends. --cluster-kill-leader SIGKILLs the leader a third of the way in.
+    """
+    import async_db_manager
+    await seed_postgres(args)
+    pool = await async_db_manager.get_db_pool()
+    premium_ids = [row['chat_id'] for row in await pool.fetch("SELECT chat_id FROM subscribers WHERE status = 'premium'")]
+    results = {}
+    for workers in [int(n) for n in args.cluster_workers.split(",")]:
+        results[f"workers_{workers}"] = await _bench_cluster_round(args, telegram, tg_url, workdir, workers, premium_ids)
+    return results
+
+# --- Baselines ---
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", key, value
+
+def compare(current, baseline, max_regression):
+    """Prints metric deltas against a baseline; returns the list of regressions beyond max_regression."""
+    previous = {path: value for path, _, value in _flatten(baseline['results'])}
+    regressions = []
+    for path, key, value in _flatten(current['results']):
+        if key not in COMPARED_METRICS or not isinstance(value, (int, float)):
+            continue
+        old = previous.get(path)
+        if not isinstance(old, (int, float)) or old == 0:
+            continue
+        change = (value - old) / old
+        worse = -change if COMPARED_METRICS[key] else change
+        marker = "REGRESSION" if worse > max_regression else ""
+        print(f"  {path:55} {old:>12} -> {value:>12} ({change:+.1%}) {marker}")
+        if marker:
+            regressions.append(path)
+    return regressions
+
+async def run(args):
+    node = FakeEthNode(block_time=args.block_time, pools_per_block=args.pools_per_block, latency=args.rpc_latency_ms / 1000)
+    telegram = FakeTelegram(latency=args.tg_latency_ms / 1000, jitter=args.tg_jitter_ms / 1000,
+                            rate_limit=args.tg_rate_limit, error_429_probability=args.tg_429_probability,
+                            blocked_percent=args.tg_blocked_percent, seed=args.seed)
+    rpc_server = BackgroundServer(node.app())
+    rpc_url = rpc_server.start()
+    tg_url = BackgroundServer(telegram.app()).start()
+    workdir = tempfile.mkdtemp(prefix="icebench-")
+    configure_environment(args, rpc_url, tg_url, workdir)
+    from telebot import asyncio_helper
+    asyncio_helper.API_URL = tg_url + "/bot{0}/{1}"
+
+    scenarios = args.scenarios.split(",")
+    results = {}
+    if any(name in scenarios for name in ('scan', 'handlers', 'cluster', 'coldstart', 'abuse')):
+        if not args.database_url:
+            logging.warning("No --database-url given; skipping the Postgres-backed scan, handlers, cluster, coldstart and abuse scenarios.")
+        else:
+            if 'scan' in scenarios:
+                results['scan_fanout'] = await bench_scan_fanout(args, telegram, node, rpc_server)
+            if 'handlers' in scenarios:
+                results['handlers'] = await bench_handlers(args, telegram)
+            if 'cluster' in scenarios:
+                results['cluster'] = await bench_cluster(args, telegram, tg_url, workdir)
+            if 'coldstart' in scenarios:
+                results['cold_start'] = await bench_cold_start(args, telegram, tg_url, workdir)
+            if 'abuse' in scenarios:
+                results['abuse'] = await bench_abuse(args, telegram)
+            import async_db_manager
+            await async_db_manager.close_db_pool()
+    if 'alpha' in scenarios:
+        results['alpha_callback'] = await bench_alpha(args, telegram, tg_url)
+
+    return {
+        'meta': {
+            'git_commit': git_commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': vars(args),
+        },
+        'results': results,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline IceAlphaHunter_Bot benchmarks (fake Telegram, RPC and seeded DB).")
+    parser.add_argument('--scenarios', default='scan,handlers,alpha', help="Comma-separated: scan, handlers, alpha, cluster, coldstart, abuse")
+    parser.add_argument('--database-url', help="Throwaway Postgres for whale_main scenarios (it is wiped and reseeded)")
+    parser.add_argument('--sqlite-path', help="SQLite file for main.py's alpha scenario (default: a temp file)")
+    parser.add_argument('--subscribers', type=int, default=10_000)
+    parser.add_argument('--premium-ratio', type=float, default=0.1)
+    parser.add_argument('--digest-ratio', type=float, default=0.2)
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to run the scan loop")
+    parser.add_argument('--scan-interval', type=float, default=2)
+    parser.add_argument('--confirmations', type=int, default=0)
+    parser.add_argument('--digest-window', type=float, default=10)
+    parser.add_argument('--block-time', type=float, default=2)
+    parser.add_argument('--pools-per-block', type=int, default=2)
+    parser.add_argument('--ws', choices=['newHeads', 'logs'], help="Scan on WebSocket notifications instead of polling")
+    parser.add_argument('--ws-drop-every', type=float, default=0, help="Kill the WebSocket every N seconds (reconnect test)")
+    parser.add_argument('--rpc-latency-ms', type=float, default=5)
+    parser.add_argument('--tg-latency-ms', type=float, default=40)
+    parser.add_argument('--tg-jitter-ms', type=float, default=20)
+    parser.add_argument('--tg-rate-limit', type=float, default=1000, help="Messages/second before the fake answers 429")
+    parser.add_argument('--tg-429-probability', type=float, default=0.0)
+    parser.add_argument('--tg-blocked-percent', type=int, default=1)
+    parser.add_argument('--handler-requests', type=int, default=2000)
+    parser.add_argument('--handler-concurrency', type=int, default=50)
+    parser.add_argument('--cluster-workers', default='1,2,4', help="Worker process counts for the cluster scenario")
+    parser.add_argument('--cluster-messages', type=int, default=5, help="Alerts queued for every premium subscriber")
+    parser.add_argument('--cluster-send-concurrency', type=int, default=8, help="ALERT_SEND_CONCURRENCY per worker process")
+    parser.add_argument('--cluster-kill-leader', action='store_true', help="SIGKILL the leader mid-drain (failover test)")
+    parser.add_argument('--cold-start-runs', type=int, default=5, help="whale_main launches timed by the coldstart scenario")
+    parser.add_argument('--abuse-legit-requests', type=int, default=300, help="Distinct legitimate users sending /start in the abuse scenario")
+    parser.add_argument('--abuse-legit-rate', type=float, default=30, help="Legitimate /starts per second")
+    parser.add_argument('--abuse-hammerers', type=int, default=5, help="Users sending /start back to back")
+    parser.add_argument('--abuse-hammer-concurrency', type=int, default=10, help="Concurrent updates per hammering user")
+    parser.add_argument('--abuse-raid-accounts', type=int, default=500, help="Fresh accounts sending one /start each")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Where to write results (default: benchmarks/baselines/<git sha>.json)")
+    parser.add_argument('--compare', help="Baseline JSON to diff against; exits 1 on regressions")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="Allowed relative slowdown before failing --compare")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+
+    output = args.output or os.path.join(BASELINE_DIR, f"{report['meta']['git_commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(json.dumps(report['results'], indent=2, sort_keys=True))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} ({baseline['meta'].get('git_commit')}):")
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.max_regression:.0%}.")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# benchmarks/store_conformance.py
+# Shared conformance checks and bulk-vs-row benchmark for subscriber_store backends. Every check runs
+# unchanged against each backend, so SQLite and Postgres can't drift apart.
+#
+#   python -m benchmarks.store_conformance                                  # SQLite only (temp file)
+#   python -m benchmarks.store_conformance --database-url postgresql://localhost/icebench --users 50000
+#
+# WARNING: the Postgres database given with --database-url has its subscribers table wiped.
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+from benchmarks.run_benchmarks import latency_summary
+
+# --- Conformance ---
+
+class ConformanceError(AssertionError):
+    pass
+
+def expect(condition, message):
+    if not condition:
+        raise ConformanceError(message)
+
+async def check_conformance(store):
+    """Runs every check against a freshly opened, empty store. Returns the names of the checks passed."""
+    passed = []
+
+    expect(await store.get(1) is None, "get() of an unknown user should be None")
+    expect(await store.get_many([1, 2]) == {}, "get_many() of unknown users should be {}")
+    expect(await store.is_premium(1) is False, "unknown users are not premium")
+    expect(await store.get_stats(1) == (0, 0), "get_stats() of an unknown user should be (0, 0)")
+    passed.append('unknown users')
+
+    await store.upsert_many([(1, 'alice'), (2, None), (1, 'alice2')])
+    records = await store.get_many([1, 2, 2, 3])
+    expect(set(records) == {1, 2}, f"get_many() should return exactly the existing users, got {sorted(records)}")
+    expect(records[1]['username'] == 'alice2', "the last username in a batch wins")
+    expect(records[2]['username'] is None and records[2]['status'] == 'free', "new users start free without a username")
+    expect(records[1]['referrals'] == 0 and records[1]['trial_used'] is False, "new users have no referrals")
+    await store.upsert(2, 'bob')
+    await store.upsert(2, None)
+    expect((await store.get(2))['username'] == 'bob', "a None username keeps the stored one")
+    passed.append('upsert_many')
+
+    started = time.time()
+    expires = await store.extend_many([1, 2, 3, 3], 3600)
+    expect(set(expires) == {1, 2, 3}, f"extend_many() should return every user once, got {sorted(expires)}")
+    expect(all(abs(expires_at - (started + 3600)) < 5 for expires_at in expires.values()),
+           "a first grant runs from now")
+    stacked = await store.extend(1, 3600)
+    expect(abs(stacked - (expires[1] + 3600)) < 5, "a grant on a running subscription extends it")
+    expect(await store.is_premium(3), "extend_many() creates missing users as premium")
+    expect((await store.get(1))['status'] == 'premium', "granted users report status 'premium'")
+    expect({1, 2, 3} <= set(await store.active_premium_ids()), "granted users are in active_premium_ids()")
+    passed.append('extend_many')
+
+    await store.extend_many([4, 5], 1)
+    await asyncio.sleep(2.1)
+    expect(await store.expire_many([1, 4]) == [4], "expire_many() only downgrades ended subscriptions")
+    expect(not await store.is_premium(4), "expired users are not premium")
+    expect(await store.expire_due() == [5], "expire_due() downgrades every other ended subscription")
+    expect(await store.expire_due() == [], "expire_due() is idempotent")
+    expect(await store.is_premium(1), "running subscriptions survive expiry sweeps")
+    expect(4 not in await store.active_premium_ids(), "expired users leave active_premium_ids()")
+    passed.append('expiry')
+
+    granted = [await store.add_referral(10) for _ in range(4)]
+    expect(granted == [False, False, True, False], f"the trial is granted once, at the third referral; got {granted}")
+    expect(await store.get_stats(10) == (4, 1), "get_stats() reports referrals and the used trial")
+    expect(await store.is_premium(10), "the referral trial grants premium")
+    passed.append('referrals')
+    return passed
+
+# --- Benchmark ---
+
+async def bench_bulk(store, users, row_sample):
+    """Times the bulk methods for `users` users against row-at-a-time calls for `row_sample` of them."""
+    user_ids = list(range(1_000_000, 1_000_000 + users))
+    results = {}
+
+    def timed(name, count, seconds):
+        results[name] = {'users': count, 'seconds': round(seconds, 3), 'users_per_second': round(count / seconds, 1)}
+
+    started = time.perf_counter()
+    await store.upsert_many([(user_id, f"bench{user_id}") for user_id in user_ids])
+    timed('upsert_many', users, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    found = await store.get_many(user_ids)
+    timed('get_many', len(found), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await store.extend_many(user_ids, 7 * 86400) # The "promo to every user" admin action
+    timed('extend_many', users, time.perf_counter() - started)
+
+    latencies = []
+    started = time.perf_counter()
+    for user_id in user_ids[:row_sample]:
+        call_started = time.perf_counter()
+        await store.extend(user_id, 86400)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    results['extend_one_by_one'] = latency_summary(latencies, elapsed)
+    results['extend_one_by_one']['projected_seconds_for_all'] = round(elapsed / row_sample * users, 1)
+    results['extend_speedup'] = round(results['extend_one_by_one']['projected_seconds_for_all'] /
+                                      results['extend_many']['seconds'], 1)
+    return results
+
+# --- Runner ---
+
+async def run_backend(backend, args):
+    import subscriber_store
+    store = subscriber_store.open_subscriber_store(backend)
+    await store.open()
+    if backend == 'postgres':
+        from entitlements import EntitlementCache
+        pool = await store.db.get_db_pool()
+        await pool.execute("TRUNCATE subscribers")
+        store.db.entitlements = EntitlementCache() # Forget rows cached before the wipe
+    try:
+        return {'conformance': await check_conformance(store), 'bulk': await bench_bulk(store, args.users, args.row_sample)}
+    finally:
+        await store.close()
+
+async def run(args):
+    results = {}
+    for backend in args.backends.split(","):
+        if backend == 'postgres' and not os.environ.get('DATABASE_URL'):
+            logging.warning("No --database-url given; skipping the Postgres backend.")
+            continue
+        print(f"Checking the {backend} backend...", flush=True)
+        results[backend] = await run_backend(backend, args)
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backends', default='sqlite,postgres', help="Comma-separated: sqlite, postgres")
+    parser.add_argument('--database-url', help="Throwaway Postgres (its subscribers table is wiped)")
+    parser.add_argument('--sqlite-path', help="SQLite file (default: a new temp file)")
+    parser.add_argument('--users', type=int, default=50_000, help="Users in the bulk benchmark")
+    parser.add_argument('--row-sample', type=int, default=1000, help="Users extended one call at a time for comparison")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    # Both data layers read their settings at import, so set them before anything imports them
+    os.environ['SQLITE_DB_PATH'] = args.sqlite_path or os.path.join(tempfile.mkdtemp(prefix="icestore-"), "store.db")
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    logging.getLogger().setLevel(logging.WARNING) # Per-call info logs would dominate the row-at-a-time timings
+    try:
+        results = asyncio.run(run(args))
+    except ConformanceError as e:
+        print(f"Conformance check failed: {e}")
+        return 1
+    print(json.dumps(results, indent=2, sort_keys=True))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,334 @@
 # blockchain_scanner.py (ensure these lines are near the top)
 import os
+import json
+import time
 import logging
+import threading
+import requests
 from web3 import Web3
 from web3.middleware import geth_poa_middleware
 from dotenv import load_dotenv # <-- Make sure this is present
+from token_metadata import TokenMetadataResolver
+from metrics import web3_rpc_metrics_middleware
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 load_dotenv() # <-- Make sure this is called once
 
-# ... rest of your blockchain_scanner.py code ...
+# --- Configuration ---
+ETHEREUM_RPC = os.getenv("ETHEREUM_RPC")
+USE_POA_MIDDLEWARE = os.getenv("USE_POA_MIDDLEWARE", "false").lower() == "true" # For PoA chains (BSC, Polygon, ...)
+UNISWAP_V2_FACTORY = os.getenv("UNISWAP_V2_FACTORY", "0x5C69bEe701ef814a2B6a3EDD4B1652CB9cc5aA6f")
+WETH_ADDRESS = os.getenv("WETH_ADDRESS", "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2")
+# keccak("PairCreated(address,address,address,uint256)")
+PAIR_CREATED_TOPIC = "0x0d3648bd0f6ba80134a33ba9275ac585d9d315f0ad8355cddefde31afa28d0e9"
+# keccak("PoolCreated(address,address,uint24,int24,address)") - Uniswap V3-style factories
+POOL_CREATED_V3_TOPIC = "0x783cca1c0412dd0d695e784568c96da2e9c22ff989357a2e8b1d9b2b4e6b7118"
+
+SCAN_CONFIRMATIONS = int(os.getenv("SCAN_CONFIRMATIONS", "3")) # Only scan blocks this deep below head
+SCAN_START_BLOCK = os.getenv("SCAN_START_BLOCK") # First run only; defaults to the current safe head
+SCAN_MAX_BLOCK_RANGE = int(os.getenv("SCAN_MAX_BLOCK_RANGE", "2000")) # Largest eth_getLogs window
+SCAN_MAX_BLOCKS_PER_CALL = int(os.getenv("SCAN_MAX_BLOCKS_PER_CALL", "20000")) # Catch-up work per scan_for_new_pools() call
+SCAN_RANGE_GROW_AFTER = 5 # Consecutive successful eth_getLogs calls before widening the range again
+SCAN_REORG_REWIND_BLOCKS = int(os.getenv("SCAN_REORG_REWIND_BLOCKS", "64")) # How far back to rescan after a deep reorg
+SCAN_TIMESTAMP_MAX_BLOCKS = 50 # Look up block timestamps (for alert latency) only for small, live ranges
+SCANNER_CHECKPOINT_FILE = os.getenv("SCANNER_CHECKPOINT_FILE", "scanner_checkpoint.json")
+
+SCAN_RPC_MAX_RETRIES = int(os.getenv("SCAN_RPC_MAX_RETRIES", "3")) # Retries of one eth_getLogs call after a rate limit/timeout
+SCAN_RPC_BACKOFF_SECONDS = float(os.getenv("SCAN_RPC_BACKOFF_SECONDS", "1")) # Doubles on each retry
+
+# Provider error fragments meaning "narrow the block range and try again". Kept specific: a rate limit
+# ("429 Too Many Requests") or a network timeout says nothing about the range.
+RANGE_TOO_LARGE_MARKERS = (
+    "query returned more than",
+    "response size exceeded",
+    "log response size",
+    "block range",
+    "range is too large",
+    "range too large",
+    "too many results",
+    "query timeout exceeded",
+)
+
+# Fragments meaning "same request, later": rate limits and transport errors.
+RETRYABLE_ERROR_MARKERS = (
+    "429",
+    "too many requests",
+    "rate limit",
+    "request rate",
+    "timed out",
+    "timeout",
+    "connection",
+    "502",
+    "503",
+    "504",
+)
+
+# --- Web3 Connection ---
+def make_web3(rpc_url, poa=False):
+    """HTTP Web3 with RPC metrics (and the PoA extraData fix for BSC/Polygon-style chains)."""
+    web3 = Web3(Web3.HTTPProvider(rpc_url, request_kwargs={'timeout': 30}))
+    if poa:
+        web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+    web3.middleware_onion.add(web3_rpc_metrics_middleware, name='metrics') # Per-method RPC latency/errors
+    return web3
+
+w3 = make_web3(ETHEREUM_RPC, poa=USE_POA_MIDDLEWARE)
+
+# --- Helpers ---
+
+def _to_bytes(value):
+    """Normalizes HexBytes/bytes/hex-string log fields to bytes."""
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+
+def _to_hex(value):
+    return "0x" + _to_bytes(value).hex()
+
+def _is_range_too_large(error):
+    message = str(error).lower()
+    return any(marker in message for marker in RANGE_TOO_LARGE_MARKERS)
+
+def _is_retryable(error):
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RETRYABLE_ERROR_MARKERS)
+
+def _pool_event(log, pair, token0, token1, num_pairs, wrapped_native):
+    wrapped_native = (wrapped_native or WETH_ADDRESS).lower()
+    return {
+        'pair_address': pair,
+        'token0_address': token0,
+        'token1_address': token1,
+        'num_pairs_on_factory': num_pairs,
+        'block_number': log['blockNumber'],
+        'block_hash': _to_hex(log['blockHash']) if log.get('blockHash') is not None else None,
+        'transaction_hash': _to_hex(log['transactionHash']),
+        'log_index': log.get('logIndex'),
+        'factory_address': Web3.to_checksum_address(log['address']),
+        'is_weth_pair': wrapped_native in (token0.lower(), token1.lower()), # Paired with the chain's wrapped native token
+    }
+
+def decode_pair_created(log, wrapped_native=None):
+    """Decodes a Uniswap V2-style PairCreated log into the pool dict used for alerts."""
+    topics = log['topics']
+    data = _to_bytes(log['data'])
+    token0 = Web3.to_checksum_address(_to_bytes(topics[1])[-20:])
+    token1 = Web3.to_checksum_address(_to_bytes(topics[2])[-20:])
+    pair = Web3.to_checksum_address(data[12:32])
+    num_pairs = int.from_bytes(data[32:64], 'big') if len(data) >= 64 else None
+    return _pool_event(log, pair, token0, token1, num_pairs, wrapped_native)
+
+def decode_pool_created_v3(log, wrapped_native=None):
+    """Decodes a Uniswap V3-style PoolCreated log (token0, token1, fee indexed; tickSpacing, pool in data)."""
+    topics = log['topics']
+    data = _to_bytes(log['data'])
+    token0 = Web3.to_checksum_address(_to_bytes(topics[1])[-20:])
+    token1 = Web3.to_checksum_address(_to_bytes(topics[2])[-20:])
+    pool = _pool_event(log, Web3.to_checksum_address(data[44:64]), token0, token1, None, wrapped_native)
+    pool['fee_tier'] = int.from_bytes(_to_bytes(topics[3]), 'big')
+    return pool
+
+class FileCheckpoint:
+    """Persists the last fully processed block (and its hash) to a small JSON file."""
+
+    def __init__(self, path=SCANNER_CHECKPOINT_FILE):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logging.error(f"Could not read scanner checkpoint {self.path}: {e}")
+            return None
+
+    def save(self, block_number, block_hash):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({'last_processed_block': block_number, 'block_hash': block_hash}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path) # Atomic, so a crash never leaves a half-written checkpoint
+
+class DeferredCheckpoint:
+    """
+    Wraps a checkpoint so scans advance in memory only. `save()` records the progress a scan
+    made (later scans resume from it); `persist(state)` writes it to the wrapped checkpoint
+    once whatever the scan found has been handed off durably. A crash in between rescans
+    those blocks instead of losing their pools.
+    """
+
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
+        self.latest = None # Unpersisted progress, if any
+
+    def load(self):
+        return self.latest or self.checkpoint.load()
+
+    def save(self, block_number, block_hash):
+        self.latest = {'last_processed_block': block_number, 'block_hash': block_hash}
+
+    def persist(self, state):
+        self.checkpoint.save(state['last_processed_block'], state['block_hash'])
+
+class PoolScanner:
+    """
+    Pulls factory pool-creation logs (PairCreated by default; pass `topic`/`decoder` for
+    V3-style factories) over adaptive eth_getLogs block ranges.
+
+    Only blocks at least `confirmations` deep are scanned, and the hash of the last
+    processed block is checked on every run so a reorg deeper than that rewinds the
+    scan instead of silently skipping blocks. `web3` can be a real Web3 instance
+    (mainnet, anvil, hardhat) or any fake exposing eth.block_number, eth.get_logs
+    and eth.get_block.
+    """
+
+    def __init__(self, web3, factory_address=UNISWAP_V2_FACTORY, checkpoint=None,
+                 confirmations=SCAN_CONFIRMATIONS, start_block=SCAN_START_BLOCK,
+                 max_block_range=SCAN_MAX_BLOCK_RANGE, max_blocks_per_call=SCAN_MAX_BLOCKS_PER_CALL,
+                 token_resolver=None, topic=PAIR_CREATED_TOPIC, decoder=decode_pair_created,
+                 wrapped_native=WETH_ADDRESS, name="ethereum:uniswap_v2"):
+        self.w3 = web3
+        self.name = name
+        self.factory_address = Web3.to_checksum_address(factory_address)
+        self.topic = topic
+        self.decoder = decoder
+        self.wrapped_native = wrapped_native
+        self.checkpoint = checkpoint if checkpoint is not None else FileCheckpoint()
+        self.confirmations = confirmations
+        self.start_block = int(start_block) if start_block not in (None, "") else None
+        self.max_block_range = max_block_range
+        self.max_blocks_per_call = max_blocks_per_call
+        self.block_range = max_block_range
+        self._range_successes = 0
+        self.blocks_behind = 0 # Safe head minus last processed block after the latest scan
+        self.token_resolver = token_resolver if token_resolver is not None else TokenMetadataResolver(web3)
+        self._lock = threading.Lock()
+
+    def _block_hash(self, block_number):
+        return _to_hex(self.w3.eth.get_block(block_number)['hash'])
+
+    def _resume_block(self, safe_head):
+        """Returns the last processed block, rewinding if it was reorged out."""
+        state = self.checkpoint.load()
+        if not state:
+            start = self.start_block if self.start_block is not None else safe_head
+            logging.info(f"[{self.name}] No scanner checkpoint found; starting at block {start}.")
+            return start - 1
+        last = state['last_processed_block']
+        saved_hash = state.get('block_hash')
+        if saved_hash and last <= safe_head + self.confirmations:
+            current_hash = self._block_hash(last)
+            if current_hash.lower() != saved_hash.lower():
+                rewound = max(0, last - SCAN_REORG_REWIND_BLOCKS)
+                logging.warning(f"[{self.name}] Reorg detected at block {last} (hash changed); rescanning from block {rewound + 1}.")
+                return rewound
+        return last
+
+    def _get_logs(self, from_block, to_block):
+        return self.w3.eth.get_logs({
+            'fromBlock': from_block,
+            'toBlock': to_block,
+            'address': self.factory_address,
+            'topics': [self.topic],
+        })
+
+    def _attach_block_timestamps(self, pools):
+        timestamps = {}
+        for pool in pools:
+            number = pool['block_number']
+            if number not in timestamps:
+                try:
+                    timestamps[number] = self.w3.eth.get_block(number)['timestamp']
+                except Exception as e:
+                    logging.warning(f"Could not fetch timestamp for block {number}: {e}")
+                    timestamps[number] = None
+            pool['block_timestamp'] = timestamps[number]
+
+    def _enrich(self, pools):
+        """Attaches token0_info/token1_info, resolving every token in the cycle in one batch."""
+        if not pools:
+            return pools
+        addresses = [pool[key] for pool in pools for key in ('token0_address', 'token1_address')]
+        infos = self.token_resolver.resolve_many(addresses)
+        for pool in pools:
+            pool['token0_info'] = infos[pool['token0_address']]
+            pool['token1_info'] = infos[pool['token1_address']]
+        return pools
+
+    def scan(self):
+        """Scans from the checkpoint up to the safe head and returns newly created pools."""
+        with self._lock:
+            head = self.w3.eth.block_number
+            safe_head = head - self.confirmations
+            last = self._resume_block(safe_head)
+            if last >= safe_head:
+                self.blocks_behind = 0
+                return []
+
+            end = min(safe_head, last + self.max_blocks_per_call)
+            pools = []
+            from_block = last + 1
+            retries = 0
+            while from_block <= end:
+                to_block = min(from_block + self.block_range - 1, end)
+                try:
+                    logs = self._get_logs(from_block, to_block)
+                except Exception as e:
+                    if _is_range_too_large(e) and to_block > from_block:
+                        self.block_range = max(1, (to_block - from_block + 1) // 2)
+                        self._range_successes = 0
+                        logging.info(f"[{self.name}] eth_getLogs range too large; shrinking to {self.block_range} blocks.")
+                        continue
+                    if _is_retryable(e) and retries < SCAN_RPC_MAX_RETRIES:
+                        delay = SCAN_RPC_BACKOFF_SECONDS * (2 ** retries)
+                        retries += 1
+                        logging.warning(f"[{self.name}] eth_getLogs for blocks {from_block}-{to_block} failed ({e}); "
+                                        f"retrying the same range in {delay:.1f}s ({retries}/{SCAN_RPC_MAX_RETRIES}).")
+                        time.sleep(delay) # Runs in a worker thread
+                        continue
+                    # Keep what we have: checkpoint the progress made so far, retry the rest next cycle.
+                    logging.error(f"[{self.name}] eth_getLogs failed for blocks {from_block}-{to_block}: {e}")
+                    end = from_block - 1
+                    break
+                pools.extend(self.decoder(log, self.wrapped_native) for log in logs)
+                from_block = to_block + 1
+                retries = 0
+                self._range_successes += 1
+                if self.block_range < self.max_block_range and self._range_successes >= SCAN_RANGE_GROW_AFTER:
+                    self.block_range = min(self.max_block_range, self.block_range * 2)
+                    self._range_successes = 0
+
+            if pools and end - last <= SCAN_TIMESTAMP_MAX_BLOCKS:
+                self._attach_block_timestamps(pools)
+            if end > last:
+                self.checkpoint.save(end, self._block_hash(end))
+            self.blocks_behind = safe_head - max(end, last)
+            if pools or end - last > 1:
+                logging.info(f"[{self.name}] Scanned blocks {last + 1}-{end}: {len(pools)} new pool(s), {self.blocks_behind} block(s) behind.")
+            return self._enrich(pools)
+
+_scanner = None
+
+def get_scanner():
+    """Returns the process-wide PoolScanner for ETHEREUM_RPC."""
+    global _scanner
+    if _scanner is None:
+        _scanner = PoolScanner(w3)
+    return _scanner
+
+def scan_for_new_pools():
+    """
+    Returns pools created since the last call (blocking; run it in a worker thread,
+    e.g. `await asyncio.to_thread(scan_for_new_pools)`, from async code).
+    """
+    try:
+        return get_scanner().scan()
+    except Exception as e:
+        logging.error(f"Pool scan failed: {e}")
+        return []
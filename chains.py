@@ -0,0 +1,32 @@
+# chains.py
+# Per-chain constants shared by the scanners and alert formatting (explorers, wrapped native tokens, RPC env vars).
+
+import os
+
+CHAINS = {
+    'ethereum': {'name': 'Ethereum', 'rpc': os.getenv("ETHEREUM_RPC"), 'explorer': "https://etherscan.io",
+                 'wrapped_native': "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2", 'poa': False, 'scan_interval': 10},
+    'base': {'name': 'Base', 'rpc': os.getenv("BASE_RPC"), 'explorer': "https://basescan.org",
+             'wrapped_native': "0x4200000000000000000000000000000000000006", 'poa': False, 'scan_interval': 2},
+    'arbitrum': {'name': 'Arbitrum', 'rpc': os.getenv("ARBITRUM_RPC"), 'explorer': "https://arbiscan.io",
+                 'wrapped_native': "0x82aF49447D8a07e3bd95BD0d56f35241523fBab1", 'poa': False, 'scan_interval': 2},
+    'bsc': {'name': 'BNB Chain', 'rpc': os.getenv("BSC_RPC"), 'explorer': "https://bscscan.com",
+            'wrapped_native': "0xbb4CdB9CBd36B01bD1cBaEBF2De08d9173bc095c", 'poa': True, 'scan_interval': 3},
+    'polygon': {'name': 'Polygon', 'rpc': os.getenv("POLYGON_RPC"), 'explorer': "https://polygonscan.com",
+                'wrapped_native': "0x0d500B1d8E8eF31E21C99d1Db9A6444d3ADf1270", 'poa': True, 'scan_interval': 3},
+    'solana': {'name': 'Solana', 'rpc': os.getenv("HELIUS_RPC"), 'explorer': "https://solscan.io",
+               'wrapped_native': "So11111111111111111111111111111111111111112", 'poa': False, 'scan_interval': 2},
+}
+
+# Solscan calls addresses "accounts"; the EVM explorers all use /address/.
+EXPLORER_ADDRESS_PATHS = {'solana': 'account'}
+
+def explorer_url(chain, kind, value):
+    """Link to an address ('address') or transaction ('tx') on the chain's block explorer."""
+    base = CHAINS.get(chain, CHAINS['ethereum'])['explorer']
+    if kind == 'address':
+        return f"{base}/{EXPLORER_ADDRESS_PATHS.get(chain, 'address')}/{value}"
+    return f"{base}/tx/{value}"
+
+def chain_name(chain):
+    return CHAINS.get(chain, {}).get('name', chain.capitalize())
@@ -0,0 +1,269 @@
+# cluster.py
+# Multi-worker mode: several bot processes (on one or many hosts) share one Postgres. Alert
+# deliveries are split between them by a consistent hash of chat_id, and one elected leader
+# runs everything that must happen exactly once (Telegram updates, scanning, expiry sweeps).
+
+import os
+import socket
+import asyncio
+import bisect
+import hashlib
+import logging
+from async_db_manager import open_session, try_advisory_lock, heartbeat_cluster_member, remove_cluster_member, \
+                             prune_cluster_members, load_scanner_checkpoint, save_scanner_checkpoint, \
+                             get_seen_pool_keys, add_seen_pools, count_seen_pools
+from seen_pools import pool_key
+from metrics import CLUSTER_REBALANCES, CLUSTER_LEADER_ELECTIONS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+CLUSTER_ENABLED = os.getenv("CLUSTER_ENABLED", "false").lower() == "true"
+CLUSTER_WORKER_ID = os.getenv("CLUSTER_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}" # Unique per process
+CLUSTER_SHARDS = int(os.getenv("CLUSTER_SHARDS", "256")) # Stored on every delivery; all workers must agree, change only with an empty outbox
+CLUSTER_VNODES = int(os.getenv("CLUSTER_VNODES", "64")) # Ring points per worker; more = more even split
+CLUSTER_HEARTBEAT_SECONDS = float(os.getenv("CLUSTER_HEARTBEAT_SECONDS", "5"))
+CLUSTER_MEMBER_TTL_SECONDS = float(os.getenv("CLUSTER_MEMBER_TTL_SECONDS", "20")) # A worker is gone after this without a heartbeat
+CLUSTER_LEADER_LOCK_KEY = int(os.getenv("CLUSTER_LEADER_LOCK_KEY", "4201770")) # pg advisory lock id held by the leader
+CLUSTER_PRUNE_AFTER_SECONDS = 3600 # Dead members' rows are kept this long for inspection
+SHARED_STATE_TIMEOUT_SECONDS = 30 # Longest a scanner thread waits on a shared-state query
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big')
+
+def shard_for(chat_id, shards=CLUSTER_SHARDS):
+    """Delivery shard of a chat. Stable across processes and restarts (unlike hash())."""
+    return _hash64(str(chat_id)) % shards
+
+class ShardRing:
+    """
+    Consistent-hash ring over worker ids with `vnodes` points per worker. A shard belongs to
+    the first point clockwise of its own hash, so a worker joining or leaving only moves
+    about 1/N of the shards, and every worker computes the same owners from the same members.
+    """
+
+    def __init__(self, members, shards=CLUSTER_SHARDS, vnodes=CLUSTER_VNODES):
+        self.shards = shards
+        points = sorted((_hash64(f"{member}#{i}"), member) for member in members for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, shard):
+        if not self._owners:
+            return None
+        return self._owners[bisect.bisect(self._hashes, _hash64(f"shard:{shard}")) % len(self._owners)]
+
+    def shards_of(self, member):
+        return [shard for shard in range(self.shards) if self.owner(shard) == member]
+
+class LeadershipLost(Exception):
+    """The leader's lock session died; its leader-only tasks can't be trusted to be the only ones any more."""
+
+class Cluster:
+    """
+    Membership, shard ownership and leader election through Postgres.
+
+    Every worker upserts a heartbeat row each CLUSTER_HEARTBEAT_SECONDS and reads back the
+    live members; when that list changes it recomputes its shards on the ShardRing and calls
+    `on_rebalance(owned_shards, members)`. Workers that briefly disagree during a change are
+    harmless: deliveries are claimed with FOR UPDATE SKIP LOCKED under a lease, so two
+    workers never hold the same row.
+
+    The leader is whoever holds advisory lock CLUSTER_LEADER_LOCK_KEY on its dedicated
+    session. Postgres drops the lock as soon as that session ends, so a crashed leader is
+    replaced at the next heartbeat of a follower. A leader that loses its session raises
+    LeadershipLost instead of carrying on, since another worker may already be leading.
+    The session also carries LISTEN for `listeners` ({channel: callback()}).
+    """
+
+    def __init__(self, on_rebalance=None, listeners=None, worker_id=CLUSTER_WORKER_ID, shards=CLUSTER_SHARDS,
+                 heartbeat_interval=CLUSTER_HEARTBEAT_SECONDS, member_ttl=CLUSTER_MEMBER_TTL_SECONDS,
+                 lock_key=CLUSTER_LEADER_LOCK_KEY):
+        self.on_rebalance = on_rebalance
+        self.listeners = listeners or {}
+        self.worker_id = worker_id
+        self.shards = shards
+        self.heartbeat_interval = heartbeat_interval
+        self.member_ttl = max(member_ttl, 2 * heartbeat_interval)
+        self.lock_key = lock_key
+        self.members = []
+        self.owned_shards = []
+        self.is_leader = False
+        self.stats = {'members': 0, 'owned_shards': 0, 'is_leader': 0, 'rebalances': 0, 'heartbeat_errors': 0}
+        self._session = None
+
+    async def join(self):
+        """Registers this worker and takes its first share of shards; call before starting delivery workers."""
+        await self._heartbeat()
+        logging.info(f"Joined cluster as {self.worker_id}: {len(self.members)} member(s), "
+                     f"{len(self.owned_shards)}/{self.shards} shard(s) owned.")
+
+    async def _heartbeat(self):
+        members = await heartbeat_cluster_member(self.worker_id, len(self.owned_shards), self.is_leader, self.member_ttl)
+        if members != self.members:
+            self._rebalance(members)
+
+    def _rebalance(self, members):
+        owned = ShardRing(members, self.shards).shards_of(self.worker_id)
+        joined = sorted(set(members) - set(self.members))
+        left = sorted(set(self.members) - set(members))
+        moved = len(set(owned) ^ set(self.owned_shards))
+        self.members = members
+        self.owned_shards = owned
+        self.stats.update(members=len(members), owned_shards=len(owned), rebalances=self.stats['rebalances'] + 1)
+        CLUSTER_REBALANCES.inc()
+        logging.info(f"Cluster rebalanced ({len(members)} member(s); joined: {', '.join(joined) or '-'}; "
+                     f"left: {', '.join(left) or '-'}): {self.worker_id} owns {len(owned)} shard(s), {moved} moved.")
+        if self.on_rebalance is not None:
+            self.on_rebalance(owned, members)
+
+    async def _ensure_session(self):
+        if self._session is not None and not self._session.is_closed():
+            return self._session
+        self._session = await open_session()
+        for channel, callback in self.listeners.items():
+            await self._session.add_listener(channel, lambda *_, callback=callback: callback())
+        return self._session
+
+    async def _close_session(self):
+        session, self._session = self._session, None
+        if session is not None and not session.is_closed():
+            try:
+                await session.close(timeout=5)
+            except Exception:
+                session.terminate()
+
+    async def _lead_or_check(self):
+        """Followers try to take the leader lock; the leader proves its session (and so its lock) is still alive."""
+        if self.is_leader:
+            try:
+                await self._session.fetchval("SELECT 1")
+            except Exception as e:
+                raise LeadershipLost(f"Leader session lost: {e}") from e
+            return False
+        session = await self._ensure_session()
+        if await try_advisory_lock(session, self.lock_key):
+            self.is_leader = True
+            self.stats['is_leader'] = 1
+            CLUSTER_LEADER_ELECTIONS.inc()
+            logging.info(f"{self.worker_id} is now the cluster leader.")
+            return True
+        return False
+
+    async def run(self, lead):
+        """
+        Heartbeats until cancelled. Once elected, runs `lead()` (a coroutine function) alongside;
+        returns or raises whatever it does, and raises LeadershipLost if the lock session dies.
+        """
+        lead_task = None
+        try:
+            while True:
+                try:
+                    if await self._lead_or_check():
+                        lead_task = asyncio.create_task(lead())
+                except LeadershipLost:
+                    raise
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error(f"Cluster leader election error: {e}")
+                    await self._close_session() # Reconnects (and re-LISTENs) on the next round
+                try:
+                    await self._heartbeat()
+                    if self.is_leader:
+                        pruned = await prune_cluster_members(CLUSTER_PRUNE_AFTER_SECONDS)
+                        if pruned:
+                            logging.info(f"Pruned {len(pruned)} long-dead cluster member(s): {', '.join(pruned)}.")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats['heartbeat_errors'] += 1
+                    logging.error(f"Cluster heartbeat failed: {e}")
+
+                if lead_task is None:
+                    await asyncio.sleep(self.heartbeat_interval)
+                else:
+                    await asyncio.wait({lead_task}, timeout=self.heartbeat_interval)
+                    if lead_task.done():
+                        return lead_task.result()
+        finally:
+            if lead_task is not None and not lead_task.done():
+                lead_task.cancel()
+                await asyncio.gather(lead_task, return_exceptions=True)
+            self.is_leader = False
+            self.stats['is_leader'] = 0
+            await remove_cluster_member(self.worker_id)
+            await self._close_session()
+
+# --- Shared scan state ---
+# The leader's scan checkpoints and seen-pool index live in Postgres, so whichever node is elected
+# next resumes at the same block and suppresses the same pools. Scanners run on worker threads;
+# these adapters run their queries on the bot's event loop (`loop`) and wait for the result, so
+# they must never be called from the loop's own thread.
+
+def _run_on(loop, coro):
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(SHARED_STATE_TIMEOUT_SECONDS)
+
+class SharedCheckpoint:
+    """
+    Scanner checkpoint in the scanner_checkpoints table (same interface as FileCheckpoint).
+    `fallback`, the node's old checkpoint file if any, seeds the row on first use so switching
+    to cluster mode doesn't restart the scan.
+    """
+
+    def __init__(self, source, loop, fallback=None):
+        self.source = source
+        self.loop = loop
+        self.fallback = fallback
+
+    def load(self):
+        state = _run_on(self.loop, load_scanner_checkpoint(self.source))
+        if state is None and self.fallback is not None:
+            state = self.fallback.load()
+            if state:
+                logging.info(f"[{self.source}] Seeding the shared scanner checkpoint from {self.fallback.path}.")
+                self.save(state['last_processed_block'], state.get('block_hash'))
+        return state
+
+    def save(self, block_number, block_hash):
+        _run_on(self.loop, save_scanner_checkpoint(self.source, block_number, block_hash))
+
+class SharedSeenPoolIndex:
+    """Seen-pool index in the seen_pools table (same interface as seen_pools.SeenPoolIndex, without the local Bloom filter)."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.stats_counters = {'hits': 0, 'misses': 0, 'false_positives': 0, 'entries': 0}
+
+    def open(self):
+        self.stats_counters['entries'] = _run_on(self.loop, count_seen_pools())
+        logging.info(f"Shared seen-pool index ready: {self.stats_counters['entries']} pools.")
+        return self
+
+    def filter_unseen(self, pools, chain):
+        if not pools:
+            return pools
+        fresh = {}
+        for pool in pools:
+            fresh.setdefault(pool_key(chain, pool['pair_address']), pool)
+        seen = _run_on(self.loop, get_seen_pool_keys(fresh))
+        self.stats_counters['hits'] += len(pools) - len(fresh) + len(seen)
+        return [pool for key, pool in fresh.items() if key not in seen]
+
+    def mark_seen(self, pools, chain):
+        if not pools:
+            return
+        entries = {pool_key(chain, pool['pair_address']): pool.get('block_number') for pool in pools}
+        inserted = _run_on(self.loop, add_seen_pools(list(entries.items())))
+        self.stats_counters['misses'] += inserted
+        self.stats_counters['entries'] += inserted
+
+    def is_seen(self, chain, pair_address):
+        key = pool_key(chain, pair_address)
+        return key in _run_on(self.loop, get_seen_pool_keys([key]))
+
+    def stats(self):
+        return dict(self.stats_counters, bloom_bytes=0)
+
+    def close(self):
+        pass
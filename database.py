@@ -1,58 +1,181 @@
+import os
+import json
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+import time
+from contextlib import contextmanager
+from entitlements import EntitlementCache
+
+DB_PATH = os.getenv("SQLITE_DB_PATH", "ice_business.db")
+SCHEMA_VERSION = 3 # 1: TEXT expiry_date (legacy), 2: INTEGER epoch expires_at + index, 3: username
+REFERRALS_FOR_TRIAL = 3
+TRIAL_HOURS = 24
+
+# VIP expiries, so check_vip doesn't hit SQLite on every button press.
+entitlements = EntitlementCache()
+
+# One long-lived connection per thread (WAL lets readers run alongside the writer),
+# and one in-process write lock so writers queue here instead of spinning on SQLITE_BUSY.
+_local = threading.local()
+_write_lock = threading.Lock()
+
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # Durable across app crashes; WAL keeps the file consistent
+        conn.execute("PRAGMA busy_timeout=10000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000") # ~16 MB page cache
+        conn.execute("PRAGMA mmap_size=134217728")
+        conn.execute("PRAGMA foreign_keys=ON")
+        _local.conn = conn
+    return conn
+
+def close_db():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def write_transaction():
+    """Runs the block in one BEGIN IMMEDIATE transaction (write lock taken up front)."""
+    conn = get_connection()
+    with _write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+def _migrate(conn):
+    """Brings an existing ice_business.db up to SCHEMA_VERSION."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+    if 'expiry_date' in columns:
+        # v1 stored local-time 'YYYY-MM-DD HH:MM:SS' text; convert to UTC epoch seconds.
+        conn.execute('''CREATE TABLE users_v2
+                        (user_id INTEGER PRIMARY KEY,
+                         expires_at INTEGER,
+                         referrals INTEGER NOT NULL DEFAULT 0,
+                         trial_used INTEGER NOT NULL DEFAULT 0)''')
+        conn.execute('''INSERT INTO users_v2 (user_id, expires_at, referrals, trial_used)
+                        SELECT user_id,
+                               CAST(strftime('%s', expiry_date, 'utc') AS INTEGER),
+                               COALESCE(referrals, 0),
+                               COALESCE(trial_used, 0)
+                        FROM users''')
+        conn.execute("DROP TABLE users")
+        conn.execute("ALTER TABLE users_v2 RENAME TO users")
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+    if 'username' not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN username TEXT")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
 def init_db():
-    conn = sqlite3.connect('ice_business.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (user_id INTEGER PRIMARY KEY,
-                  expiry_date TEXT,
-                  referrals INTEGER DEFAULT 0,
-                  trial_used INTEGER DEFAULT 0)''')
-    conn.commit()
-    conn.close()
+    with write_transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS users
+                        (user_id INTEGER PRIMARY KEY,
+                         expires_at INTEGER,
+                         referrals INTEGER NOT NULL DEFAULT 0,
+                         trial_used INTEGER NOT NULL DEFAULT 0,
+                         username TEXT)''')
+        _migrate(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_expires_at ON users (expires_at) WHERE expires_at IS NOT NULL")
 
 def check_vip(user_id):
-    conn = sqlite3.connect('ice_business.db')
-    c = conn.cursor()
-    c.execute("SELECT expiry_date FROM users WHERE user_id = ?", (user_id,))
-    res = c.fetchone()
-    conn.close()
-    if res and res[0]:
-        expiry = datetime.strptime(res[0], '%Y-%m-%d %H:%M:%S')
-        return expiry > datetime.now()
-    return False
+    cached = entitlements.is_premium(user_id)
+    if cached is not None:
+        return cached
+    res = get_connection().execute("SELECT expires_at FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    expires_at = res[0] if res else None
+    entitlements.put(user_id, 'premium' if expires_at else 'free', expires_at)
+    return expires_at is not None and expires_at > time.time()
+
+def _grant(conn, user_id, hours):
+    """Extends (or starts) a subscription inside the caller's transaction; keeps referral counters."""
+    now = int(time.time())
+    conn.execute('''INSERT INTO users (user_id, expires_at) VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE
+                    SET expires_at = MAX(COALESCE(users.expires_at, 0), ?) + ?''',
+                 (user_id, now + int(hours * 3600), now, int(hours * 3600)))
+    return conn.execute("SELECT expires_at FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
 
 def add_sub(user_id, hours):
-    conn = sqlite3.connect('ice_business.db')
-    c = conn.cursor()
-    expiry = datetime.now() + timedelta(hours=hours)
-    c.execute("INSERT OR REPLACE INTO users (user_id, expiry_date) VALUES (?, ?)",
-              (user_id, expiry.strftime('%Y-%m-%d %H:%M:%S')))
-    conn.commit()
-    conn.close()
+    with write_transaction() as conn:
+        expires_at = _grant(conn, user_id, hours)
+    entitlements.put(user_id, 'premium', expires_at)
 
 def do_referral(ref_id):
-    conn = sqlite3.connect('ice_business.db')
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (ref_id,))
-    c.execute("UPDATE users SET referrals = referrals + 1 WHERE user_id = ?", (ref_id,))
-    c.execute("SELECT referrals, trial_used FROM users WHERE user_id = ?", (ref_id,))
-    res = c.fetchone()
-    if res and res[0] >= 3 and res[1] == 0:
-        c.execute("UPDATE users SET trial_used = 1 WHERE user_id = ?", (ref_id,))
-        conn.commit()
-        conn.close()
-        add_sub(ref_id, 24)
-        return True
-    conn.commit()
-    conn.close()
-    return False
+    """Counts a referral and grants the free trial at REFERRALS_FOR_TRIAL, all in one transaction."""
+    with write_transaction() as conn:
+        conn.execute('''INSERT INTO users (user_id, referrals) VALUES (?, 1)
+                        ON CONFLICT(user_id) DO UPDATE SET referrals = users.referrals + 1''', (ref_id,))
+        referrals, trial_used = conn.execute("SELECT referrals, trial_used FROM users WHERE user_id = ?",
+                                             (ref_id,)).fetchone()
+        if referrals < REFERRALS_FOR_TRIAL or trial_used:
+            return False
+        conn.execute("UPDATE users SET trial_used = 1 WHERE user_id = ?", (ref_id,))
+        expires_at = _grant(conn, ref_id, TRIAL_HOURS)
+    entitlements.put(ref_id, 'premium', expires_at)
+    return True
 
 def get_stats(user_id):
-    conn = sqlite3.connect('ice_business.db')
-    c = conn.cursor()
-    c.execute("SELECT referrals, trial_used FROM users WHERE user_id = ?", (user_id,))
-    res = c.fetchone()
-    conn.close()
+    res = get_connection().execute("SELECT referrals, trial_used FROM users WHERE user_id = ?", (user_id,)).fetchone()
     return res if res else (0, 0)
+
+# --- Bulk operations (one statement or one transaction per call, whatever the number of users) ---
+
+def _id_list(user_ids):
+    return json.dumps([int(user_id) for user_id in user_ids]) # Bound as one parameter, expanded by json_each
+
+def get_users(user_ids):
+    """{user_id: {'username', 'expires_at', 'referrals', 'trial_used'}} for the users that exist."""
+    rows = get_connection().execute('''SELECT user_id, username, expires_at, referrals, trial_used FROM users
+                                       WHERE user_id IN (SELECT value FROM json_each(?))''', (_id_list(user_ids),))
+    return {user_id: {'username': username, 'expires_at': expires_at, 'referrals': referrals, 'trial_used': trial_used}
+            for user_id, username, expires_at, referrals, trial_used in rows}
+
+def upsert_users(rows):
+    """Creates missing users and sets usernames for [(user_id, username)]; a None username keeps the old one."""
+    with write_transaction() as conn:
+        conn.executemany('''INSERT INTO users (user_id, username) VALUES (?, ?)
+                            ON CONFLICT(user_id) DO UPDATE SET username = COALESCE(excluded.username, users.username)''',
+                         rows)
+
+def extend_users(user_ids, seconds):
+    """Adds `seconds` to each user's subscription (from now if none is running); returns {user_id: expires_at}."""
+    now = int(time.time())
+    with write_transaction() as conn:
+        rows = conn.execute('''INSERT INTO users (user_id, expires_at) SELECT value, ? FROM json_each(?) WHERE true
+                               ON CONFLICT(user_id) DO UPDATE
+                               SET expires_at = MAX(COALESCE(users.expires_at, 0), ?) + ?
+                               RETURNING user_id, expires_at''',
+                            (now + int(seconds), _id_list(set(user_ids)), now, int(seconds))).fetchall()
+    expires = dict(rows)
+    for user_id, expires_at in expires.items():
+        entitlements.put(user_id, 'premium', expires_at)
+    return expires
+
+def expire_users(user_ids=None):
+    """Clears subscriptions that have ended (only for `user_ids` if given); returns the user_ids cleared."""
+    now = int(time.time())
+    with write_transaction() as conn:
+        if user_ids is None:
+            rows = conn.execute("UPDATE users SET expires_at = NULL WHERE expires_at <= ? RETURNING user_id", (now,))
+        else:
+            rows = conn.execute('''UPDATE users SET expires_at = NULL
+                                   WHERE expires_at <= ? AND user_id IN (SELECT value FROM json_each(?))
+                                   RETURNING user_id''', (now, _id_list(user_ids)))
+        expired = [row[0] for row in rows]
+    entitlements.expire(expired)
+    return expired
+
+def get_active_vip_ids():
+    return [row[0] for row in get_connection().execute("SELECT user_id FROM users WHERE expires_at > ?", (int(time.time()),))]
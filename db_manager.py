@@ -1,16 +1,29 @@
 # db_manager.py
 
 import os
+import time
+import threading
 import psycopg2
+import psycopg2.extensions
 import logging
-from datetime import datetime, timedelta
+from collections import deque
+from contextlib import contextmanager
+from metrics import timed_db
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# --- Connection Pool Configuration ---
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_CHECKOUT_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT_SECONDS", "10"))
+DB_POOL_MAX_IDLE_SECONDS = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300")) # Close idle connections above min size after this
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", "3600")) # Recycle connections older than this
+DB_POOL_HEALTHCHECK_AFTER_SECONDS = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER_SECONDS", "30")) # Ping connections idle longer than this
+
 def get_db_connection():
-    """Establishes and returns a database connection."""
+    """Establishes and returns a new (unpooled) database connection."""
     if not DATABASE_URL:
         logging.error("DATABASE_URL environment variable is not set.")
         raise ValueError("DATABASE_URL is required for database operations.")
@@ -21,144 +34,384 @@ def get_db_connection():
         logging.error(f"Error connecting to the database: {e}")
         raise
 
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time."""
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections.
+    Connections are health-checked on checkout, rolled back on return,
+    and recycled once they sit idle or live too long.
+    """
+
+    def __init__(self, connect, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT_SECONDS, max_idle=DB_POOL_MAX_IDLE_SECONDS,
+                 max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS, healthcheck_after=DB_POOL_HEALTHCHECK_AFTER_SECONDS):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool bounds: min_size={min_size}, max_size={max_size}")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.healthcheck_after = healthcheck_after
+
+        self._cond = threading.Condition()
+        self._idle = deque() # (conn, created_at, last_used_at), most recently used on the right
+        self._created_at = {} # id(conn) -> creation time, for every open connection
+        self._size = 0 # Open connections, idle + checked out (+ being opened)
+        self._closed = False
+        self._stats = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'checkout_waits': 0,
+            'checkout_timeouts': 0,
+            'healthcheck_failures': 0,
+            'recycled_idle': 0,
+            'recycled_lifetime': 0,
+            'wait_time_total_seconds': 0.0,
+        }
+
+    # --- Internal helpers ---
+
+    def _open(self):
+        """Opens a new connection. The caller must already have reserved a slot in self._size."""
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def _discard(self, conn, reason=None):
+        """Closes a connection and frees its slot."""
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception as e:
+            logging.warning(f"Error closing pooled connection: {e}")
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._size -= 1
+            self._stats['connections_closed'] += 1
+            if reason:
+                self._stats[reason] += 1
+            self._cond.notify()
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.healthcheck_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logging.warning(f"Pooled connection failed health check: {e}")
+            return False
+
+    def _collect_expired_locked(self, now):
+        """Pops idle connections that outlived max_idle/max_lifetime. Must hold self._cond."""
+        expired = []
+        kept = deque()
+        for entry in self._idle:
+            conn, created_at, last_used_at = entry
+            open_count = self._size - len(expired)
+            if now - created_at >= self.max_lifetime:
+                expired.append((conn, 'recycled_lifetime'))
+            elif now - last_used_at >= self.max_idle and open_count > self.min_size:
+                expired.append((conn, 'recycled_idle'))
+            else:
+                kept.append(entry)
+        self._idle = kept
+        return expired
+
+    # --- Public API ---
+
+    def getconn(self):
+        """Checks out a healthy connection, opening one if the pool has room."""
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+        wait_started = time.monotonic()
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed.")
+                expired = self._collect_expired_locked(time.monotonic())
+                entry = self._idle.pop() if self._idle else None
+                reserve = entry is None and self._size < self.max_size
+                if reserve:
+                    self._size += 1
+                if entry is None and not reserve and not expired:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['checkout_timeouts'] += 1
+                        raise PoolTimeoutError(f"Timed out after {self.checkout_timeout}s waiting for a database connection.")
+                    if not waited:
+                        waited = True
+                        self._stats['checkout_waits'] += 1
+                    self._cond.wait(remaining)
+                    continue
+
+            for conn, reason in expired:
+                self._discard(conn, reason)
+
+            if entry is not None:
+                conn, created_at, last_used_at = entry
+                if not self._is_healthy(conn, time.monotonic() - last_used_at):
+                    with self._cond:
+                        self._stats['healthcheck_failures'] += 1
+                    self._discard(conn)
+                    continue
+            elif reserve:
+                conn = self._open()
+            else:
+                continue
+
+            with self._cond:
+                self._stats['checkouts'] += 1
+                if waited:
+                    self._stats['wait_time_total_seconds'] += time.monotonic() - wait_started
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception as e:
+                logging.warning(f"Discarding pooled connection that failed to reset: {e}")
+                discard = True
+        if discard or conn.closed or self._closed:
+            self._discard(conn)
+            return
+        now = time.monotonic()
+        with self._cond:
+            created_at = self._created_at.get(id(conn), now)
+            if now - created_at >= self.max_lifetime:
+                recycle = True
+            else:
+                recycle = False
+                self._idle.append((conn, created_at, now))
+                self._cond.notify()
+        if recycle:
+            self._discard(conn, 'recycled_lifetime')
+
+    @contextmanager
+    def connection(self):
+        """Context manager for a single checkout. Broken connections are dropped instead of reused."""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def prefill(self):
+        """Opens connections up to min_size so the first requests don't pay connect latency."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            conn = self._open()
+            self.putconn(conn)
+
+    def stats(self):
+        """Returns a snapshot of pool counters and current occupancy."""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+            return snapshot
+
+    def close(self):
+        """Closes idle connections and refuses new checkouts. In-use connections are closed when returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(get_db_connection)
+                logging.info(f"Database connection pool created (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}).")
+    return _pool
+
+@contextmanager
+def db_connection():
+    """Checks a connection out of the shared pool for the duration of the block."""
+    with get_db_pool().connection() as conn:
+        yield conn
+
+def get_db_pool_stats():
+    """Returns connection pool statistics (empty if the pool was never used)."""
+    return _pool.stats() if _pool else {}
+
+def close_db_pool():
+    """Closes the shared connection pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+@timed_db
 def initialize_db():
     """
     Ensures the 'subscribers' table exists.
     """
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS subscribers (
-                chat_id BIGINT PRIMARY KEY,
-                username TEXT,
-                status TEXT DEFAULT 'free', -- 'free', 'pending_payment', 'premium'
-                subscribed_until TIMESTAMP WITH TIME ZONE,
-                last_payment_tx TEXT,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-            );
-        """)
-        conn.commit()
+        pool = get_db_pool()
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    chat_id BIGINT PRIMARY KEY,
+                    username TEXT,
+                    status TEXT DEFAULT 'free', -- 'free', 'pending_payment', 'premium'
+                    subscribed_until TIMESTAMP WITH TIME ZONE,
+                    last_payment_tx TEXT,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                );
+            """)
+            cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS alert_mode TEXT NOT NULL DEFAULT 'realtime';")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_subscribers_premium_expiry
+                ON subscribers (subscribed_until) WHERE status = 'premium';
+            """)
+            conn.commit()
+        pool.prefill()
         logging.info("Database initialized successfully: 'subscribers' table checked/created.")
     except Exception as e:
         logging.error(f"Error initializing database: {e}")
         raise
-    finally:
-        if conn:
-            conn.close()
 
+@timed_db
 def get_subscriber(chat_id):
     """Retrieves a subscriber's information."""
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM subscribers WHERE chat_id = %s", (chat_id,))
-        subscriber = cur.fetchone()
-        if subscriber:
-            # Convert tuple to dictionary for easier access
-            columns = [desc[0] for desc in cur.description]
-            return dict(zip(columns, subscriber))
-        return None
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM subscribers WHERE chat_id = %s", (chat_id,))
+            subscriber = cur.fetchone()
+            if subscriber:
+                # Convert tuple to dictionary for easier access
+                columns = [desc[0] for desc in cur.description]
+                return dict(zip(columns, subscriber))
+            return None
     except Exception as e:
         logging.error(f"Error getting subscriber {chat_id}: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
+@timed_db
 def create_or_update_subscriber(chat_id, username):
     """Creates a new subscriber or updates an existing one's username."""
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO subscribers (chat_id, username, updated_at)
-            VALUES (%s, %s, NOW())
-            ON CONFLICT (chat_id) DO UPDATE SET username = EXCLUDED.username, updated_at = NOW();
-        """, (chat_id, username))
-        conn.commit()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO subscribers (chat_id, username, updated_at)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (chat_id) DO UPDATE SET username = EXCLUDED.username, updated_at = NOW();
+            """, (chat_id, username))
+            conn.commit()
         logging.info(f"Subscriber {chat_id} ({username}) created or updated.")
     except Exception as e:
         logging.error(f"Error creating/updating subscriber {chat_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
 
+@timed_db
 def update_subscription_status(chat_id, status, duration_days=None, tx_hash=None):
     """
     Updates a subscriber's status and expiry.
     Status can be 'free', 'pending_payment', 'premium'.
     """
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Default to existing subscribed_until if not extending premium
-        subscribed_until_clause = ""
-        if status == 'premium' and duration_days:
-            # Extend current subscription or set a new one
-            existing_sub = get_subscriber(chat_id)
-            if existing_sub and existing_sub['subscribed_until'] and existing_sub['subscribed_until'] > datetime.now(existing_sub['subscribed_until'].tzinfo):
-                 new_expiry = existing_sub['subscribed_until'] + timedelta(days=duration_days)
-            else:
-                 new_expiry = datetime.now() + timedelta(days=duration_days)
-            subscribed_until_clause = f", subscribed_until = '{new_expiry.isoformat()}'"
-        elif status == 'free':
-            subscribed_until_clause = ", subscribed_until = NULL" # Remove expiry for free users
-
-        tx_hash_clause = f", last_payment_tx = '{tx_hash}'" if tx_hash else ""
-
-        cur.execute(f"""
-            UPDATE subscribers SET status = %s {subscribed_until_clause} {tx_hash_clause}, updated_at = NOW()
-            WHERE chat_id = %s;
-        """, (status, chat_id))
-        conn.commit()
+        with db_connection() as conn:
+            cur = conn.cursor()
+
+            # Default to existing subscribed_until if not extending premium
+            subscribed_until_clause = ""
+            params = [status]
+            if status == 'premium' and duration_days:
+                # Extend current subscription or set a new one, in the same statement
+                # (no second connection/round trip to read the old expiry first)
+                subscribed_until_clause = ", subscribed_until = GREATEST(COALESCE(subscribed_until, NOW()), NOW()) + make_interval(days => %s)"
+                params.append(int(duration_days))
+            elif status == 'free':
+                subscribed_until_clause = ", subscribed_until = NULL" # Remove expiry for free users
+
+            tx_hash_clause = ""
+            if tx_hash:
+                tx_hash_clause = ", last_payment_tx = %s"
+                params.append(tx_hash)
+            params.append(chat_id)
+
+            cur.execute(f"""
+                UPDATE subscribers SET status = %s {subscribed_until_clause} {tx_hash_clause}, updated_at = NOW()
+                WHERE chat_id = %s;
+            """, params)
+            conn.commit()
         logging.info(f"Subscription status for {chat_id} updated to '{status}'.")
     except Exception as e:
         logging.error(f"Error updating subscription status for {chat_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
 
+@timed_db
 def get_active_premium_subscribers():
     """Retrieves all chat_ids of active premium subscribers."""
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT chat_id FROM subscribers WHERE status = 'premium' AND subscribed_until > NOW();")
-        return [row[0] for row in cur.fetchall()]
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT chat_id FROM subscribers WHERE status = 'premium' AND subscribed_until > NOW();")
+            return [row[0] for row in cur.fetchall()]
     except Exception as e:
         logging.error(f"Error getting active premium subscribers: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
+@timed_db
 def check_and_update_expired_subscriptions():
     """Sets expired premium subscribers back to 'free' status."""
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            UPDATE subscribers
-            SET status = 'free', subscribed_until = NULL, updated_at = NOW()
-            WHERE status = 'premium' AND subscribed_until <= NOW();
-        """)
-        updated_count = cur.rowcount
-        if updated_count > 0:
-            logging.info(f"Updated {updated_count} expired premium subscriptions to 'free'.")
-            conn.commit()
-        return updated_count
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE subscribers
+                SET status = 'free', subscribed_until = NULL, updated_at = NOW()
+                WHERE status = 'premium' AND subscribed_until <= NOW();
+            """)
+            updated_count = cur.rowcount
+            if updated_count > 0:
+                logging.info(f"Updated {updated_count} expired premium subscriptions to 'free'.")
+                conn.commit()
+            return updated_count
     except Exception as e:
         logging.error(f"Error checking and updating expired subscriptions: {e}")
         return 0
-    finally:
-        if conn:
-            conn.close()
@@ -0,0 +1,155 @@
+# dexscreener.py
+# Shared, cached DexScreener client: one pooled aiohttp session, short-TTL cache with
+# stale-while-revalidate, single-flight request coalescing and a circuit breaker.
+
+import os
+import time
+import asyncio
+import logging
+import aiohttp
+from metrics import HTTP_UPSTREAM_LATENCY
+
+# --- Configuration ---
+DEXSCREENER_BOOSTS_URL = "https://api.dexscreener.com/token-boosts/latest/v1"
+DEXSCREENER_CACHE_TTL_SECONDS = float(os.getenv("DEXSCREENER_CACHE_TTL_SECONDS", "30")) # Served without revalidating
+DEXSCREENER_STALE_TTL_SECONDS = float(os.getenv("DEXSCREENER_STALE_TTL_SECONDS", "600")) # Served while revalidating / upstream is down
+DEXSCREENER_TIMEOUT_SECONDS = float(os.getenv("DEXSCREENER_TIMEOUT_SECONDS", "5"))
+DEXSCREENER_MAX_CONNECTIONS = int(os.getenv("DEXSCREENER_MAX_CONNECTIONS", "10"))
+CIRCUIT_FAILURE_THRESHOLD = 5 # Consecutive failures before the circuit opens
+CIRCUIT_RESET_SECONDS = 30 # How long the circuit stays open before one trial request
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that keeps failing."""
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open (one trial) after a cool-down."""
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logging.warning(f"Circuit opened after {self.failures} consecutive upstream failures.")
+            self.opened_at = time.monotonic()
+
+class DexScreenerClient:
+    """Cached JSON GETs against api.dexscreener.com. Safe to share across all handlers."""
+
+    def __init__(self, ttl=DEXSCREENER_CACHE_TTL_SECONDS, stale_ttl=DEXSCREENER_STALE_TTL_SECONDS,
+                 timeout=DEXSCREENER_TIMEOUT_SECONDS, max_connections=DEXSCREENER_MAX_CONNECTIONS):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.breaker = CircuitBreaker()
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'upstream_requests': 0,
+                      'upstream_errors': 0, 'coalesced': 0, 'circuit_rejections': 0}
+        self._session = None
+        self._cache = {} # url -> (fetched_at, data)
+        self._in_flight = {} # url -> asyncio.Task
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _fetch(self, url):
+        if not self.breaker.allow():
+            self.stats['circuit_rejections'] += 1
+            raise CircuitOpenError(f"Circuit open for DexScreener; not calling {url}")
+        self.stats['upstream_requests'] += 1
+        started = time.perf_counter()
+        try:
+            async with self._get_session().get(url) as resp:
+                if resp.status != 200:
+                    raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status,
+                                                      message=f"Unexpected status {resp.status}")
+                data = await resp.json()
+        except Exception:
+            self.stats['upstream_errors'] += 1
+            self.breaker.record_failure()
+            raise
+        finally:
+            HTTP_UPSTREAM_LATENCY.labels('dexscreener').observe(time.perf_counter() - started)
+        self.breaker.record_success()
+        self._cache[url] = (time.monotonic(), data)
+        return data
+
+    def _fetch_single_flight(self, url):
+        """Returns the in-flight task for `url`, starting one if none is running."""
+        task = self._in_flight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url))
+            self._in_flight[url] = task
+            task.add_done_callback(lambda t: self._in_flight.pop(url, None))
+            # Background refreshes may finish with nobody awaiting them; don't log "exception never retrieved".
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.stats['coalesced'] += 1
+        return task
+
+    async def get_json(self, url, default=None):
+        """
+        Returns the cached body for `url` if it is fresh; if it is merely stale, returns it
+        and refreshes in the background. Otherwise fetches (sharing one request among all
+        concurrent callers). Falls back to stale data, then `default`, if the fetch fails.
+        """
+        entry = self._cache.get(url)
+        now = time.monotonic()
+        if entry is not None:
+            age = now - entry[0]
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                return entry[1]
+            if age < self.stale_ttl:
+                self.stats['stale_hits'] += 1
+                self._fetch_single_flight(url)
+                return entry[1]
+        self.stats['misses'] += 1
+        try:
+            return await asyncio.shield(self._fetch_single_flight(url))
+        except CircuitOpenError:
+            pass
+        except Exception as e:
+            logging.error(f"DexScreener request failed for {url}: {e}")
+        return entry[1] if entry is not None else default
+
+    async def fetch_latest_boosts(self):
+        """Latest boosted tokens (the 'alpha' feed)."""
+        return await self.get_json(DEXSCREENER_BOOSTS_URL, default=[])
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,129 @@
+# entitlements.py
+# In-memory entitlement (VIP/premium) cache shared by the SQLite and Postgres data layers.
+
+import os
+import time
+import heapq
+import threading
+from collections import OrderedDict
+
+ENTITLEMENT_CACHE_MAX_ENTRIES = int(os.getenv("ENTITLEMENT_CACHE_MAX_ENTRIES", "100000"))
+ENTITLEMENT_CACHE_TTL_SECONDS = float(os.getenv("ENTITLEMENT_CACHE_TTL_SECONDS", "300")) # Bounds staleness from out-of-band writes
+
+class EntitlementCache:
+    """
+    Per-user cache of subscription status with precomputed expiry timestamps (epoch seconds),
+    plus an incrementally maintained set of active premium users.
+
+    Writers must call `put()` with the state they just wrote (or `invalidate()` when they
+    don't know it), so reads never see a stale upgrade/downgrade from this process.
+    The per-user map is an LRU bounded by `max_entries`; the active set holds exactly the
+    premium users and shrinks as their expiries pass (tracked with a min-heap).
+    """
+
+    def __init__(self, max_entries=ENTITLEMENT_CACHE_MAX_ENTRIES, ttl=ENTITLEMENT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # user_id -> {'status', 'expires_at', 'record', 'cached_at'}
+        self._active = {} # user_id -> expires_at, for premium users not yet expired
+        self._expiry_heap = [] # (expires_at, user_id); entries that no longer match _active are skipped
+        self._active_loaded = False
+        self._active_loaded_at = 0.0
+        self._lock = threading.RLock()
+
+    # --- Per-user entries ---
+
+    def get(self, user_id):
+        """Returns the cached entry dict, or None if unknown/too old."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.time() - entry['cached_at'] > self.ttl:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry
+
+    def is_premium(self, user_id, now=None):
+        """True/False if the user is cached, None if the caller must ask the database."""
+        entry = self.get(user_id)
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        return entry['status'] == 'premium' and entry['expires_at'] is not None and entry['expires_at'] > now
+
+    def put(self, user_id, status, expires_at, record=None):
+        """Records the authoritative state for a user (after a read or a write)."""
+        with self._lock:
+            self._entries[user_id] = {'status': status, 'expires_at': expires_at, 'record': record,
+                                      'cached_at': time.time()}
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._set_active(user_id, status, expires_at)
+
+    def invalidate(self, user_id):
+        """Forgets the per-user entry (the active set is only changed through put()/expire())."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def expire(self, user_ids):
+        """Marks users as downgraded to free (e.g. after an expiry sweep)."""
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+                self._active.pop(user_id, None)
+
+    # --- Active premium set ---
+
+    def _set_active(self, user_id, status, expires_at):
+        if status == 'premium' and expires_at is not None and expires_at > time.time():
+            if self._active.get(user_id) != expires_at:
+                self._active[user_id] = expires_at
+                heapq.heappush(self._expiry_heap, (expires_at, user_id))
+        else:
+            self._active.pop(user_id, None)
+
+    def _prune_expired(self, now):
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, user_id = heapq.heappop(heap)
+            if self._active.get(user_id) == expires_at:
+                del self._active[user_id]
+        if len(heap) > 2 * len(self._active) + 1024:
+            # Too many superseded heap entries; rebuild from the live set.
+            self._expiry_heap = [(exp, uid) for uid, exp in self._active.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def load_active(self, active):
+        """Replaces the active set with {user_id: expires_at} fetched from the database."""
+        with self._lock:
+            self._active = dict(active)
+            self._expiry_heap = [(exp, uid) for uid, exp in self._active.items()]
+            heapq.heapify(self._expiry_heap)
+            self._active_loaded = True
+            self._active_loaded_at = time.time()
+
+    def active_loaded(self, max_age=None):
+        """True if the active set has been loaded (and, with max_age, is recent enough)."""
+        with self._lock:
+            if not self._active_loaded:
+                return False
+            return max_age is None or time.time() - self._active_loaded_at < max_age
+
+    def active_ids(self, now=None):
+        """Returns the chat/user IDs whose premium is active right now."""
+        with self._lock:
+            self._prune_expired(time.time() if now is None else now)
+            return list(self._active)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'active': len(self._active),
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / total, 4) if total else 0.0}
@@ -0,0 +1,134 @@
+# expiry_scheduler.py
+# Timer-driven premium expiry: downgrades subscribers within seconds of their expiry
+# (and optionally reminds them beforehand) instead of sweeping the whole table hourly.
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from async_db_manager import get_upcoming_expiries, expire_subscriptions
+
+# --- Configuration ---
+EXPIRY_WINDOW_SECONDS = float(os.getenv("EXPIRY_WINDOW_SECONDS", "3600")) # How far ahead each reload looks
+EXPIRY_RELOAD_SECONDS = float(os.getenv("EXPIRY_RELOAD_SECONDS", "900")) # Reload cadence; must be < window
+EXPIRY_BATCH_GRACE_SECONDS = 1.0 # Expiries this close together are downgraded in one statement
+RENEWAL_REMINDER_LEAD_SECONDS = float(os.getenv("RENEWAL_REMINDER_LEAD_SECONDS", "0")) # e.g. 86400; 0 disables reminders
+
+EXPIRE = 'expire'
+REMIND = 'remind'
+
+class ExpiryScheduler:
+    """
+    Keeps the next window of premium expiries in a min-heap and sleeps until the earliest one.
+
+    Each reload reads only rows in the window (served by the partial index on
+    subscribers(subscribed_until) WHERE status = 'premium'), so the cost scales with
+    the number of expiring rows rather than the table size. Expiries falling within
+    EXPIRY_BATCH_GRACE_SECONDS of each other are downgraded with one UPDATE, and the
+    UPDATE itself re-checks subscribed_until, so renewals made after a reload are safe.
+    """
+
+    def __init__(self, on_expired=None, on_reminder=None, window=EXPIRY_WINDOW_SECONDS,
+                 reload_interval=EXPIRY_RELOAD_SECONDS, reminder_lead=RENEWAL_REMINDER_LEAD_SECONDS):
+        self.on_expired = on_expired # async callback(chat_ids)
+        self.on_reminder = on_reminder # async callback(chat_id, expires_at_ts)
+        self.window = window
+        self.reload_interval = min(reload_interval, window)
+        self.reminder_lead = reminder_lead if on_reminder else 0
+        self._heap = [] # (fire_at, kind, chat_id, expires_at)
+        self._expiry_of = {} # chat_id -> latest known expiry ts; stale heap entries are skipped
+        self._reminded = set() # (chat_id, expires_at) already reminded
+        self._next_reload_at = 0.0
+        self._wakeup = asyncio.Event()
+        self.stats = {'reloads': 0, 'rows_loaded': 0, 'batches': 0, 'downgraded': 0, 'reminders': 0,
+                      'max_lag_seconds': 0.0}
+
+    def schedule(self, chat_id, expires_at):
+        """Registers a (new or extended) expiry, e.g. right after a payment or grant."""
+        now = time.time()
+        self._expiry_of[chat_id] = expires_at
+        if expires_at - now <= self.window:
+            heapq.heappush(self._heap, (expires_at, EXPIRE, chat_id, expires_at))
+        if self.reminder_lead and (chat_id, expires_at) not in self._reminded and \
+                expires_at - self.reminder_lead - now <= self.window:
+            heapq.heappush(self._heap, (expires_at - self.reminder_lead, REMIND, chat_id, expires_at))
+        self._wakeup.set()
+
+    async def reload(self):
+        rows = await get_upcoming_expiries(self.window + self.reminder_lead)
+        self._heap = []
+        self._expiry_of = {}
+        for chat_id, subscribed_until in rows:
+            self.schedule(chat_id, subscribed_until.timestamp())
+        self._next_reload_at = time.time() + self.reload_interval
+        self.stats['reloads'] += 1
+        self.stats['rows_loaded'] += len(rows)
+        logging.info(f"Expiry scheduler loaded {len(rows)} upcoming expiry(ies); next at "
+                     f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self._heap[0][0])) if self._heap else 'n/a'}.")
+
+    def _pop_due(self, now):
+        """Pops all due heap entries, grouped by kind, dropping superseded ones."""
+        due_expiries, due_reminders, not_yet = [], [], []
+        while self._heap and self._heap[0][0] <= now + EXPIRY_BATCH_GRACE_SECONDS:
+            entry = heapq.heappop(self._heap)
+            fire_at, kind, chat_id, expires_at = entry
+            if self._expiry_of.get(chat_id) != expires_at:
+                continue
+            if kind == EXPIRE:
+                if expires_at > now:
+                    # Inside the grace period but not expired yet; the UPDATE guard would skip it.
+                    # Set aside rather than stopping, so reminders queued behind it still fire.
+                    not_yet.append(entry)
+                    continue
+                due_expiries.append(chat_id)
+                self.stats['max_lag_seconds'] = max(self.stats['max_lag_seconds'], round(now - expires_at, 3))
+            else:
+                due_reminders.append((chat_id, expires_at))
+        for entry in not_yet:
+            heapq.heappush(self._heap, entry)
+        return due_expiries, due_reminders
+
+    async def _fire(self, due_expiries, due_reminders):
+        if due_expiries:
+            expired = await expire_subscriptions(due_expiries)
+            self.stats['batches'] += 1
+            self.stats['downgraded'] += len(expired)
+            for chat_id in expired:
+                self._expiry_of.pop(chat_id, None)
+            if expired and self.on_expired:
+                try:
+                    await self.on_expired(expired)
+                except Exception as e:
+                    logging.error(f"Expiry callback failed: {e}")
+        for chat_id, expires_at in due_reminders:
+            self._reminded.add((chat_id, expires_at))
+            self.stats['reminders'] += 1
+            try:
+                await self.on_reminder(chat_id, expires_at)
+            except Exception as e:
+                logging.error(f"Renewal reminder for {chat_id} failed: {e}")
+
+    async def run(self):
+        logging.info("Expiry scheduler started.")
+        while True:
+            try:
+                now = time.time()
+                if now >= self._next_reload_at:
+                    await self.reload()
+                    # Forget reminders for expiries that are long gone.
+                    self._reminded = {(c, e) for c, e in self._reminded if e > now}
+                await self._fire(*self._pop_due(time.time()))
+
+                next_event = self._heap[0][0] if self._heap else float('inf')
+                timeout = max(0.0, min(next_event, self._next_reload_at) - time.time())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Expiry scheduler error: {e}")
+                await asyncio.sleep(5)
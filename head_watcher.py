@@ -0,0 +1,131 @@
+# head_watcher.py
+# Push-based block notifications over WebSocket (eth_subscribe) so the scanner runs as soon as
+# a block is announced instead of on a fixed sleep. HTTP polling remains the fallback.
+
+import os
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from metrics import HEAD_ANNOUNCE_DELAY_SECONDS, WS_RECONNECTS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+ETHEREUM_WS_RPC = os.getenv("ETHEREUM_WS_RPC") # ws(s):// endpoint; unset = HTTP polling only
+HEAD_SUBSCRIPTION = os.getenv("HEAD_SUBSCRIPTION", "newHeads") # 'newHeads' (every block) or 'logs' (only blocks with PairCreated)
+WS_STALE_SECONDS = float(os.getenv("WS_STALE_SECONDS", "60")) # Reconnect if the subscription goes quiet this long
+WS_HEARTBEAT_SECONDS = 20 # WebSocket ping interval; detects half-open connections
+WS_RECONNECT_BASE_SECONDS = 1
+WS_RECONNECT_MAX_SECONDS = 30
+
+class HeadWatcher:
+    """
+    Keeps an `eth_subscribe` WebSocket open and wakes the scan loop on every notification.
+    Notifications coalesce: however many arrive during a scan, the next `wait()` returns once.
+    Several loops can share one watcher by each waiting on its own `listener()`.
+    After every (re)connect the loop is woken immediately; the scanner's checkpoint then
+    backfills whatever was mined while the socket was down.
+
+    In 'logs' mode only blocks containing a PairCreated log wake the loop; confirmed blocks are
+    still picked up by the caller's fallback timeout, so pair it with SCAN_CONFIRMATIONS=0 for
+    the lowest latency.
+    """
+
+    def __init__(self, ws_url=ETHEREUM_WS_RPC, mode=HEAD_SUBSCRIPTION, addresses=None, topics=None,
+                 stale_after=WS_STALE_SECONDS):
+        self.ws_url = ws_url
+        self.mode = 'logs' if mode.lower() == 'logs' else 'newHeads'
+        self.addresses = addresses or []
+        self.topics = topics or []
+        self.stale_after = stale_after
+        self.connected = False
+        self.latest_head = None
+        self.stats = {'notifications': 0, 'reconnects': 0, 'errors': 0}
+        self._wakeup = asyncio.Event()
+        self._listeners = [self._wakeup]
+        self._session = None
+
+    def listener(self):
+        """A private wake-up event for one more consumer (pass it to `wait()`)."""
+        event = asyncio.Event()
+        self._listeners.append(event)
+        return event
+
+    def _wake_all(self):
+        for event in self._listeners:
+            event.set()
+
+    def _subscribe_params(self):
+        if self.mode == 'logs':
+            return ['logs', {'address': self.addresses, 'topics': [self.topics]}]
+        return ['newHeads']
+
+    def _on_notification(self, result):
+        self.stats['notifications'] += 1
+        if self.mode == 'newHeads':
+            self.latest_head = int(result['number'], 16)
+            if result.get('timestamp'):
+                HEAD_ANNOUNCE_DELAY_SECONDS.observe(max(0.0, time.time() - int(result['timestamp'], 16)))
+        else:
+            self.latest_head = max(self.latest_head or 0, int(result['blockNumber'], 16))
+        self._wake_all()
+
+    async def _listen(self):
+        async with self._session.ws_connect(self.ws_url, heartbeat=WS_HEARTBEAT_SECONDS) as ws:
+            await ws.send_json({'jsonrpc': '2.0', 'id': 1, 'method': 'eth_subscribe', 'params': self._subscribe_params()})
+            subscription_id = None
+            while True:
+                msg = await asyncio.wait_for(ws.receive(), timeout=self.stale_after)
+                if msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                    raise ConnectionError(f"WebSocket closed ({msg.type.name})")
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                data = msg.json()
+                if data.get('id') == 1:
+                    if 'error' in data:
+                        raise RuntimeError(f"eth_subscribe failed: {data['error']}")
+                    subscription_id = data['result']
+                    self.connected = True
+                    logging.info(f"Subscribed to {self.mode} over WebSocket ({subscription_id}).")
+                    self._wake_all() # Backfill anything mined while we were disconnected
+                elif data.get('method') == 'eth_subscription' and data['params'].get('subscription') == subscription_id:
+                    self._on_notification(data['params']['result'])
+
+    async def run(self):
+        """Connects and re-connects forever (with capped, jittered backoff). Run as a background task."""
+        self._session = aiohttp.ClientSession()
+        attempt = 0
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    await self._listen()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logging.warning(f"Head subscription dropped: {e or type(e).__name__}. Falling back to polling until reconnected.")
+                self.connected = False
+                if time.monotonic() - started > self.stale_after:
+                    attempt = 0 # The connection was healthy for a while; start backing off from scratch
+                delay = min(WS_RECONNECT_MAX_SECONDS, WS_RECONNECT_BASE_SECONDS * (2 ** attempt))
+                attempt += 1
+                self.stats['reconnects'] += 1
+                WS_RECONNECTS.inc()
+                await asyncio.sleep(delay * (0.5 + random.random() / 2))
+        finally:
+            self.connected = False
+            await self._session.close()
+
+    async def wait(self, timeout, listener=None):
+        """Returns True when woken by a notification, False after `timeout` seconds (the polling fallback)."""
+        event = listener if listener is not None else self._wakeup
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            event.clear()
@@ -0,0 +1,496 @@
+# history_archive.py
+# Append-only columnar history of detected pools and alert delivery outcomes, for backtests and
+# analytics on one box without touching production Postgres. Rows are buffered in memory and
+# flushed as segments of NumPy .npy files (one per column) under <table>/date=YYYY-MM-DD/, so a
+# query memory-maps only the days and columns it needs. Finished days are compacted into one segment.
+#
+#   python history_archive.py stats --since 2026-10-01
+#   python history_archive.py backtest --alert-min 40 --public-min 80 --since 2026-10-01
+#   python history_archive.py compact
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history") # Archive root (local disk); "" disables the archive
+HISTORY_FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS", "5000")) # Buffered rows in one table that trigger a flush
+HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS", "60")) # Flush at least this often (bounds rows lost in a crash)
+HISTORY_COMPACT_AFTER_SECONDS = float(os.getenv("HISTORY_COMPACT_AFTER_SECONDS", "3600")) # Compact a day once it ended this long ago
+HISTORY_COMPACT_INTERVAL_SECONDS = 3600
+HISTORY_GC_GRACE_SECONDS = 600 # Segments replaced by compaction stay readable this long, for queries already running
+HISTORY_MAX_BUFFERED_ROWS = 200000 # Per table; if flushes keep failing (disk full) the oldest buffered rows are dropped
+SEGMENT_META_FILE = "_segment.json"
+
+# Columns and fixed-width dtypes per table. Text is stored as UTF-8 bytes cut to the width; missing
+# values are NaN (floats), -1 (ints) or b"" (text). Each table is partitioned by day on its time column.
+FEATURE_COLUMNS = ('liquidity', 'lp_locked', 'renounced', 'deployer_nonce', 'deployer_share') # scorer.FEATURES
+SCHEMAS = {
+    'pools': {
+        'detected_at': 'f8', # When the alert loop received the pool
+        'block_timestamp': 'f8',
+        'block_number': 'i8', # Slot on Solana
+        'chain': 'S16',
+        'dex': 'S24',
+        'source': 'S32',
+        'pair_address': 'S64',
+        'token0_address': 'S64',
+        'token1_address': 'S64',
+        'token0_symbol': 'S32',
+        'token1_symbol': 'S32',
+        'transaction_hash': 'S96',
+        'fee_tier': 'i4', # V3 pools only
+        'score': 'f4', # NaN = unscored
+        'route': 'S8',
+        'alerted': 'i1',
+        **{name: 'f8' for name in FEATURE_COLUMNS},
+        'deployer': 'S64',
+    },
+    'deliveries': {
+        'settled_at': 'f8',
+        'message_id': 'i8',
+        'chat_id': 'i8',
+        'kind': 'S16', # realtime, immediate, digest, vip_channel, public_channel
+        'outcome': 'S8', # sent, failed (after the last attempt), blocked, skipped
+        'attempts': 'i2',
+        'block_timestamp': 'f8', # Earliest block time of the pools in the message
+        'latency_seconds': 'f8', # Block time to settled; NaN without a block time
+    },
+}
+TIME_COLUMNS = {'pools': 'detected_at', 'deliveries': 'settled_at'}
+
+def pool_record(pool, detected_at=None):
+    """Archive row for one pool dict from the scanners (after scoring)."""
+    features = pool.get('score_features') or {}
+    record = {
+        'detected_at': detected_at or time.time(),
+        'block_timestamp': pool.get('block_timestamp'),
+        'block_number': pool.get('block_number'),
+        'chain': pool.get('chain', 'ethereum'),
+        'dex': pool.get('dex'),
+        'source': pool.get('source'),
+        'pair_address': pool.get('pair_address'),
+        'token0_address': pool.get('token0_address'),
+        'token1_address': pool.get('token1_address'),
+        'token0_symbol': (pool.get('token0_info') or {}).get('symbol'),
+        'token1_symbol': (pool.get('token1_info') or {}).get('symbol'),
+        'transaction_hash': pool.get('transaction_hash'),
+        'fee_tier': pool.get('fee_tier'),
+        'score': pool.get('score'),
+        'route': pool.get('route'),
+        'alerted': pool.get('route') != 'drop',
+        'deployer': features.get('deployer'),
+    }
+    record.update({name: features.get(name) for name in FEATURE_COLUMNS})
+    return record
+
+def delivery_record(row, outcome, settled_at=None):
+    """Archive row for one settled alert_deliveries row (as claimed by the outbox)."""
+    settled_at = settled_at or time.time()
+    block_timestamp = row.get('block_timestamp')
+    return {'settled_at': settled_at, 'message_id': row['message_id'], 'chat_id': row['chat_id'], 'kind': row['kind'],
+            'outcome': outcome, 'attempts': row['attempts'], 'block_timestamp': block_timestamp,
+            'latency_seconds': settled_at - block_timestamp if block_timestamp else None}
+
+def _column(values, dtype):
+    if dtype.kind == 'S':
+        return np.array([(v if isinstance(v, bytes) else str(v).encode('utf-8'))[:dtype.itemsize] if v is not None else b""
+                         for v in values], dtype=dtype)
+    missing = np.nan if dtype.kind == 'f' else -1
+    return np.array([missing if v is None else v for v in values], dtype=dtype)
+
+def _missing(dtype, rows):
+    dtype = np.dtype(dtype)
+    return np.full(rows, b"" if dtype.kind == 'S' else np.nan if dtype.kind == 'f' else -1, dtype=dtype)
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+def _day_start(day):
+    return datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+def _encode(values):
+    """Query values for a text column: str -> UTF-8 bytes, one value or a list/tuple/set of them."""
+    if not isinstance(values, (list, tuple, set, frozenset)):
+        values = [values]
+    return [value.encode('utf-8') if isinstance(value, str) else value for value in values]
+
+def text(values):
+    """Decodes a text column returned by a query to a str array."""
+    return np.char.decode(values, 'utf-8', errors='ignore')
+
+class HistoryArchive:
+    """
+    Columnar, append-only archive under `root`. `append()`/`extend()` only buffer rows; `run()`
+    flushes them from a worker thread every HISTORY_FLUSH_SECONDS or once a table has
+    HISTORY_FLUSH_ROWS buffered. Each flush publishes a segment directory with a single rename,
+    so readers never see half-written data, and writers in several processes never collide
+    (segment names carry host and pid).
+
+    `scan()`/`read()` load only the requested columns of the partitions overlapping the time
+    range, memory-mapped. `compact_due()` (one process per archive: `run_compaction()`) merges
+    each finished day into one segment; the segments it replaces are hidden at once and deleted
+    after HISTORY_GC_GRACE_SECONDS.
+    """
+
+    def __init__(self, root=HISTORY_DIR, flush_rows=HISTORY_FLUSH_ROWS, flush_seconds=HISTORY_FLUSH_SECONDS,
+                 compact_after=HISTORY_COMPACT_AFTER_SECONDS):
+        self.root = root
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.compact_after = compact_after
+        self.writer_id = f"{socket.gethostname()}-{os.getpid()}".replace(os.sep, "_")
+        self.stats = {'buffered': 0, 'rows_written': 0, 'segments_written': 0, 'flush_errors': 0, 'dropped': 0,
+                      'days_compacted': 0}
+        self._buffers = {table: [] for table in SCHEMAS}
+        self._lock = threading.Lock() # Buffers are appended on the event loop and swapped out by the flush thread
+        self._flush_lock = threading.Lock()
+        self._sequence = 0
+        self._wakeup = asyncio.Event()
+
+    # --- Writing ---
+
+    def append(self, table, record):
+        self.extend(table, [record])
+
+    def extend(self, table, records):
+        """Buffers rows (dicts keyed by SCHEMAS[table] columns; missing keys are stored as missing values)."""
+        with self._lock:
+            buffer = self._buffers[table]
+            buffer.extend(records)
+            if len(buffer) > HISTORY_MAX_BUFFERED_ROWS:
+                self.stats['dropped'] += len(buffer) - HISTORY_MAX_BUFFERED_ROWS
+                del buffer[:len(buffer) - HISTORY_MAX_BUFFERED_ROWS]
+            self.stats['buffered'] = sum(len(rows) for rows in self._buffers.values())
+            full = len(buffer) >= self.flush_rows
+        if full:
+            self._wakeup.set()
+
+    def record_pools(self, pools):
+        detected_at = time.time()
+        self.extend('pools', [pool_record(pool, detected_at) for pool in pools])
+
+    def record_delivery(self, row, outcome):
+        self.append('deliveries', delivery_record(row, outcome))
+
+    def flush(self):
+        """Writes every buffered row (one segment per table and day). Returns the number of rows written."""
+        written = 0
+        with self._flush_lock:
+            for table in SCHEMAS:
+                with self._lock:
+                    rows, self._buffers[table] = self._buffers[table], []
+                if not rows:
+                    continue
+                try:
+                    written += self._write_rows(table, rows)
+                except Exception as e:
+                    self.stats['flush_errors'] += 1
+                    logging.error(f"History archive flush of {len(rows)} {table} row(s) failed: {e}. Keeping them buffered.")
+                    with self._lock:
+                        self._buffers[table][:0] = rows[-HISTORY_MAX_BUFFERED_ROWS:]
+            with self._lock:
+                self.stats['buffered'] = sum(len(rows) for rows in self._buffers.values())
+        return written
+
+    def _write_rows(self, table, rows):
+        columns = {column: _column([row.get(column) for row in rows], np.dtype(dtype))
+                   for column, dtype in SCHEMAS[table].items()}
+        times = columns[TIME_COLUMNS[table]]
+        days = (np.nan_to_num(times, nan=time.time()) // 86400).astype(np.int64)
+        for day_number in np.unique(days):
+            mask = days == day_number
+            day = _day(day_number * 86400)
+            self._write_segment(table, day, {column: values[mask] for column, values in columns.items()})
+        self.stats['rows_written'] += len(rows)
+        return len(rows)
+
+    def _partition(self, table, day):
+        return os.path.join(self.root, table, f"date={day}")
+
+    def _segment_name(self, label=""):
+        self._sequence += 1
+        return f"{time.time_ns() // 1000:017d}-{label}{self.writer_id}-{self._sequence:06d}"
+
+    def _staging(self, table, day, name):
+        partition = self._partition(table, day)
+        staging = os.path.join(partition, f".{name}.tmp") # Dot-prefixed: invisible to readers until published
+        os.makedirs(staging)
+        return partition, staging
+
+    def _publish(self, partition, staging, name, rows, replaces=()):
+        with open(os.path.join(staging, SEGMENT_META_FILE), "w") as f:
+            json.dump({'rows': rows, 'created_at': time.time(), 'replaces': sorted(replaces)}, f)
+        os.rename(staging, os.path.join(partition, name))
+        self.stats['segments_written'] += 1
+
+    def _write_segment(self, table, day, columns):
+        name = self._segment_name()
+        partition, staging = self._staging(table, day, name)
+        for column, values in columns.items():
+            np.save(os.path.join(staging, f"{column}.npy"), values)
+        self._publish(partition, staging, name, len(next(iter(columns.values()))))
+
+    async def run(self):
+        """Flush loop (every process that appends). Flushes what is still buffered when cancelled."""
+        logging.info(f"History archive writing to {os.path.abspath(self.root)}.")
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await asyncio.to_thread(self.flush)
+        finally:
+            self.flush()
+
+    # --- Reading ---
+
+    def days(self, table, start=None, end=None):
+        """Partitions of `table` overlapping [start, end) (epoch seconds), oldest first."""
+        try:
+            names = os.listdir(os.path.join(self.root, table))
+        except FileNotFoundError:
+            return []
+        days = sorted(name[5:] for name in names if name.startswith("date="))
+        return [day for day in days if (start is None or _day_start(day) + 86400 > start) and
+                (end is None or _day_start(day) < end)]
+
+    def _segment_metas(self, partition):
+        """{segment name: meta} of every published segment in a partition, replaced or not."""
+        try:
+            names = sorted(name for name in os.listdir(partition) if not name.startswith("."))
+        except FileNotFoundError:
+            return {}
+        metas = {}
+        for name in names:
+            try:
+                with open(os.path.join(partition, name, SEGMENT_META_FILE)) as f:
+                    metas[name] = json.load(f)
+            except (OSError, ValueError):
+                continue # Being deleted by GC
+        return metas
+
+    def segments(self, table, day):
+        """[(path, meta)] of the live segments of one day partition, oldest first."""
+        partition = self._partition(table, day)
+        metas = self._segment_metas(partition)
+        replaced = {name for meta in metas.values() for name in meta.get('replaces', ())}
+        return [(os.path.join(partition, name), meta) for name, meta in metas.items() if name not in replaced]
+
+    @staticmethod
+    def _load(path, column, dtype, rows):
+        try:
+            return np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r')
+        except FileNotFoundError:
+            return _missing(dtype, rows) # Column added after this segment was written
+
+    def scan(self, table, columns, start=None, end=None, where=None):
+        """
+        Yields {column: array} per live segment, oldest first, reading only `columns` (plus the ones
+        filtered on) as memory maps. `start`/`end` bound the table's time column (epoch seconds,
+        end exclusive); `where` maps a column to a value or a list of values it must equal (str
+        values are matched against text columns as UTF-8). Unfiltered columns stay memory-mapped;
+        filtered ones hold only the matching rows. Text comes back as bytes (see `text()`).
+        """
+        schema = SCHEMAS[table]
+        where = where or {}
+        time_column = TIME_COLUMNS[table]
+        needed = set(columns) | set(where) | ({time_column} if start is not None or end is not None else set())
+        unknown = needed - set(schema)
+        if unknown:
+            raise ValueError(f"Unknown {table} column(s): {', '.join(sorted(unknown))}")
+        for day in self.days(table, start, end):
+            day_start = _day_start(day)
+            for path, meta in self.segments(table, day):
+                arrays = {column: self._load(path, column, schema[column], meta['rows']) for column in needed}
+                mask = None
+                if start is not None and start > day_start:
+                    mask = arrays[time_column] >= start
+                if end is not None and end < day_start + 86400:
+                    mask = (arrays[time_column] < end) if mask is None else mask & (arrays[time_column] < end)
+                for column, values in where.items():
+                    matches = np.isin(arrays[column], _encode(values) if schema[column].startswith('S') else values)
+                    mask = matches if mask is None else mask & matches
+                if mask is None:
+                    yield {column: arrays[column] for column in columns}
+                elif mask.any():
+                    yield {column: np.asarray(arrays[column][mask]) for column in columns}
+
+    def read(self, table, columns, start=None, end=None, where=None):
+        """Like `scan()`, concatenated into one in-memory array per column."""
+        chunks = list(self.scan(table, columns, start, end, where))
+        return {column: np.concatenate([chunk[column] for chunk in chunks]) if chunks else
+                np.empty(0, dtype=SCHEMAS[table][column]) for column in columns}
+
+    # --- Compaction ---
+
+    def compact(self, table, day):
+        """
+        Merges the live segments of one day into a single segment; returns the number merged. A
+        segment flushed into the day meanwhile is simply not replaced, so it stays live.
+        """
+        partition = self._partition(table, day)
+        metas = self._segment_metas(partition)
+        inputs = self.segments(table, day)
+        if len(inputs) < 2:
+            return 0
+        # Also list what the inputs replaced, so GC'ing an earlier compaction never resurrects its inputs
+        names = {os.path.basename(path) for path, _ in inputs}
+        replaces = names | {replaced for name in names for replaced in metas[name].get('replaces', ())}
+        rows = sum(meta['rows'] for _, meta in inputs)
+        name = self._segment_name("compacted-")
+        partition, staging = self._staging(table, day, name)
+        for column, dtype in SCHEMAS[table].items():
+            out = np.lib.format.open_memmap(os.path.join(staging, f"{column}.npy"), mode='w+', dtype=dtype, shape=(rows,))
+            offset = 0
+            for path, meta in inputs: # One column of one segment in memory at a time
+                out[offset:offset + meta['rows']] = self._load(path, column, dtype, meta['rows'])
+                offset += meta['rows']
+            out.flush()
+            del out
+        self._publish(partition, staging, name, rows, replaces)
+        self.stats['days_compacted'] += 1
+        logging.info(f"History archive: compacted {len(inputs)} {table} segment(s) of {day} ({rows} rows).")
+        return len(inputs)
+
+    def collect_garbage(self, table, day, now=None):
+        """Deletes segments replaced more than HISTORY_GC_GRACE_SECONDS ago and abandoned staging directories."""
+        now = now or time.time()
+        partition = self._partition(table, day)
+        for name, meta in self._segment_metas(partition).items(): # Oldest compaction first
+            if now - meta.get('created_at', now) < HISTORY_GC_GRACE_SECONDS:
+                continue
+            for replaced in meta.get('replaces', ()):
+                shutil.rmtree(os.path.join(partition, replaced), ignore_errors=True)
+        try:
+            names = os.listdir(partition)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(partition, name)
+            if name.startswith(".") and now - os.path.getmtime(path) > HISTORY_GC_GRACE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True) # A writer died mid-flush
+
+    def compact_due(self, now=None):
+        """Compacts every day that ended more than `compact_after` ago and GCs replaced segments. Returns days compacted."""
+        now = now or time.time()
+        compacted = 0
+        for table in SCHEMAS:
+            for day in self.days(table):
+                if _day_start(day) + 86400 + self.compact_after <= now and self.compact(table, day):
+                    compacted += 1
+                self.collect_garbage(table, day, now)
+        return compacted
+
+    async def run_compaction(self):
+        """Compaction loop; run it in one process per archive directory (the cluster leader)."""
+        while True:
+            try:
+                await asyncio.to_thread(self.compact_due)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"History archive compaction error: {e}")
+            await asyncio.sleep(HISTORY_COMPACT_INTERVAL_SECONDS)
+
+# --- Analytics ---
+
+def replay(archive, start=None, end=None, alert_min=None, public_min=None, min_liquidity=None, blocked=None, where=None):
+    """
+    Backtest: re-scores archived pools from their stored features through scorer.py with other
+    thresholds (None = the live SCORE_ALERT_MIN / SCORE_PUBLIC_MIN / SCORER_MIN_LIQUIDITY and
+    blocklist) and counts how their routing would change. Pools that were never scored keep
+    their recorded route. Streams one segment at a time.
+    """
+    import scorer
+    alert_min = scorer.SCORE_ALERT_MIN if alert_min is None else alert_min
+    public_min = scorer.SCORE_PUBLIC_MIN if public_min is None else public_min
+    min_liquidity = scorer.SCORER_MIN_LIQUIDITY if min_liquidity is None else min_liquidity
+    blocked = _encode(list(scorer.blocklist.current() if blocked is None else {a.lower() for a in blocked}))
+    columns = ['score', 'route', 'token0_address', 'token1_address', 'deployer', *scorer.FEATURES]
+    result = {'pools': 0, 'unscored': 0, 'recorded': {}, 'replayed': {}, 'transitions': {},
+              'settings': {'alert_min': alert_min, 'public_min': public_min, 'min_liquidity': min_liquidity,
+                           'blocklisted_addresses': len(blocked)}}
+
+    def count(counts, keys, values):
+        for key, n in zip(keys, values):
+            counts[str(key)] = counts.get(str(key), 0) + int(n)
+
+    for chunk in archive.scan('pools', columns, start, end, where):
+        recorded = text(chunk['route'])
+        scored = ~np.isnan(chunk['score'])
+        scores = scorer.score_features(np.column_stack([chunk[name] for name in scorer.FEATURES]), min_liquidity)
+        if blocked:
+            hits = np.zeros(len(scores), dtype=bool)
+            for column in ('token0_address', 'token1_address', 'deployer'):
+                hits |= np.isin(np.char.lower(chunk[column]), blocked)
+            scores[hits] = 0.0
+        replayed = np.where(scored, scorer.routes_for(scores, alert_min, public_min, chunk['liquidity']), recorded)
+        result['pools'] += len(scores)
+        result['unscored'] += int((~scored).sum())
+        count(result['recorded'], *np.unique(recorded, return_counts=True))
+        count(result['replayed'], *np.unique(replayed, return_counts=True))
+        changed = recorded != replayed
+        if changed.any():
+            count(result['transitions'], *np.unique(np.char.add(np.char.add(recorded[changed], "->"), replayed[changed]),
+                                                    return_counts=True))
+    return result
+
+def summarize(archive, start=None, end=None):
+    """Pools per chain/route and deliveries per kind/outcome with sent-latency percentiles, streamed per segment."""
+    def count(counts, table, left, right):
+        for chunk in archive.scan(table, [left, right], start, end):
+            keys, n = np.unique(np.char.add(np.char.add(chunk[left], b"/"), chunk[right]), return_counts=True)
+            for key, value in zip(text(keys), n):
+                counts[str(key)] = counts.get(str(key), 0) + int(value)
+        return counts
+
+    latencies = archive.read('deliveries', ['latency_seconds'], start, end, where={'outcome': 'sent'})['latency_seconds']
+    latencies = latencies[~np.isnan(latencies)]
+    return {'pools': count({}, 'pools', 'chain', 'route'), 'deliveries': count({}, 'deliveries', 'kind', 'outcome'),
+            'sent_latency_seconds': {f"p{p}": round(float(np.percentile(latencies, p)), 3) for p in (50, 90, 99)}
+            if len(latencies) else {}}
+
+# --- Command line ---
+
+def _timestamp(value):
+    return _day_start(value) if value else None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query, backtest and compact the pool/alert history archive.")
+    parser.add_argument('command', choices=['stats', 'backtest', 'compact'])
+    parser.add_argument('--dir', default=HISTORY_DIR or "history", help="Archive root (HISTORY_DIR)")
+    parser.add_argument('--since', help="First day, YYYY-MM-DD (UTC)")
+    parser.add_argument('--until', help="Day after the last one, YYYY-MM-DD (UTC)")
+    parser.add_argument('--chain', help="Backtest only this chain")
+    parser.add_argument('--alert-min', type=float, help="Backtest SCORE_ALERT_MIN")
+    parser.add_argument('--public-min', type=float, help="Backtest SCORE_PUBLIC_MIN")
+    parser.add_argument('--min-liquidity', type=float, help="Backtest SCORER_MIN_LIQUIDITY")
+    args = parser.parse_args(argv)
+    archive = HistoryArchive(args.dir)
+    start, end = _timestamp(args.since), _timestamp(args.until)
+    if args.command == 'stats':
+        result = summarize(archive, start, end)
+    elif args.command == 'backtest':
+        result = replay(archive, start, end, args.alert_min, args.public_min, args.min_liquidity,
+                        where={'chain': args.chain} if args.chain else None)
+    else:
+        result = {'days_compacted': archive.compact_due()}
+    print(json.dumps(result, indent=2, sort_keys=True))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
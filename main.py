@@ -1,15 +1,17 @@
+from startup_profiler import startup_profiler # First, so --profile-startup times every import below
 import os
 import asyncio
-import aiohttp
 import logging
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, CommandStart
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database import init_db, check_premium, add_subscription, add_referral, get_stats
-from flask import Flask
-from threading import Thread
+from subscriber_store import open_subscriber_store
+from dexscreener import DexScreenerClient
 from dotenv import load_dotenv
+import webhook_server
+from metrics import HANDLER_LATENCY, observe_async, register_cache_stats, register_gauge_fn
+from throttling import Throttler, AiogramThrottlingMiddleware
 
 load_dotenv()
 
@@ -20,25 +22,21 @@ WALLET = os.getenv("ETHEREUM_WALLET")
 ETHERSCAN_KEY = os.getenv("ETHEREUM_API_KEY")
 PUBLIC_CHANNEL = os.getenv("PUBLIC_CHANNEL_ID") # e.g., @ICEGODSICEDEVILS
 
-init_db()
+store = open_subscriber_store() # SQLite by default; SUBSCRIBER_STORE_BACKEND=postgres shares whale_main's subscribers
 bot = Bot(token=TOKEN)
 dp = Dispatcher()
-
-# --- RENDER SERVER ---
-app = Flask('')
-@app.route('/health')
-def health(): return "OK", 200
-def run_web():
-    app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 10000)))
+dexscreener = DexScreenerClient() # One pooled, cached session shared by every handler
+register_cache_stats('dexscreener', lambda: dexscreener.stats)
+throttler = Throttler() # Per-user/global limits and duplicate-tap coalescing, before the premium check and DexScreener
+throttle_middleware = AiogramThrottlingMiddleware(throttler)
+dp.message.outer_middleware(throttle_middleware)
+dp.callback_query.outer_middleware(throttle_middleware)
+register_gauge_fn('throttle_tracked_users', 'Users with a live throttling window or counters', lambda: throttler.tracked_users)
 
 # --- ALPHA LOGIC ---
 async def fetch_alpha():
-    url = "https://api.dexscreener.com/token-boosts/latest/v1"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url) as resp:
-                return await resp.json() if resp.status == 200 else []
-        except: return []
+    # Cached + coalesced: a burst of button presses shares one upstream request
+    return await dexscreener.fetch_latest_boosts()
 
 # --- AUTO-SIGNAL BACKGROUND TASK ---
 async def auto_signal_broadcaster():
@@ -75,6 +73,7 @@ async def auto_signal_broadcaster():
 
 # --- BOT HANDLERS ---
 @dp.message(CommandStart())
+@observe_async(HANDLER_LATENCY, 'start')
 async def start(message: types.Message):
     # (Existing referral & welcome logic...)
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -83,10 +82,12 @@ async def start(message: types.Message):
         [InlineKeyboardButton(text="💎 Purchase VIP", callback_data="buy")]
     ])
     await message.answer(f"🦅 <b>Ice Alpha Hunter PRO</b>\n\nWelcome {message.from_user.first_name}!", parse_mode="HTML", reply_markup=kb)
+    startup_profiler.mark("first /start answered")
 
 @dp.callback_query(F.data == "alpha")
+@observe_async(HANDLER_LATENCY, 'alpha')
 async def alpha(callback: types.CallbackQuery):
-    if not check_premium(callback.from_user.id):
+    if not await store.is_premium(callback.from_user.id):
         gems = await fetch_alpha()
         teaser = "❌ <b>VIP Access Only</b>\n\n🔥 <b>LATEST GEMS:</b>\n"
         for g in gems[:3]:
@@ -100,12 +101,41 @@ async def alpha(callback: types.CallbackQuery):
 
 # --- STARTUP ---
 async def main():
+    await store.open()
+
     # Start the Auto-Signal Broadcaster in the background
     asyncio.create_task(auto_signal_broadcaster())
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    Thread(target=run_web).start()
-    await dp.start_polling(bot)
+    # --- RENDER SERVER --- /health, /ready and (webhook mode) updates, served from this event loop
+    webhook_mode = webhook_server.BOT_MODE == 'webhook'
+
+    async def handle_update(update):
+        await dp.feed_raw_update(bot, update)
+
+    try:
+        http_app = webhook_server.create_app(handle_update=handle_update if webhook_mode else None)
+    except ValueError as e:
+        logging.critical(f"{e} Exiting.")
+        await store.close()
+        return
+    runner = await webhook_server.start_server(http_app, port=int(os.environ.get("PORT", 10000)))
+    metrics_runner = await webhook_server.start_metrics_server() # Internal listener, not the public port
+    startup_profiler.mark("receiving updates")
+    startup_profiler.report()
+    try:
+        if webhook_mode:
+            await bot.set_webhook(webhook_server.webhook_url(), secret_token=webhook_server.WEBHOOK_SECRET_TOKEN,
+                                  max_connections=webhook_server.WEBHOOK_MAX_CONNECTIONS)
+            await asyncio.Event().wait() # Serve until cancelled
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        await runner.cleanup()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await dexscreener.close()
+        await store.close()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
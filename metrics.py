@@ -0,0 +1,226 @@
+# metrics.py
+# Prometheus metrics (served on /metrics by webhook_server) and an optional sampling profiler.
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# --- Configuration ---
+PROFILE_HOT_LOOPS = os.getenv("PROFILE_HOT_LOOPS", "false").lower() == "true"
+PROFILE_SAMPLE_INTERVAL_SECONDS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_SECONDS", "0.005"))
+PROFILE_OUTPUT_FILE = os.getenv("PROFILE_OUTPUT_FILE", "hot_loops.folded") # Folded stacks, for flamegraph.pl/speedscope
+
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+# --- Metric definitions ---
+SCAN_CYCLE_SECONDS = Histogram('scan_cycle_duration_seconds', 'Duration of one pool scan', ['source'], buckets=SLOW_BUCKETS)
+SCAN_BLOCKS_BEHIND = Histogram('scan_blocks_behind', 'Blocks between the safe head and the last scanned block', ['source'],
+                               buckets=(0, 1, 2, 5, 10, 25, 50, 100, 500, 1000, 10000))
+SCAN_ERRORS = Counter('scan_errors_total', 'Failed scans per source', ['source'])
+ALERT_FANOUT_SECONDS = Histogram('alert_fanout_seconds', 'Time to deliver one batch of pool alerts', buckets=SLOW_BUCKETS)
+RPC_LATENCY = Histogram('rpc_call_latency_seconds', 'Blockchain RPC call latency', ['method'], buckets=FAST_BUCKETS)
+RPC_ERRORS = Counter('rpc_call_errors_total', 'Blockchain RPC calls that raised', ['method'])
+DB_LATENCY = Histogram('db_query_latency_seconds', 'Database call latency by db_manager function', ['function'],
+                       buckets=FAST_BUCKETS)
+HTTP_UPSTREAM_LATENCY = Histogram('http_upstream_latency_seconds', 'Third-party HTTP API latency', ['upstream'],
+                                  buckets=FAST_BUCKETS)
+TELEGRAM_SEND_LATENCY = Histogram('telegram_send_latency_seconds', 'Telegram sendMessage latency', buckets=FAST_BUCKETS)
+TELEGRAM_SEND_ERRORS = Counter('telegram_send_errors_total', 'Telegram sendMessage errors', ['code'])
+ALERT_END_TO_END_SECONDS = Histogram('alert_end_to_end_seconds', 'Pool block timestamp to alert delivery',
+                                     buckets=SLOW_BUCKETS)
+ALERTS_SENT = Counter('alerts_sent_total', 'Alert messages delivered to subscribers', ['kind'])
+HEAD_ANNOUNCE_DELAY_SECONDS = Histogram('head_announce_delay_seconds', 'Block timestamp to newHeads notification',
+                                        buckets=FAST_BUCKETS)
+WS_RECONNECTS = Counter('ws_reconnects_total', 'Head subscription WebSocket reconnects')
+ALERT_OUTBOX_ENQUEUED = Counter('alert_outbox_enqueued_total', 'Deliveries written to the alert outbox', ['kind'])
+ALERT_OUTBOX_OUTCOMES = Counter('alert_outbox_outcomes_total', 'Outbox delivery attempts by outcome', ['outcome'])
+POOLS_DETECTED = Counter('pools_detected_total', 'New pools returned by the scanner')
+POOL_SCORES = Histogram('pool_score', 'Scores given to new pools by the scorer', buckets=(10, 20, 30, 40, 50, 60, 70, 80, 90, 100))
+POOLS_ROUTED = Counter('pools_routed_total', 'Scored pools by route', ['route'])
+CLUSTER_REBALANCES = Counter('cluster_rebalances_total', 'Shard reassignments after cluster membership changed')
+CLUSTER_LEADER_ELECTIONS = Counter('cluster_leader_elections_total', 'Times this worker became the cluster leader')
+THROTTLED_UPDATES = Counter('throttled_updates_total', 'Bot updates dropped before reaching a handler', ['reason'])
+HANDLER_LATENCY = Histogram('handler_latency_seconds', 'Bot command/callback handling latency', ['handler'],
+                            buckets=FAST_BUCKETS)
+
+# --- Helpers ---
+
+def observe_async(histogram, *labels):
+    """Decorator timing an async function into `histogram` (with optional label values)."""
+    metric = histogram.labels(*labels) if labels else histogram
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def observe_sync(histogram, *labels):
+    """Decorator timing a regular function into `histogram` (with optional label values)."""
+    metric = histogram.labels(*labels) if labels else histogram
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def timed_db(func):
+    """Times a db_manager/async_db_manager function under its own name."""
+    if asyncio.iscoroutinefunction(func):
+        return observe_async(DB_LATENCY, func.__name__)(func)
+    return observe_sync(DB_LATENCY, func.__name__)(func)
+
+def web3_rpc_metrics_middleware(make_request, w3):
+    """web3 middleware recording latency and errors per JSON-RPC method."""
+    def middleware(method, params):
+        started = time.perf_counter()
+        try:
+            response = make_request(method, params)
+        except Exception:
+            RPC_ERRORS.labels(method).inc()
+            raise
+        finally:
+            RPC_LATENCY.labels(method).observe(time.perf_counter() - started)
+        if isinstance(response, dict) and response.get('error'):
+            RPC_ERRORS.labels(method).inc()
+        return response
+    return middleware
+
+# --- Cache statistics (read at scrape time, so hot paths pay nothing) ---
+
+class _StatsCollector:
+    def __init__(self):
+        self._sources = {}
+
+    def register(self, name, stats_fn):
+        self._sources[name] = stats_fn
+
+    def collect(self):
+        hits = CounterMetricFamily('cache_hits', 'Cache hits', labels=['cache'])
+        misses = CounterMetricFamily('cache_misses', 'Cache misses', labels=['cache'])
+        entries = GaugeMetricFamily('cache_entries', 'Entries currently cached', labels=['cache'])
+        for name, stats_fn in list(self._sources.items()):
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logging.warning(f"Could not collect stats for cache '{name}': {e}")
+                continue
+            hits.add_metric([name], stats.get('hits', 0) + stats.get('stale_hits', 0))
+            misses.add_metric([name], stats.get('misses', 0))
+            if 'entries' in stats:
+                entries.add_metric([name], stats['entries'])
+        yield hits
+        yield misses
+        yield entries
+
+_stats_collector = _StatsCollector()
+REGISTRY.register(_stats_collector)
+
+def register_cache_stats(name, stats_fn):
+    """Exposes a cache's stats() dict (hits/misses/entries) as cache_* metrics labelled `name`."""
+    _stats_collector.register(name, stats_fn)
+
+def register_gauge_fn(name, documentation, fn):
+    """Exposes fn() as a gauge evaluated at scrape time."""
+    Gauge(name, documentation).set_function(fn)
+
+def render():
+    """Returns (body, content_type) for the /metrics endpoint."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+# --- Sampling profiler ---
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler: while at least one `section()` is active, a background
+    thread samples the stack of the thread that opened it every PROFILE_SAMPLE_INTERVAL_SECONDS
+    and counts folded stacks. `dump()` writes them in flamegraph 'folded' format.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL_SECONDS, output_file=PROFILE_OUTPUT_FILE):
+        self.interval = interval
+        self.output_file = output_file
+        self.samples = StackCounter()
+        self._active = {} # thread id -> (section name, nesting depth)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, (name, _) in active.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.samples[name + ";" + ";".join(reversed(stack))] += 1
+
+    @contextmanager
+    def section(self, name):
+        thread_id = threading.get_ident()
+        with self._lock:
+            current = self._active.get(thread_id)
+            self._active[thread_id] = (current[0] if current else name, (current[1] if current else 0) + 1)
+        self._ensure_thread()
+        try:
+            yield
+        finally:
+            with self._lock:
+                current_name, depth = self._active[thread_id]
+                if depth <= 1:
+                    del self._active[thread_id]
+                else:
+                    self._active[thread_id] = (current_name, depth - 1)
+
+    def maybe_dump(self, every_seconds=60):
+        now = time.monotonic()
+        if now - getattr(self, '_last_dump_at', 0) >= every_seconds:
+            self._last_dump_at = now
+            self.dump()
+
+    def dump(self):
+        with open(self.output_file, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"Wrote {len(self.samples)} sampled stacks to {self.output_file}.")
+
+profiler = SamplingProfiler() if PROFILE_HOT_LOOPS else None
+
+@contextmanager
+def profile_section(name):
+    """Profiles the enclosed block when PROFILE_HOT_LOOPS=true; a no-op otherwise."""
+    if profiler is None:
+        yield
+        return
+    with profiler.section(name):
+        yield
@@ -0,0 +1,389 @@
+# payment_verifier.py
+# Asynchronous /paid verification: claims are queued and checked on-chain by a bounded
+# worker pool, so the bot never blocks on RPC calls while a payment is being verified.
+
+import os
+import re
+import math
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from metrics import RPC_LATENCY
+from async_db_manager import record_payment_claim, settle_payment_claim, get_pending_payment_claims, \
+                             get_payment_invoice, create_payment_invoice, is_payment_verified
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+ETHEREUM_RPC = os.getenv("ETHEREUM_RPC")
+HELIUS_RPC = os.getenv("HELIUS_RPC")
+ETH_MAIN_WALLET = os.getenv("ETH_MAIN")
+SOL_MAIN_WALLET = os.getenv("SOL_MAIN")
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "4"))
+PAYMENT_QUEUE_MAX = int(os.getenv("PAYMENT_QUEUE_MAX", "1000"))
+PAYMENT_BATCH_SIZE = int(os.getenv("PAYMENT_BATCH_SIZE", "20")) # Claims verified per ETH JSON-RPC batch
+PAYMENT_MIN_ETH_CONFIRMATIONS = int(os.getenv("PAYMENT_MIN_ETH_CONFIRMATIONS", "2"))
+PAYMENT_RETRY_DELAY_SECONDS = float(os.getenv("PAYMENT_RETRY_DELAY_SECONDS", "20")) # For not-yet-mined/confirmed txs
+PAYMENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_MAX_ATTEMPTS", "15")) # Then the claim stays pending until the user re-sends /paid
+PAYMENT_INVOICE_TTL_SECONDS = float(os.getenv("PAYMENT_INVOICE_TTL_SECONDS", "86400")) # Payments must land within this window
+PRICE_CACHE_TTL_SECONDS = float(os.getenv("PRICE_CACHE_TTL_SECONDS", "60"))
+COINGECKO_PRICE_URL = "https://api.coingecko.com/api/v3/simple/price?ids=ethereum,solana&vs_currencies=usd"
+RPC_TIMEOUT_SECONDS = 15
+INVOICE_TAG_MAX = 9999 # Invoice tags live in the low digits of every quoted amount (see quote_invoice)
+
+# Stablecoins accepted as ERC-20 payment (address -> decimals)
+ERC20_STABLECOINS = {
+    "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48": 6, # USDC
+    "0xdac17f958d2ee523a2206206994597c13d831ec7": 6, # USDT
+}
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+ETH_TX_RE = re.compile(r"^0x[0-9a-fA-F]{64}$")
+SOL_SIGNATURE_RE = re.compile(r"^[1-9A-HJ-NP-Za-km-z]{64,90}$")
+
+# Verification outcomes
+VERIFIED = 'verified'
+REJECTED = 'rejected'
+RETRY = 'retry'
+STALLED = 'stalled' # Retries exhausted; the claim is left pending and can be re-submitted
+
+def detect_chain(tx_hash):
+    """Returns 'eth', 'sol' or None for a malformed hash."""
+    if ETH_TX_RE.match(tx_hash):
+        return 'eth'
+    if SOL_SIGNATURE_RE.match(tx_hash):
+        return 'sol'
+    return None
+
+def quote_invoice(plan_price_usd, tag, eth_price=None, sol_price=None):
+    """
+    Exact amounts for an invoice, each carrying `tag` in digits below the quote's precision:
+    USDC/USDT in micro-dollars (+tag), ETH rounded up to 0.0001 ETH (+tag gwei), SOL rounded up
+    to 0.001 SOL (+tag * 100 lamports). Returns (usd_micro, eth_wei, sol_lamports); a chain
+    without a price quote gets None.
+    """
+    usd_micro = round(plan_price_usd * 10**6) + tag
+    eth_wei = math.ceil(plan_price_usd / eth_price * 10**4) * 10**14 + tag * 10**9 if eth_price else None
+    sol_lamports = math.ceil(plan_price_usd / sol_price * 10**3) * 10**6 + tag * 100 if sol_price else None
+    return usd_micro, eth_wei, sol_lamports
+
+def format_units(amount, decimals):
+    """Exact decimal string for an integer amount of base units (wei, lamports, micro-dollars)."""
+    whole, fraction = divmod(int(amount), 10 ** decimals)
+    return f"{whole}.{fraction:0{decimals}d}".rstrip('0').rstrip('.')
+
+def within_invoice(invoice, block_time):
+    """True if a tx mined at `block_time` (epoch seconds) was sent while the invoice was open."""
+    return invoice['created_at'] <= block_time <= invoice['expires_at']
+
+class PriceQuoteCache:
+    """USD quotes for ETH/SOL, refreshed at most every PRICE_CACHE_TTL_SECONDS."""
+
+    def __init__(self, session_getter, ttl=PRICE_CACHE_TTL_SECONDS, url=COINGECKO_PRICE_URL):
+        self._session_getter = session_getter
+        self.ttl = ttl
+        self.url = url
+        self._prices = {}
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self, asset):
+        """asset: 'ethereum' or 'solana'."""
+        if time.monotonic() - self._fetched_at >= self.ttl:
+            async with self._lock: # Concurrent callers share one refresh
+                if time.monotonic() - self._fetched_at >= self.ttl:
+                    try:
+                        async with self._session_getter().get(self.url) as resp:
+                            resp.raise_for_status()
+                            data = await resp.json()
+                        self._prices = {name: float(quote['usd']) for name, quote in data.items()}
+                        self._fetched_at = time.monotonic()
+                    except Exception as e:
+                        if not self._prices:
+                            raise
+                        logging.warning(f"Price refresh failed, using last quote: {e}")
+        return self._prices[asset]
+
+class PaymentVerifier:
+    """
+    Queue + worker pool that settles /paid claims.
+
+    `create_invoice()` quotes the plan in exact, per-subscriber amounts (see quote_invoice).
+    `submit()` records the claim and returns at once. A claim only verifies if the tx pays
+    the claimant's own invoice amount to our wallet and was mined while that invoice was open,
+    so old transfers and hashes copied from someone else's payment are rejected. A tx can be
+    verified once (payments has a unique index on verified tx hashes).
+
+    Workers verify ETH claims in JSON-RPC batches (eth_getTransactionByHash + eth_getTransactionReceipt
+    + one eth_blockNumber per batch, then eth_getBlockByNumber for block times) against ETHEREUM_RPC
+    and SOL claims with getTransaction against HELIUS_RPC, then call `on_settled(claim, status,
+    amount_usd, reason)` with VERIFIED, REJECTED or STALLED. Both RPC URLs are plain JSON-RPC,
+    so a local node or stub server works.
+    """
+
+    def __init__(self, on_settled, plan_price_usd, eth_rpc=ETHEREUM_RPC, sol_rpc=HELIUS_RPC,
+                 eth_wallet=ETH_MAIN_WALLET, sol_wallet=SOL_MAIN_WALLET, workers=PAYMENT_WORKERS,
+                 price_url=COINGECKO_PRICE_URL, retry_delay=PAYMENT_RETRY_DELAY_SECONDS,
+                 max_attempts=PAYMENT_MAX_ATTEMPTS, invoice_ttl=PAYMENT_INVOICE_TTL_SECONDS):
+        self.on_settled = on_settled
+        self.plan_price_usd = plan_price_usd
+        self.eth_rpc = eth_rpc
+        self.sol_rpc = sol_rpc
+        self.eth_wallet = (eth_wallet or "").lower()
+        self.sol_wallet = sol_wallet or ""
+        self.worker_count = workers
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.invoice_ttl = invoice_ttl
+        self.queue = asyncio.Queue(maxsize=PAYMENT_QUEUE_MAX)
+        self.prices = PriceQuoteCache(self._get_session, url=price_url)
+        self.stats = {'submitted': 0, 'replays': 0, 'verified': 0, 'rejected': 0, 'retries': 0, 'stalled': 0, 'rpc_batches': 0}
+        self._in_flight = set() # (tx_hash, chat_id) of queued or retrying claims
+        self._session = None
+        self._workers = []
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=RPC_TIMEOUT_SECONDS))
+        return self._session
+
+    async def start(self):
+        """Starts the workers and re-queues claims left pending by a previous run."""
+        for _ in range(self.worker_count):
+            self._workers.append(asyncio.create_task(self._worker()))
+        pending = await get_pending_payment_claims()
+        for claim in pending:
+            claim['attempts'] = 0
+            self._in_flight.add((claim['tx_hash'], claim['chat_id']))
+            await self.queue.put(claim)
+        logging.info(f"Payment verifier started with {self.worker_count} worker(s); resumed {len(pending)} pending claim(s).")
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def create_invoice(self, chat_id):
+        """
+        Returns the subscriber's open invoice, issuing a new one if needed. ETH/SOL amounts are
+        None when no price quote is available (the stablecoin amount always is).
+        """
+        invoice = await get_payment_invoice(chat_id)
+        if invoice and invoice['expires_at'] > time.time():
+            return invoice
+        prices = {}
+        for asset in ('ethereum', 'solana'):
+            try:
+                prices[asset] = await self.prices.get(asset)
+            except Exception as e:
+                logging.warning(f"No {asset} price quote for invoice of {chat_id}: {e}")
+        for _ in range(20):
+            tag = random.randint(1, INVOICE_TAG_MAX)
+            invoice = await create_payment_invoice(chat_id, tag, *quote_invoice(self.plan_price_usd, tag, prices.get('ethereum'),
+                                                                                  prices.get('solana')), self.invoice_ttl)
+            if invoice:
+                return invoice
+        raise RuntimeError("No free invoice tag; too many open invoices.")
+
+    async def submit(self, chat_id, tx_hash, username=None):
+        """
+        Queues a claim. Returns 'queued', 'invalid' (malformed hash), 'no_invoice' (no /subscribe
+        invoice to pay), 'replay' (hash already verified) or 'busy' (queue full, ask the user to retry).
+        The same claimant may re-submit a rejected or stalled claim.
+        """
+        chain = detect_chain(tx_hash)
+        if chain is None:
+            return 'invalid'
+        if chain == 'eth':
+            tx_hash = tx_hash.lower()
+        if (tx_hash, chat_id) in self._in_flight:
+            return 'queued' # Already being verified
+        if self.queue.full():
+            return 'busy' # Cheap early out; the put below is what actually decides
+        invoice = await get_payment_invoice(chat_id)
+        # Verifying a payment closes its invoice, so no invoice may mean a re-sent /paid
+        if invoice is None and not await is_payment_verified(tx_hash):
+            return 'no_invoice'
+        if invoice is None or not await record_payment_claim(tx_hash, chat_id, chain):
+            self.stats['replays'] += 1
+            logging.warning(f"Rejected replayed payment tx {tx_hash} from {chat_id}.")
+            return 'replay'
+        if (tx_hash, chat_id) in self._in_flight:
+            return 'queued' # Submitted again while we were awaiting the database
+        try:
+            self.queue.put_nowait({'tx_hash': tx_hash, 'chat_id': chat_id, 'chain': chain,
+                                   'username': username, 'invoice': invoice, 'attempts': 0})
+        except asyncio.QueueFull:
+            # The claim row stays 'pending' (picked up on restart); the claimant's re-submission resets it.
+            return 'busy'
+        self._in_flight.add((tx_hash, chat_id))
+        self.stats['submitted'] += 1
+        return 'queued'
+
+    # --- JSON-RPC ---
+
+    async def _rpc(self, url, payload):
+        method = 'batch' if isinstance(payload, list) else payload['method']
+        with RPC_LATENCY.labels(method).time():
+            async with self._get_session().post(url, json=payload) as resp:
+                resp.raise_for_status()
+                return await resp.json(content_type=None)
+
+    async def _verify_eth_batch(self, claims):
+        """Returns [(status, amount_usd, reason)] for ETH claims, using two JSON-RPC batches."""
+        batch = [{'jsonrpc': '2.0', 'id': 'head', 'method': 'eth_blockNumber', 'params': []}]
+        for i, claim in enumerate(claims):
+            batch.append({'jsonrpc': '2.0', 'id': f"tx{i}", 'method': 'eth_getTransactionByHash', 'params': [claim['tx_hash']]})
+            batch.append({'jsonrpc': '2.0', 'id': f"rc{i}", 'method': 'eth_getTransactionReceipt', 'params': [claim['tx_hash']]})
+        response = await self._rpc(self.eth_rpc, batch)
+        self.stats['rpc_batches'] += 1
+        by_id = {item.get('id'): item.get('result') for item in response}
+        head = int(by_id['head'], 16)
+
+        # Block times, to check each tx was sent while its invoice was open
+        block_numbers = sorted({by_id[f"rc{i}"]['blockNumber'] for i in range(len(claims)) if by_id.get(f"rc{i}")})
+        block_times = {}
+        if block_numbers:
+            response = await self._rpc(self.eth_rpc, [{'jsonrpc': '2.0', 'id': number, 'method': 'eth_getBlockByNumber',
+                                                       'params': [number, False]} for number in block_numbers])
+            self.stats['rpc_batches'] += 1
+            block_times = {item.get('id'): int(item['result']['timestamp'], 16) for item in response if item.get('result')}
+        results = []
+        for i, claim in enumerate(claims):
+            results.append(self._evaluate_eth(claim['invoice'], by_id.get(f"tx{i}"), by_id.get(f"rc{i}"), head, block_times))
+        return results
+
+    def _evaluate_eth(self, invoice, tx, receipt, head, block_times):
+        if tx is None or receipt is None:
+            return RETRY, None, "Transaction not found or not mined yet."
+        if int(receipt.get('status', '0x0'), 16) != 1:
+            return REJECTED, None, "Transaction failed on-chain."
+        if head - int(receipt['blockNumber'], 16) + 1 < PAYMENT_MIN_ETH_CONFIRMATIONS:
+            return RETRY, None, "Waiting for confirmations."
+        block_time = block_times.get(receipt['blockNumber'])
+        if block_time is None:
+            return RETRY, None, "Block not available yet."
+
+        paid = []
+        if (tx.get('to') or "").lower() == self.eth_wallet:
+            value = int(tx.get('value', '0x0'), 16)
+            if value:
+                paid.append(value == invoice['eth_wei'])
+        for log in receipt.get('logs', []):
+            decimals = ERC20_STABLECOINS.get((log.get('address') or "").lower())
+            topics = log.get('topics') or []
+            if decimals is None or len(topics) < 3 or topics[0].lower() != TRANSFER_TOPIC:
+                continue
+            if "0x" + topics[2][-40:].lower() == self.eth_wallet:
+                paid.append(int(log['data'], 16) == invoice['usd_micro'] * 10 ** (decimals - 6))
+        if not paid:
+            return REJECTED, None, "Transaction did not pay our ETH wallet."
+        if not any(paid):
+            return REJECTED, None, "Amount does not match your invoice. Send the exact amount from /subscribe."
+        if not within_invoice(invoice, block_time):
+            return REJECTED, None, "Transaction was not sent while your invoice was open. Use /subscribe for a new invoice."
+        return VERIFIED, invoice['usd_micro'] / 10**6, None
+
+    async def _verify_sol(self, claim):
+        invoice = claim['invoice']
+        response = await self._rpc(self.sol_rpc, {
+            'jsonrpc': '2.0', 'id': 1, 'method': 'getTransaction',
+            'params': [claim['tx_hash'], {'encoding': 'jsonParsed', 'commitment': 'confirmed',
+                                          'maxSupportedTransactionVersion': 0}],
+        })
+        result = response.get('result')
+        if result is None or result.get('blockTime') is None:
+            return RETRY, None, "Transaction not found or not confirmed yet."
+        meta = result.get('meta') or {}
+        if meta.get('err') is not None:
+            return REJECTED, None, "Transaction failed on-chain."
+        # Sum System Program transfers to our wallet, including ones made by inner (CPI) instructions
+        instructions = list(result['transaction']['message'].get('instructions', []))
+        for inner in meta.get('innerInstructions') or []:
+            instructions.extend(inner.get('instructions', []))
+        lamports = 0
+        for instruction in instructions:
+            parsed = instruction.get('parsed')
+            if instruction.get('program') != 'system' or not isinstance(parsed, dict):
+                continue
+            info = parsed.get('info') or {}
+            if parsed.get('type') in ('transfer', 'transferWithSeed') and info.get('destination') == self.sol_wallet:
+                lamports += int(info.get('lamports', 0))
+        if lamports <= 0:
+            return REJECTED, None, "Transaction did not pay our SOL wallet."
+        if invoice['sol_lamports'] is None or lamports != invoice['sol_lamports']:
+            return REJECTED, None, "Amount does not match your invoice. Send the exact amount from /subscribe."
+        if not within_invoice(invoice, result['blockTime']):
+            return REJECTED, None, "Transaction was not sent while your invoice was open. Use /subscribe for a new invoice."
+        return VERIFIED, invoice['usd_micro'] / 10**6, None
+
+    # --- Workers ---
+
+    async def _requeue_later(self, claim):
+        await asyncio.sleep(self.retry_delay)
+        await self.queue.put(claim)
+
+    async def _settle(self, claim, status, amount_usd, reason):
+        if status in (VERIFIED, REJECTED):
+            written = await settle_payment_claim(claim['tx_hash'], claim['chat_id'], status, amount_usd, reason)
+            if written == 'replay' and status == VERIFIED:
+                status, amount_usd, reason = REJECTED, None, "This transaction was already used for another subscription."
+                written = await settle_payment_claim(claim['tx_hash'], claim['chat_id'], status, amount_usd, reason)
+            if written == 'failed':
+                # Nothing was committed and the claim is still pending: check it again later, never credit it now.
+                status, amount_usd, reason = RETRY, None, "Database error while settling."
+        if status == RETRY:
+            claim['attempts'] += 1
+            if claim['attempts'] < self.max_attempts:
+                self.stats['retries'] += 1
+                asyncio.create_task(self._requeue_later(claim))
+                return
+            # Not a verdict: the tx may still confirm. Leave the claim pending (resumed on restart)
+            # and let the user re-send /paid.
+            status = STALLED
+        self._in_flight.discard((claim['tx_hash'], claim['chat_id']))
+        self.stats[status] += 1
+        logging.info(f"Payment {claim['tx_hash']} from {claim['chat_id']} {status}" + (f": {reason}" if reason else "."))
+        try:
+            await self.on_settled(claim, status, amount_usd, reason)
+        except Exception as e:
+            logging.error(f"Payment settlement callback failed for {claim['tx_hash']}: {e}")
+
+    async def _worker(self):
+        while True:
+            claims = [await self.queue.get()]
+            while len(claims) < PAYMENT_BATCH_SIZE and not self.queue.empty():
+                claims.append(self.queue.get_nowait())
+            try:
+                for claim in [c for c in claims if c['invoice'] is None]: # Resumed claim whose invoice was deleted meanwhile
+                    await self._settle(claim, REJECTED, None, "Your invoice has expired. Use /subscribe for a new one.")
+                eth_claims = [c for c in claims if c['chain'] == 'eth' and c['invoice'] is not None]
+                sol_claims = [c for c in claims if c['chain'] == 'sol' and c['invoice'] is not None]
+                jobs = []
+                if eth_claims:
+                    jobs.append(self._verify_eth_batch(eth_claims))
+                jobs.extend(self._verify_sol(c) for c in sol_claims)
+                outcomes = await asyncio.gather(*jobs, return_exceptions=True)
+
+                results = []
+                if eth_claims:
+                    eth_outcome = outcomes.pop(0)
+                    if isinstance(eth_outcome, Exception):
+                        logging.error(f"ETH payment verification batch failed: {eth_outcome}")
+                        eth_outcome = [(RETRY, None, f"RPC error: {eth_outcome}")] * len(eth_claims)
+                    results.extend(zip(eth_claims, eth_outcome))
+                for claim, outcome in zip(sol_claims, outcomes):
+                    if isinstance(outcome, Exception):
+                        logging.error(f"SOL payment verification failed for {claim['tx_hash']}: {outcome}")
+                        outcome = (RETRY, None, f"RPC error: {outcome}")
+                    results.append((claim, outcome))
+                for claim, (status, amount_usd, reason) in results:
+                    await self._settle(claim, status, amount_usd, reason)
+            except Exception as e:
+                logging.error(f"Payment worker error: {e}")
+            finally:
+                for _ in claims:
+                    self.queue.task_done()
@@ -0,0 +1,249 @@
+# scanner_registry.py
+# Runs every configured chain/DEX source as its own concurrent task and merges their pools
+# into one normalized event stream for the alert loop.
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import blockchain_scanner
+from blockchain_scanner import PoolScanner, FileCheckpoint, DeferredCheckpoint, make_web3, decode_pair_created, decode_pool_created_v3, \
+                               PAIR_CREATED_TOPIC, POOL_CREATED_V3_TOPIC, SCANNER_CHECKPOINT_FILE
+from token_metadata import TokenMetadataResolver, TOKEN_CACHE_FILE
+from seen_pools import pool_key
+from solana_scanner import RaydiumScanner
+from scorer import PoolScorer, SCORER_ENABLED
+from chains import CHAINS
+from metrics import SCAN_CYCLE_SECONDS, SCAN_BLOCKS_BEHIND, SCAN_ERRORS, profile_section
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+SCAN_SOURCES = os.getenv("SCAN_SOURCES", "ethereum:uniswap_v2") # Comma-separated names from SOURCE_CATALOG
+SCAN_EVENT_QUEUE_MAX = int(os.getenv("SCAN_EVENT_QUEUE_MAX", "10000"))
+SCAN_ERROR_BACKOFF_MAX_SECONDS = 300 # Longest pause for a source that keeps failing
+
+# kind: 'v2' (PairCreated), 'v3' (PoolCreated) or 'raydium'
+SOURCE_CATALOG = {
+    'ethereum:uniswap_v2': {'chain': 'ethereum', 'dex': 'Uniswap V2', 'kind': 'v2', 'factory': blockchain_scanner.UNISWAP_V2_FACTORY},
+    'ethereum:uniswap_v3': {'chain': 'ethereum', 'dex': 'Uniswap V3', 'kind': 'v3', 'factory': "0x1F98431c8aD98523631AE4a59f267346ea31F984"},
+    'ethereum:sushiswap': {'chain': 'ethereum', 'dex': 'SushiSwap', 'kind': 'v2', 'factory': "0xC0AEe478e3658e2610c5F7A4A2E1777cE9e4f2Ac"},
+    'base:uniswap_v2': {'chain': 'base', 'dex': 'Uniswap V2', 'kind': 'v2', 'factory': "0x8909Dc15e40173Ff4699343b6eB8132c65e18eC6"},
+    'base:uniswap_v3': {'chain': 'base', 'dex': 'Uniswap V3', 'kind': 'v3', 'factory': "0x33128a8fC17869897dcE68Ed026d694621f6FDfD"},
+    'arbitrum:uniswap_v3': {'chain': 'arbitrum', 'dex': 'Uniswap V3', 'kind': 'v3', 'factory': "0x1F98431c8aD98523631AE4a59f267346ea31F984"},
+    'arbitrum:sushiswap': {'chain': 'arbitrum', 'dex': 'SushiSwap', 'kind': 'v2', 'factory': "0xc35DADB65012eC5796536bD9864eD8773aBc74C4"},
+    'bsc:pancakeswap_v2': {'chain': 'bsc', 'dex': 'PancakeSwap V2', 'kind': 'v2', 'factory': "0xcA143Ce32Fe78f1f7019d7d551a6402fC5350c73"},
+    'polygon:uniswap_v3': {'chain': 'polygon', 'dex': 'Uniswap V3', 'kind': 'v3', 'factory': "0x1F98431c8aD98523631AE4a59f267346ea31F984"},
+    'polygon:quickswap': {'chain': 'polygon', 'dex': 'QuickSwap', 'kind': 'v2', 'factory': "0x5757371414417b8C6CAad45bAeF941aBc7d3Ab32"},
+    'solana:raydium': {'chain': 'solana', 'dex': 'Raydium', 'kind': 'raydium'},
+}
+
+def checkpoint_path(name):
+    """The original Ethereum/Uniswap V2 source keeps SCANNER_CHECKPOINT_FILE so upgrades resume where they left off."""
+    if name == 'ethereum:uniswap_v2':
+        return SCANNER_CHECKPOINT_FILE
+    root, ext = os.path.splitext(SCANNER_CHECKPOINT_FILE)
+    return f"{root}_{name.replace(':', '_')}{ext or '.json'}"
+
+def scan_interval(chain):
+    return float(os.getenv(f"{chain.upper()}_SCAN_INTERVAL_SECONDS", CHAINS[chain]['scan_interval']))
+
+def build_sources(names=SCAN_SOURCES, checkpoint_factory=None):
+    """
+    Creates a scanner per enabled source; sources on one chain share its Web3, token cache and scorer.
+    `checkpoint_factory(name)` overrides the per-source checkpoint files (cluster mode keeps them in Postgres).
+    """
+    sources = []
+    web3_by_chain = {'ethereum': blockchain_scanner.w3}
+    resolvers = {}
+    scorers = {}
+    for name in [n.strip() for n in names.split(",") if n.strip()]:
+        spec = SOURCE_CATALOG.get(name)
+        if spec is None:
+            logging.error(f"Unknown scan source '{name}'; known sources: {', '.join(SOURCE_CATALOG)}.")
+            continue
+        chain = spec['chain']
+        chain_config = CHAINS[chain]
+        if not chain_config['rpc']:
+            logging.warning(f"Scan source '{name}' skipped: no RPC configured for {chain}.")
+            continue
+        checkpoint = checkpoint_factory(name) if checkpoint_factory is not None else FileCheckpoint(checkpoint_path(name))
+        if SCORER_ENABLED and spec['kind'] != 'raydium' and chain not in scorers:
+            scorers[chain] = PoolScorer(chain_config['rpc'], chain_config['wrapped_native'])
+        if spec['kind'] == 'raydium':
+            scanner = RaydiumScanner(chain_config['rpc'], checkpoint, name=name)
+        elif name == 'ethereum:uniswap_v2':
+            scanner = blockchain_scanner.get_scanner() # Same instance scan_for_new_pools() uses
+            scanner.checkpoint = checkpoint
+        else:
+            if chain not in web3_by_chain:
+                web3_by_chain[chain] = make_web3(chain_config['rpc'], poa=chain_config['poa'])
+            web3 = web3_by_chain[chain]
+            if chain not in resolvers:
+                if chain == 'ethereum':
+                    resolvers[chain] = blockchain_scanner.get_scanner().token_resolver
+                else:
+                    cache_file = f"{os.path.splitext(TOKEN_CACHE_FILE)[0]}_{chain}.json" if TOKEN_CACHE_FILE else ""
+                    resolvers[chain] = TokenMetadataResolver(web3, cache_file=cache_file)
+            v3 = spec['kind'] == 'v3'
+            scanner = PoolScanner(web3, factory_address=spec['factory'], checkpoint=checkpoint,
+                                  token_resolver=resolvers[chain], name=name,
+                                  topic=POOL_CREATED_V3_TOPIC if v3 else PAIR_CREATED_TOPIC,
+                                  decoder=decode_pool_created_v3 if v3 else decode_pair_created,
+                                  wrapped_native=chain_config['wrapped_native'])
+        sources.append({'name': name, 'chain': chain, 'dex': spec['dex'], 'scanner': scanner,
+                        'scorer': scorers.get(chain), 'interval': scan_interval(chain)})
+    return sources
+
+class ScannerRegistry:
+    """
+    One asyncio task per source, each with its own cadence, checkpoint and error backoff.
+    Blocking scans run on a dedicated thread pool with a thread per source, so a slow or
+    hanging RPC only stalls its own source. Pools already in `seen_index` (a SeenPoolIndex)
+    are dropped; the rest are scored as one batch by the source's scorer (EVM chains), tagged
+    with chain/dex/source and queued on `events`, which the alert loop drains with `next_batch()`.
+
+    Scans advance their checkpoints in memory only (DeferredCheckpoint). Once the alert loop
+    has queued a batch's alerts durably it calls `commit_batch()`, and each scan whose pools
+    are all committed (and every earlier scan of its source) is then marked seen and
+    checkpointed on disk. A crash before that rescans the blocks instead of losing alerts.
+    """
+
+    def __init__(self, sources, queue_max=SCAN_EVENT_QUEUE_MAX, seen_index=None):
+        self.sources = sources
+        self.events = asyncio.Queue(maxsize=queue_max)
+        self.seen_index = seen_index
+        self.status = {s['name']: {'scans': 0, 'pools': 0, 'duplicates': 0, 'errors': 0, 'consecutive_errors': 0,
+                                   'blocks_behind': 0, 'last_success_at': None, 'last_error': None} for s in sources}
+        self._head_watchers = {} # source name -> (HeadWatcher, listener event)
+        self._scans = {s['name']: deque() for s in sources} # Uncommitted scans per source, oldest first
+        self._commit_locks = {s['name']: asyncio.Lock() for s in sources}
+        self._in_flight = set() # pool_key of every queued, uncommitted pool
+        self._handed_out = [] # Scans of the pools returned by next_batch() since the last commit_batch()
+        for source in sources:
+            source['scanner'].checkpoint = DeferredCheckpoint(source['scanner'].checkpoint)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(sources)), thread_name_prefix="scanner")
+        self._tasks = []
+
+    def attach_head_watcher(self, watcher, chain='ethereum'):
+        """Wakes this chain's sources on every block the watcher announces instead of on their timer."""
+        for source in self.sources:
+            if source['chain'] == chain:
+                self._head_watchers[source['name']] = (watcher, watcher.listener())
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run_source(source)) for source in self.sources]
+        logging.info(f"Scanner registry started {len(self._tasks)} source(s): {', '.join(s['name'] for s in self.sources)}.")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    def _scan(self, source):
+        """Runs on the scanner thread. Returns (new pools, duplicates dropped, progress to persist or None)."""
+        with profile_section(f"scan:{source['name']}"):
+            checkpoint = source['scanner'].checkpoint
+            before = checkpoint.latest
+            pools = source['scanner'].scan()
+            progress = checkpoint.latest if checkpoint.latest is not before else None # save() makes a new dict
+            fresh = self.seen_index.filter_unseen(pools, source['chain']) if self.seen_index is not None else pools
+            fresh = [p for p in fresh if pool_key(source['chain'], p['pair_address']) not in self._in_flight] # Reorg rescans
+            if source.get('scorer') is not None:
+                source['scorer'].score(fresh)
+            return fresh, len(pools) - len(fresh), progress
+
+    def _persist(self, source, scan):
+        """Runs on a worker thread: seen index first, so a crash between the two only rescans already-seen pools."""
+        if self.seen_index is not None:
+            self.seen_index.mark_seen(scan['pools'], source['chain'])
+        if scan['progress'] is not None:
+            source['scanner'].checkpoint.persist(scan['progress'])
+
+    async def _commit_ready(self, source):
+        """Persists the source's oldest scans, in order, as long as all their pools are committed."""
+        scans = self._scans[source['name']]
+        async with self._commit_locks[source['name']]:
+            while scans and scans[0]['remaining'] == 0:
+                try:
+                    await asyncio.to_thread(self._persist, source, scans[0])
+                except Exception as e:
+                    logging.error(f"[{source['name']}] Could not persist scan progress ({e}); retrying after the next scan.")
+                    return
+                scan = scans.popleft()
+                self._in_flight.difference_update(pool_key(source['chain'], p['pair_address']) for p in scan['pools'])
+
+    async def _run_source(self, source):
+        name = source['name']
+        status = self.status[name]
+        scanner = source['scanner']
+        loop = asyncio.get_running_loop()
+        while True:
+            started = time.perf_counter()
+            try:
+                pools, duplicates, progress = await loop.run_in_executor(self._executor, self._scan, source)
+            except Exception as e:
+                status['errors'] += 1
+                status['consecutive_errors'] += 1
+                status['last_error'] = str(e)
+                SCAN_ERRORS.labels(name).inc()
+                backoff = min(SCAN_ERROR_BACKOFF_MAX_SECONDS, source['interval'] * 2 ** status['consecutive_errors'])
+                logging.error(f"[{name}] Scan failed ({status['consecutive_errors']} in a row): {e}. Retrying in {backoff:.0f}s.")
+                await asyncio.sleep(backoff)
+                continue
+            finally:
+                SCAN_CYCLE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+            status['scans'] += 1
+            status['pools'] += len(pools)
+            status['duplicates'] += duplicates
+            if duplicates:
+                logging.info(f"[{name}] Dropped {duplicates} already-alerted pool(s).")
+            status['consecutive_errors'] = 0
+            status['last_success_at'] = time.time()
+            status['blocks_behind'] = scanner.blocks_behind
+            SCAN_BLOCKS_BEHIND.labels(name).observe(scanner.blocks_behind)
+            if pools or progress is not None:
+                scan = {'pools': pools, 'progress': progress, 'remaining': len(pools)}
+                self._scans[name].append(scan)
+                self._in_flight.update(pool_key(source['chain'], p['pair_address']) for p in pools)
+                for pool in pools:
+                    pool.update({'chain': source['chain'], 'dex': source['dex'], 'source': name})
+                    await self.events.put((pool, scan))
+                if not pools:
+                    await self._commit_ready(source)
+
+            if scanner.blocks_behind > 0:
+                await asyncio.sleep(0) # Catching up; go again right away
+            elif name in self._head_watchers:
+                watcher, listener = self._head_watchers[name]
+                await watcher.wait(source['interval'], listener) # Times out into a plain poll while the socket is down
+            else:
+                await asyncio.sleep(source['interval'])
+
+    async def next_batch(self, timeout):
+        """
+        Waits up to `timeout` seconds for pools, then returns everything queued so far ([] on timeout).
+        Call `commit_batch()` once their alerts are durably queued.
+        """
+        try:
+            batch = [await asyncio.wait_for(self.events.get(), timeout=timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.events.empty():
+            batch.append(self.events.get_nowait())
+        self._handed_out.extend(scan for _, scan in batch)
+        return [pool for pool, _ in batch]
+
+    async def commit_batch(self):
+        """Marks every pool returned by next_batch() so far as handled, persisting the scans that are complete."""
+        handed_out, self._handed_out = self._handed_out, []
+        for scan in handed_out:
+            scan['remaining'] -= 1
+        names = {pool['source'] for scan in handed_out for pool in scan['pools']}
+        for source in self.sources:
+            if source['name'] in names:
+                await self._commit_ready(source)
@@ -0,0 +1,252 @@
+# scorer.py
+# Batched on-chain risk scoring for newly detected pools, and public / VIP / drop routing from the score.
+
+import os
+import time
+import logging
+import requests
+import numpy as np
+from eth_abi import encode, decode
+from token_metadata import MULTICALL3_ADDRESS, MULTICALL_MAX_CALLS, AGGREGATE3_SELECTOR
+from metrics import RPC_LATENCY, POOL_SCORES, POOLS_ROUTED
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+SCORER_ENABLED = os.getenv("SCORER_ENABLED", "true").lower() == "true"
+SCORE_ALERT_MIN = float(os.getenv("SCORE_ALERT_MIN", "30")) # Pools scoring below this are not alerted at all
+SCORE_PUBLIC_MIN = float(os.getenv("SCORE_PUBLIC_MIN", "75")) # Pools scoring at least this also go to the public channel
+SCORER_MIN_LIQUIDITY = float(os.getenv("SCORER_MIN_LIQUIDITY", "0.1")) # Less wrapped-native liquidity than this scores 0
+SCORER_BLOCKLIST_FILE = os.getenv("SCORER_BLOCKLIST_FILE", "blocklist.txt") # Known scam tokens/deployers, one address per line
+# LP tokens held here count as locked: burn addresses plus UNCX, Team Finance and PinkLock lockers.
+LP_LOCK_HOLDERS = [a.strip() for a in os.getenv("LP_LOCK_HOLDERS", ",".join([
+    "0x000000000000000000000000000000000000dEaD",
+    "0x0000000000000000000000000000000000000000",
+    "0x663A5C229c09b049E36dCc11a9B0d4a8Eb9db214",
+    "0xE2fE530C047f2d85298b07D9333C05737f1435fB",
+    "0x71B5759d73262FBb223956913ecF4ecC51057641",
+])).split(",") if a.strip()]
+SCORER_RPC_TIMEOUT_SECONDS = 30
+
+RENOUNCED_OWNERS = {"0x0000000000000000000000000000000000000000", "0x000000000000000000000000000000000000dead"}
+SELECTOR_BALANCE_OF = bytes.fromhex("70a08231") # balanceOf(address)
+SELECTOR_OWNER = bytes.fromhex("8da5cb5b") # owner()
+SELECTOR_TOTAL_SUPPLY = bytes.fromhex("18160ddd") # totalSupply()
+
+ROUTE_DROP = 'drop'
+ROUTE_VIP = 'vip'
+ROUTE_PUBLIC = 'public'
+
+# Raw feature columns (NaN = unknown) and the weight of each normalised component in the 0-100 score.
+FEATURES = ('liquidity', 'lp_locked', 'renounced', 'deployer_nonce', 'deployer_share')
+FEATURE_WEIGHTS = np.array([0.35, 0.25, 0.10, 0.15, 0.15])
+
+# --- Scoring ---
+
+def score_features(features, min_liquidity=SCORER_MIN_LIQUIDITY):
+    """
+    Scores a (pools x FEATURES) matrix in one pass. Each feature is mapped to 0..1 (unknown = 0.5,
+    except liquidity): liquidity on a log scale (0.1 -> 0, 1 -> 0.5, 10+ -> 1 native token), share
+    of LP tokens burned/locked, owner renounced, deployer's transaction count (log scale, 100+ -> 1)
+    and how little of the supply the deployer still holds. Pools with known, too-low liquidity score
+    0; unknown liquidity (no wrapped-native side, failed read) earns no liquidity points.
+    """
+    liquidity, lp_locked, renounced, deployer_nonce, deployer_share = features.T
+    components = np.column_stack([
+        np.clip((np.log10(np.maximum(liquidity, 1e-12)) + 1) / 2, 0, 1),
+        np.clip(lp_locked / 0.9, 0, 1),
+        renounced,
+        np.clip(np.log10(deployer_nonce + 1) / 2, 0, 1),
+        1 - np.clip(deployer_share / 0.5, 0, 1),
+    ])
+    components[:, 0] = np.where(np.isnan(components[:, 0]), 0.0, components[:, 0])
+    components = np.where(np.isnan(components), 0.5, components)
+    scores = components @ FEATURE_WEIGHTS * 100
+    scores[liquidity < min_liquidity] = 0.0
+    return scores
+
+def routes_for(scores, alert_min=SCORE_ALERT_MIN, public_min=SCORE_PUBLIC_MIN, liquidity=None):
+    """
+    'drop' below SCORE_ALERT_MIN, 'public' from SCORE_PUBLIC_MIN, otherwise 'vip' (subscribers only).
+    Pools whose `liquidity` is unknown (NaN) are never routed 'public', whatever their score.
+    """
+    public = scores >= public_min
+    if liquidity is not None:
+        public &= ~np.isnan(liquidity)
+    return np.where(public, ROUTE_PUBLIC, np.where(scores >= alert_min, ROUTE_VIP, ROUTE_DROP))
+
+class Blocklist:
+    """Lower-cased addresses from a text file (one per line, '#' comments), reloaded when the file changes."""
+
+    def __init__(self, path=SCORER_BLOCKLIST_FILE):
+        self.path = path
+        self.addresses = frozenset()
+        self._mtime = None
+
+    def current(self):
+        if not self.path:
+            return self.addresses
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return self.addresses
+        if mtime != self._mtime:
+            try:
+                with open(self.path) as f:
+                    self.addresses = frozenset(line.split("#", 1)[0].strip().lower() for line in f if line.split("#", 1)[0].strip())
+                self._mtime = mtime
+                logging.info(f"Loaded {len(self.addresses)} blocklisted address(es) from {self.path}.")
+            except OSError as e:
+                logging.error(f"Could not read blocklist {self.path}: {e}")
+        return self.addresses
+
+blocklist = Blocklist()
+
+# --- ABI helpers ---
+
+def _address_arg(address):
+    return bytes.fromhex(address[2:].lower().rjust(64, "0"))
+
+def _uint_result(success, data):
+    return int.from_bytes(data[:32], 'big') if success and len(data) >= 32 else None
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if numerator is not None and denominator else np.nan
+
+class PoolScorer:
+    """
+    Scores every pool of a scan batch with two JSON-RPC round trips, however many pools there are:
+    1. the creation transactions (for the deployer) plus one Multicall3 `aggregate3` per
+       MULTICALL_MAX_CALLS reads: wrapped-native balance of the pool, token owner() and
+       totalSupply(), LP totalSupply() and LP balances of burn/locker addresses;
+    2. the deployers' transaction counts plus their token balances.
+    Without Multicall3 the reads fall back to plain eth_calls in one extra batch.
+    """
+
+    def __init__(self, rpc_url, wrapped_native, multicall_address=MULTICALL3_ADDRESS, lock_holders=None):
+        self.rpc_url = rpc_url
+        self.wrapped_native = wrapped_native.lower()
+        self.multicall_address = multicall_address
+        self.lock_holders = lock_holders if lock_holders is not None else LP_LOCK_HOLDERS
+        self.rpc_round_trips = 0
+        self._session = requests.Session()
+
+    def _batch(self, items):
+        """Posts one JSON-RPC batch; returns the replies in request order."""
+        for i, item in enumerate(items):
+            item.update({'jsonrpc': '2.0', 'id': i})
+        with RPC_LATENCY.labels('scorer_batch').time():
+            response = self._session.post(self.rpc_url, json=items, timeout=SCORER_RPC_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        self.rpc_round_trips += 1
+        by_id = {reply.get('id'): reply for reply in response.json()}
+        return [by_id.get(i, {}) for i in range(len(items))]
+
+    def _multicall_items(self, calls):
+        items = []
+        for start in range(0, len(calls), MULTICALL_MAX_CALLS):
+            chunk = calls[start:start + MULTICALL_MAX_CALLS]
+            payload = AGGREGATE3_SELECTOR + encode(['(address,bool,bytes)[]'], [[(target, True, data) for target, data in chunk]])
+            items.append({'method': 'eth_call', 'params': [{'to': self.multicall_address, 'data': '0x' + payload.hex()}, 'latest']})
+        return items
+
+    def _multicall_results(self, calls, replies):
+        """Decodes aggregate3 replies into [(success, returndata)]; chunks that failed are re-read with plain eth_calls."""
+        results = []
+        for n, reply in enumerate(replies):
+            chunk = calls[n * MULTICALL_MAX_CALLS:(n + 1) * MULTICALL_MAX_CALLS]
+            if reply.get('result'):
+                results.extend(decode(['(bool,bytes)[]'], bytes.fromhex(reply['result'][2:]))[0])
+                continue
+            logging.warning(f"Multicall3 aggregate3 failed ({reply.get('error')}); falling back to plain eth_calls.")
+            direct = self._batch([{'method': 'eth_call', 'params': [{'to': target, 'data': '0x' + data.hex()}, 'latest']}
+                                  for target, data in chunk])
+            results.extend((bool(r.get('result')), bytes.fromhex(r['result'][2:]) if r.get('result') else b"") for r in direct)
+        return results
+
+    def _quote_and_token(self, pool):
+        """(wrapped-native side or None, the other token)."""
+        if pool['token0_address'].lower() == self.wrapped_native:
+            return pool['token0_address'], pool['token1_address']
+        if pool['token1_address'].lower() == self.wrapped_native:
+            return pool['token1_address'], pool['token0_address']
+        return None, pool['token0_address']
+
+    def fetch_features(self, pools):
+        """Returns (features matrix, deployer addresses) for `pools`."""
+        sides = [self._quote_and_token(pool) for pool in pools]
+        reads_per_pool = 4 + len(self.lock_holders)
+        calls = []
+        for pool, (quote, token) in zip(pools, sides):
+            pair = pool['pair_address']
+            calls.append((quote or token, SELECTOR_BALANCE_OF + _address_arg(pair)))
+            calls.append((token, SELECTOR_OWNER))
+            calls.append((token, SELECTOR_TOTAL_SUPPLY))
+            calls.append((pair, SELECTOR_TOTAL_SUPPLY)) # Reverts for V3 pools (no fungible LP token)
+            calls.extend((pair, SELECTOR_BALANCE_OF + _address_arg(holder)) for holder in self.lock_holders)
+
+        tx_items = [{'method': 'eth_getTransactionByHash', 'params': [pool['transaction_hash']]} for pool in pools]
+        multicall_items = self._multicall_items(calls)
+        replies = self._batch(tx_items + multicall_items)
+        deployers = [(reply.get('result') or {}).get('from') for reply in replies[:len(pools)]]
+        reads = self._multicall_results(calls, replies[len(pools):])
+
+        known = [(i, deployer) for i, deployer in enumerate(deployers) if deployer]
+        holding_calls = [(sides[i][1], SELECTOR_BALANCE_OF + _address_arg(deployer)) for i, deployer in known]
+        nonce_items = [{'method': 'eth_getTransactionCount', 'params': [deployer, 'latest']} for _, deployer in known]
+        holding_items = self._multicall_items(holding_calls)
+        replies = self._batch(nonce_items + holding_items) if known else []
+        holdings = self._multicall_results(holding_calls, replies[len(known):]) if known else []
+
+        features = np.full((len(pools), len(FEATURES)), np.nan)
+        for i, (quote, _) in enumerate(sides):
+            row = reads[i * reads_per_pool:(i + 1) * reads_per_pool]
+            quote_balance = _uint_result(*row[0])
+            if quote is not None and quote_balance is not None:
+                features[i, 0] = quote_balance / 10 ** 18 # Wrapped native tokens all use 18 decimals
+            lp_supply = _uint_result(*row[3])
+            lp_held = [_uint_result(*r) for r in row[4:]]
+            if lp_supply and None not in lp_held:
+                features[i, 1] = sum(lp_held) / lp_supply
+            success, data = row[1]
+            if success and len(data) >= 32:
+                features[i, 2] = 1.0 if "0x" + data[12:32].hex() in RENOUNCED_OWNERS else 0.0
+        for n, (i, _) in enumerate(known):
+            nonce = replies[n].get('result')
+            if nonce:
+                features[i, 3] = int(nonce, 16)
+            features[i, 4] = _ratio(_uint_result(*holdings[n]), _uint_result(*reads[i * reads_per_pool + 2]))
+        return features, deployers
+
+    def score(self, pools):
+        """Sets 'score', 'route' and 'score_features' on every pool (in place). Scoring errors leave pools unscored ('vip')."""
+        if not pools:
+            return pools
+        started = time.perf_counter()
+        try:
+            features, deployers = self.fetch_features(pools)
+        except Exception as e:
+            logging.error(f"Scoring failed for {len(pools)} pool(s): {e}. Alerting them unscored.")
+            for pool in pools:
+                pool['route'] = ROUTE_VIP
+            return pools
+
+        scores = score_features(features)
+        blocked = blocklist.current()
+        if blocked:
+            hits = np.array([bool({pool['token0_address'].lower(), pool['token1_address'].lower(), (deployer or "").lower()} & blocked)
+                             for pool, deployer in zip(pools, deployers)])
+            scores[hits] = 0.0
+        routes = routes_for(scores, liquidity=features[:, 0])
+
+        for i, pool in enumerate(pools):
+            pool['score'] = round(float(scores[i]), 1)
+            pool['route'] = str(routes[i])
+            pool['score_features'] = {name: (None if np.isnan(value) else float(value)) for name, value in zip(FEATURES, features[i])}
+            pool['score_features']['deployer'] = deployers[i]
+            POOL_SCORES.observe(pool['score'])
+            POOLS_ROUTED.labels(pool['route']).inc()
+        logging.info(f"Scored {len(pools)} pool(s) in {time.perf_counter() - started:.2f}s: "
+                     f"{sum(r == ROUTE_PUBLIC for r in routes)} public, {sum(r == ROUTE_VIP for r in routes)} VIP, "
+                     f"{sum(r == ROUTE_DROP for r in routes)} dropped.")
+        return pools
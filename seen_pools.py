@@ -0,0 +1,203 @@
+# seen_pools.py
+# Remembers every pool that has already been alerted (keyed on chain + pair address) so overlapping
+# scan windows, RPC retries, reorg rescans and restarts never alert the same pool twice.
+
+import os
+import math
+import time
+import struct
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+SEEN_POOLS_DB_PATH = os.getenv("SEEN_POOLS_DB_PATH", "seen_pools.db") # Exact on-disk index; "" disables dedup
+SEEN_POOLS_BLOOM_CAPACITY = int(os.getenv("SEEN_POOLS_BLOOM_CAPACITY", "20000000")) # Pools the filter is sized for
+SEEN_POOLS_BLOOM_ERROR_RATE = float(os.getenv("SEEN_POOLS_BLOOM_ERROR_RATE", "0.001")) # ~36 MB at the default capacity
+SEEN_POOLS_SNAPSHOT_EVERY = 10000 # New entries between Bloom snapshots (the snapshot only speeds up startup)
+BLOOM_SNAPSHOT_MAGIC = b"SEENBLM1"
+BLOOM_SNAPSHOT_HEADER = struct.Struct("<8sQIQQ") # magic, bits, hashes, entries, last rowid
+
+def pool_key(chain, pair_address):
+    """EVM addresses are case-insensitive (checksums vary); Solana's base58 keys are not."""
+    address = pair_address.lower() if pair_address.startswith("0x") else pair_address
+    return f"{chain}:{address}"
+
+class BloomFilter:
+    """Fixed-size Bloom filter over a bytearray, using double hashing of one BLAKE2b digest."""
+
+    def __init__(self, capacity, error_rate, data=None):
+        self.bits, self.hashes = self.dimensions(capacity, error_rate)
+        self.data = data if data is not None else bytearray((self.bits + 7) // 8)
+
+    @staticmethod
+    def dimensions(capacity, error_rate):
+        """Optimal (bit count, hash count) for `capacity` keys at `error_rate` false positives."""
+        bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        return bits, max(1, round(bits / capacity * math.log(2)))
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class SeenPoolIndex:
+    """
+    Exact SQLite table of seen pools fronted by an in-memory Bloom filter. New pools (the common
+    case) are recognised by the filter alone and bulk-inserted; only filter hits (real duplicates
+    or the rare false positive) are looked up in SQLite. RAM stays at the filter size however
+    many pools are stored. The index assumes it is the only writer to its database file.
+
+    The filter is snapshotted next to the database together with the last table rowid it
+    covers; at startup the snapshot is loaded and only newer rows are replayed, so a stale or
+    missing snapshot costs startup time but never correctness. `filter_unseen()` only reads;
+    call `mark_seen()` once the pools' alerts are durably queued, so a crash in between
+    re-detects them instead of losing them.
+    """
+
+    def __init__(self, path=SEEN_POOLS_DB_PATH, capacity=SEEN_POOLS_BLOOM_CAPACITY,
+                 error_rate=SEEN_POOLS_BLOOM_ERROR_RATE):
+        self.path = path
+        self.snapshot_path = f"{path}.bloom"
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = None
+        self.stats_counters = {'hits': 0, 'misses': 0, 'false_positives': 0, 'entries': 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._last_rowid = 0
+        self._unsnapshotted = 0
+
+    def open(self):
+        """Creates the table if needed and loads the filter (snapshot + newer rows, or a full rebuild)."""
+        started = time.perf_counter()
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS seen_pools
+                              (pool_key TEXT PRIMARY KEY,
+                               block_number INTEGER,
+                               first_seen_at INTEGER NOT NULL)''')
+        entries = self._conn.execute("SELECT COALESCE(MAX(rowid), 0), COUNT(*) FROM seen_pools").fetchone()
+        max_rowid, self.stats_counters['entries'] = entries
+        if self.stats_counters['entries'] > self.capacity:
+            logging.warning(f"Seen-pool index holds {self.stats_counters['entries']} pools, more than SEEN_POOLS_BLOOM_CAPACITY "
+                            f"({self.capacity}); sizing the filter for twice that.")
+            self.capacity = self.stats_counters['entries'] * 2
+
+        loaded = self._load_snapshot()
+        if not loaded:
+            self.bloom = BloomFilter(self.capacity, self.error_rate)
+            self._last_rowid = 0
+        replayed = 0
+        for _, key in self._conn.execute("SELECT rowid, pool_key FROM seen_pools WHERE rowid > ? ORDER BY rowid",
+                                             (self._last_rowid,)):
+            self.bloom.add(key)
+            replayed += 1
+        self._last_rowid = max(self._last_rowid, max_rowid)
+        if replayed:
+            self._save_snapshot()
+        logging.info(f"Seen-pool index ready: {self.stats_counters['entries']} pools, {len(self.bloom.data) / 1e6:.1f} MB filter "
+                     f"({'snapshot + ' if loaded else ''}{replayed} row(s) replayed) in {time.perf_counter() - started:.2f}s.")
+        return self
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                magic, bits, hashes, _, last_rowid = BLOOM_SNAPSHOT_HEADER.unpack(f.read(BLOOM_SNAPSHOT_HEADER.size))
+                data = bytearray(f.read())
+        except FileNotFoundError:
+            return False
+        except (OSError, struct.error) as e:
+            logging.warning(f"Could not read seen-pool filter snapshot {self.snapshot_path}: {e}. Rebuilding.")
+            return False
+        expected = BloomFilter.dimensions(self.capacity, self.error_rate)
+        if magic != BLOOM_SNAPSHOT_MAGIC or (bits, hashes) != expected or len(data) != (bits + 7) // 8:
+            logging.info("Seen-pool filter snapshot doesn't match the configured size. Rebuilding.")
+            return False
+        self.bloom = BloomFilter(self.capacity, self.error_rate, data=data)
+        self._last_rowid = last_rowid
+        return True
+
+    def _save_snapshot(self):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(BLOOM_SNAPSHOT_HEADER.pack(BLOOM_SNAPSHOT_MAGIC, self.bloom.bits, self.bloom.hashes,
+                                                   self.stats_counters['entries'], self._last_rowid))
+                f.write(self.bloom.data)
+            os.replace(tmp_path, self.snapshot_path)
+            self._unsnapshotted = 0
+        except OSError as e:
+            logging.error(f"Could not save seen-pool filter snapshot {self.snapshot_path}: {e}")
+
+    def filter_unseen(self, pools, chain):
+        """Returns the pools not in the index, once each (input order kept). Records nothing."""
+        if not pools:
+            return pools
+        with self._lock:
+            fresh = {}
+            for pool in pools:
+                key = pool_key(chain, pool['pair_address'])
+                if key in fresh:
+                    self.stats_counters['hits'] += 1
+                elif key in self.bloom and self._conn.execute("SELECT 1 FROM seen_pools WHERE pool_key = ?", (key,)).fetchone():
+                    self.stats_counters['hits'] += 1
+                else:
+                    if key in self.bloom:
+                        self.stats_counters['false_positives'] += 1
+                    fresh[key] = pool
+        return list(fresh.values())
+
+    def mark_seen(self, pools, chain):
+        """Records `pools` (as returned by filter_unseen) as seen."""
+        if not pools:
+            return
+        with self._lock:
+            now = int(time.time())
+            keys = {pool_key(chain, pool['pair_address']): pool for pool in pools}
+            # Mostly Bloom negatives, so the whole batch is one insert without per-row lookups.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                inserted = self._conn.executemany("INSERT OR IGNORE INTO seen_pools (pool_key, block_number, first_seen_at) VALUES (?, ?, ?)",
+                                                  [(key, pool.get('block_number'), now) for key, pool in keys.items()]).rowcount
+                self._last_rowid = self._conn.execute("SELECT MAX(rowid) FROM seen_pools").fetchone()[0]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            for key in keys:
+                self.bloom.add(key) # Only after COMMIT, so the filter never claims a row that isn't on disk
+            self.stats_counters['misses'] += inserted
+            self.stats_counters['entries'] += inserted
+            self._unsnapshotted += inserted
+            if self._unsnapshotted >= SEEN_POOLS_SNAPSHOT_EVERY:
+                self._save_snapshot()
+
+    def is_seen(self, chain, pair_address):
+        key = pool_key(chain, pair_address)
+        if key not in self.bloom:
+            return False
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM seen_pools WHERE pool_key = ?", (key,)).fetchone() is not None
+
+    def stats(self):
+        return dict(self.stats_counters, bloom_bytes=len(self.bloom.data) if self.bloom is not None else 0)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._save_snapshot()
+                self._conn.close()
+                self._conn = None
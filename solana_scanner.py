@@ -0,0 +1,146 @@
+# solana_scanner.py
+# Raydium AMM v4 pool-creation detection over plain Solana JSON-RPC (Helius or any RPC node).
+
+import os
+import logging
+import requests
+from metrics import RPC_LATENCY
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+RAYDIUM_AMM_PROGRAM = "675kPX9MHTjS2zt1qfr1NYHuzeLXfQM9H24wFSUt1Mp8"
+# Receives Raydium's pool-creation fee, so it only shows up in `initialize2` transactions. Polling it
+# instead of the AMM program avoids fetching every swap.
+RAYDIUM_POOL_FEE_ACCOUNT = os.getenv("RAYDIUM_POOL_FEE_ACCOUNT", "7YttLkHDoNj9wyDur5pM1ejNaAvT9X4eqaYcHQqtj2G5")
+SOLANA_COMMITMENT = os.getenv("SOLANA_COMMITMENT", "confirmed") # 'confirmed' or 'finalized'
+SOLANA_SIGNATURE_PAGE = 1000 # getSignaturesForAddress maximum
+SOLANA_MAX_SIGNATURES_PER_SCAN = int(os.getenv("SOLANA_MAX_SIGNATURES_PER_SCAN", "3000"))
+SOLANA_TX_BATCH_SIZE = 50 # getTransaction calls per JSON-RPC batch
+SOLANA_RPC_TIMEOUT_SECONDS = 30
+
+# initialize2 account layout: [4] AMM id, [8] coin mint, [9] pc mint
+INIT_AMM_INDEX, INIT_COIN_MINT_INDEX, INIT_PC_MINT_INDEX = 4, 8, 9
+
+def short_mint(mint):
+    return f"{mint[:4]}…{mint[-4:]}"
+
+def _account_keys(tx):
+    message = tx['transaction']['message']
+    keys = [k['pubkey'] if isinstance(k, dict) else k for k in message['accountKeys']]
+    loaded = (tx.get('meta') or {}).get('loadedAddresses') or {}
+    return keys + loaded.get('writable', []) + loaded.get('readonly', []) # v0 transactions with lookup tables
+
+def parse_raydium_initialize(tx, signature):
+    """Returns the pool dict for a Raydium initialize2 transaction, or None if it isn't one."""
+    meta = tx.get('meta') or {}
+    if meta.get('err') is not None or not any('initialize2' in line for line in meta.get('logMessages') or []):
+        return None
+    keys = _account_keys(tx)
+    instructions = list(tx['transaction']['message']['instructions'])
+    for inner in meta.get('innerInstructions') or []: # Pools created through a router/CPI
+        instructions.extend(inner.get('instructions', []))
+    for ix in instructions:
+        if keys[ix['programIdIndex']] != RAYDIUM_AMM_PROGRAM or len(ix['accounts']) <= INIT_PC_MINT_INDEX:
+            continue
+        accounts = [keys[i] for i in ix['accounts']]
+        coin_mint, pc_mint = accounts[INIT_COIN_MINT_INDEX], accounts[INIT_PC_MINT_INDEX]
+        return {
+            'pair_address': accounts[INIT_AMM_INDEX],
+            'token0_address': coin_mint,
+            'token1_address': pc_mint,
+            'num_pairs_on_factory': None,
+            'block_number': tx['slot'],
+            'block_hash': None,
+            'block_timestamp': tx.get('blockTime'),
+            'transaction_hash': signature,
+            'log_index': 0,
+            'factory_address': RAYDIUM_AMM_PROGRAM,
+            'is_weth_pair': False, # Almost every Raydium pool is quoted in WSOL, so the EVM WETH filter doesn't apply
+            'token0_info': {'address': coin_mint, 'symbol': short_mint(coin_mint), 'name': None, 'decimals': None},
+            'token1_info': {'address': pc_mint, 'symbol': short_mint(pc_mint), 'name': None, 'decimals': None},
+        }
+    return None
+
+class RaydiumScanner:
+    """
+    Finds new Raydium AMM pools since the last checkpoint (slot + newest processed signature).
+    Same interface as blockchain_scanner.PoolScanner: blocking `scan()` returning pool dicts
+    and a `blocks_behind` attribute, so the scanner registry treats both alike.
+    """
+
+    def __init__(self, rpc_url, checkpoint, name="solana:raydium", commitment=SOLANA_COMMITMENT):
+        self.rpc_url = rpc_url
+        self.checkpoint = checkpoint
+        self.name = name
+        self.commitment = commitment
+        self.blocks_behind = 0
+        self._session = requests.Session()
+
+    def _rpc(self, payload):
+        method = 'batch' if isinstance(payload, list) else payload['method']
+        with RPC_LATENCY.labels(f"sol_{method}").time():
+            response = self._session.post(self.rpc_url, json=payload, timeout=SOLANA_RPC_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.json()
+
+    def _signatures(self, until=None, before=None, limit=SOLANA_SIGNATURE_PAGE):
+        options = {'limit': limit, 'commitment': self.commitment}
+        if until:
+            options['until'] = until
+        if before:
+            options['before'] = before
+        reply = self._rpc({'jsonrpc': '2.0', 'id': 1, 'method': 'getSignaturesForAddress',
+                           'params': [RAYDIUM_POOL_FEE_ACCOUNT, options]})
+        if 'error' in reply:
+            raise RuntimeError(f"getSignaturesForAddress failed: {reply['error']}")
+        return reply['result']
+
+    def _transactions(self, signatures):
+        transactions = {}
+        for start in range(0, len(signatures), SOLANA_TX_BATCH_SIZE):
+            chunk = signatures[start:start + SOLANA_TX_BATCH_SIZE]
+            batch = [{'jsonrpc': '2.0', 'id': i, 'method': 'getTransaction',
+                      'params': [sig, {'encoding': 'json', 'maxSupportedTransactionVersion': 0,
+                                       'commitment': self.commitment}]}
+                     for i, sig in enumerate(chunk)]
+            for item in self._rpc(batch):
+                if 'error' in item:
+                    raise RuntimeError(f"getTransaction failed: {item['error']}")
+                transactions[chunk[item['id']]] = item.get('result')
+        return transactions
+
+    def scan(self):
+        state = self.checkpoint.load()
+        if not state:
+            latest = self._signatures(limit=1)
+            if latest:
+                self.checkpoint.save(latest[0]['slot'], latest[0]['signature'])
+                logging.info(f"[{self.name}] No scanner checkpoint found; starting at slot {latest[0]['slot']}.")
+            return []
+
+        # Newest first; page backwards until we reach the checkpointed signature.
+        entries = []
+        before = None
+        while len(entries) < SOLANA_MAX_SIGNATURES_PER_SCAN:
+            page = self._signatures(until=state['block_hash'], before=before)
+            entries.extend(page)
+            if len(page) < SOLANA_SIGNATURE_PAGE:
+                break
+            before = page[-1]['signature']
+        else:
+            logging.warning(f"[{self.name}] More than {SOLANA_MAX_SIGNATURES_PER_SCAN} new signatures; older ones are skipped.")
+        if not entries:
+            return []
+
+        signatures = [e['signature'] for e in reversed(entries) if e.get('err') is None] # Oldest first
+        transactions = self._transactions(signatures)
+        pools = []
+        for signature in signatures:
+            tx = transactions.get(signature)
+            pool = parse_raydium_initialize(tx, signature) if tx else None
+            if pool is not None:
+                pools.append(pool)
+        self.checkpoint.save(entries[0]['slot'], entries[0]['signature'])
+        logging.info(f"[{self.name}] Checked {len(signatures)} transaction(s) up to slot {entries[0]['slot']}: {len(pools)} new pool(s).")
+        return pools
@@ -0,0 +1,106 @@
+# startup_profiler.py
+# Opt-in cold-start report (--profile-startup or PROFILE_STARTUP=true): time spent in each
+# top-level import and startup phase, measured from process start. Standard library only, so
+# it can be imported before anything heavy and time everything that follows.
+
+import os
+import sys
+import time
+import builtins
+import logging
+import threading
+from contextlib import contextmanager
+
+# --- Configuration ---
+PROFILE_STARTUP = "--profile-startup" in sys.argv or os.getenv("PROFILE_STARTUP", "false").lower() == "true"
+STARTUP_REPORT_MIN_SECONDS = 0.005 # Faster imports are summed into one "other" line
+
+def process_started_at():
+    """Wall-clock time the process started (from /proc on Linux, so interpreter startup counts); now elsewhere."""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split() # Fields from 3 on; comm may contain spaces
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + int(fields[19]) / os.sysconf("SC_CLK_TCK") # Field 22: start time in ticks
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+class StartupProfiler:
+    """
+    Records top-level imports (through a builtins.__import__ wrapper, per thread, inclusive of
+    everything they import), named phases and one-off marks. Does nothing unless enabled.
+    `report()` logs the breakdown once startup is complete.
+    """
+
+    def __init__(self, enabled=PROFILE_STARTUP):
+        self.enabled = enabled
+        self.started_at = process_started_at()
+        self.imports = {} # module -> [seconds, thread name]
+        self.phases = [] # (name, offset from process start, seconds)
+        self.marks = {} # name -> offset from process start
+        self._local = threading.local()
+        self._reported = False
+        if enabled:
+            self._install_import_hook()
+
+    def offset(self):
+        return time.time() - self.started_at
+
+    def _install_import_hook(self):
+        original_import = builtins.__import__
+
+        def timed_import(name, *args, **kwargs):
+            if getattr(self._local, 'importing', False) or name in sys.modules:
+                return original_import(name, *args, **kwargs)
+            self._local.importing = True
+            started = time.perf_counter()
+            try:
+                return original_import(name, *args, **kwargs)
+            finally:
+                self._local.importing = False
+                entry = self.imports.setdefault(name, [0.0, threading.current_thread().name])
+                entry[0] += time.perf_counter() - started
+
+        builtins.__import__ = timed_import
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        offset = self.offset()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, offset, time.perf_counter() - started))
+
+    def mark(self, name):
+        """Records the first time `name` happens (later calls are ignored)."""
+        if self.enabled and name not in self.marks:
+            self.marks[name] = self.offset()
+            if self._reported:
+                logging.info(f"Startup profile: {name} at +{self.marks[name]:.3f}s")
+
+    def report(self):
+        """Logs the import/phase/mark breakdown (once)."""
+        if not self.enabled or self._reported:
+            return
+        self._reported = True
+        lines = [f"Startup profile ({self.offset():.3f}s since process start):"]
+        other = 0.0
+        for name, (seconds, thread) in sorted(self.imports.items(), key=lambda item: -item[1][0]):
+            if seconds < STARTUP_REPORT_MIN_SECONDS:
+                other += seconds
+                continue
+            where = "" if thread == "MainThread" else f" [{thread}]"
+            lines.append(f"  import {name:<30} {seconds * 1000:8.1f} ms{where}")
+        lines.append(f"  import {'(other)':<30} {other * 1000:8.1f} ms")
+        for name, offset, seconds in sorted(self.phases, key=lambda phase: phase[1]):
+            lines.append(f"  phase  {name:<30} {seconds * 1000:8.1f} ms  (from +{offset:.3f}s)")
+        for name, offset in sorted(self.marks.items(), key=lambda mark: mark[1]):
+            lines.append(f"  mark   {name:<30} +{offset:.3f}s")
+        logging.info("\n".join(lines))
+
+startup_profiler = StartupProfiler()
@@ -0,0 +1,175 @@
+# subscriber_store.py
+# One async repository for subscriber state, over either store the bots grew up with: the SQLite
+# `users` table (database.py, main.py's default) or the Postgres `subscribers` table
+# (async_db_manager.py, whale_main.py). Bulk methods cost one statement or transaction per call.
+
+import os
+import time
+import asyncio
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+SUBSCRIBER_STORE_BACKEND = os.getenv("SUBSCRIBER_STORE_BACKEND", "sqlite").lower() # 'sqlite' or 'postgres'
+
+class SubscriberStore:
+    """
+    Backend-neutral subscriber repository. Records are dicts:
+    {'user_id', 'username', 'status', 'expires_at' (epoch seconds or None), 'referrals', 'trial_used'}.
+    Use `is_premium()` for entitlement checks; `status` may lag an expiry until `expire_due()` runs.
+
+    Backends implement open/close, get_many, upsert_many, extend_many, expire_due,
+    expire_many, add_referral and active_premium_ids; the single-user methods are built
+    on the bulk ones (Postgres get_many serves cached rows without a query). upsert_many and
+    extend_many raise on database errors.
+    """
+
+    async def open(self):
+        """Creates/migrates the schema."""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def get_many(self, user_ids):
+        """{user_id: record} for the users that exist."""
+        raise NotImplementedError
+
+    async def upsert_many(self, rows):
+        """Creates missing users and sets usernames for [(user_id, username)]; a None username keeps the old one."""
+        raise NotImplementedError
+
+    async def extend_many(self, user_ids, seconds):
+        """Grants `seconds` of premium to each user (on top of a running subscription); returns {user_id: expires_at}."""
+        raise NotImplementedError
+
+    async def expire_due(self):
+        """Downgrades every subscription that has ended; returns the user_ids downgraded."""
+        raise NotImplementedError
+
+    async def expire_many(self, user_ids):
+        """Like expire_due, limited to `user_ids` (renewed subscriptions are left alone)."""
+        raise NotImplementedError
+
+    async def add_referral(self, user_id):
+        """Counts a referral; returns True if it earned the user's one-time free trial."""
+        raise NotImplementedError
+
+    async def active_premium_ids(self):
+        raise NotImplementedError
+
+    async def get(self, user_id):
+        return (await self.get_many([user_id])).get(user_id)
+
+    async def upsert(self, user_id, username=None):
+        await self.upsert_many([(user_id, username)])
+
+    async def extend(self, user_id, seconds):
+        return (await self.extend_many([user_id], seconds)).get(user_id)
+
+    async def is_premium(self, user_id):
+        record = await self.get(user_id)
+        return record is not None and record['status'] == 'premium' and \
+            record['expires_at'] is not None and record['expires_at'] > time.time()
+
+    async def get_stats(self, user_id):
+        """(referrals, trial_used) like database.get_stats."""
+        record = await self.get(user_id)
+        return (record['referrals'], int(record['trial_used'])) if record else (0, 0)
+
+class SQLiteSubscriberStore(SubscriberStore):
+    """database.py's `users` table. Queries run on worker threads (one SQLite connection each), except is_premium."""
+
+    def __init__(self):
+        import database
+        self.db = database
+
+    async def open(self):
+        await asyncio.to_thread(self.db.init_db)
+
+    async def close(self):
+        self.db.close_db()
+
+    @staticmethod
+    def _record(user_id, row):
+        premium = row['expires_at'] is not None and row['expires_at'] > time.time()
+        return {'user_id': user_id, 'username': row['username'], 'status': 'premium' if premium else 'free',
+                'expires_at': row['expires_at'], 'referrals': row['referrals'], 'trial_used': bool(row['trial_used'])}
+
+    async def get_many(self, user_ids):
+        rows = await asyncio.to_thread(self.db.get_users, list(user_ids))
+        return {user_id: self._record(user_id, row) for user_id, row in rows.items()}
+
+    async def upsert_many(self, rows):
+        await asyncio.to_thread(self.db.upsert_users, list(rows))
+
+    async def extend_many(self, user_ids, seconds):
+        return await asyncio.to_thread(self.db.extend_users, list(user_ids), seconds)
+
+    async def expire_due(self):
+        return await asyncio.to_thread(self.db.expire_users)
+
+    async def expire_many(self, user_ids):
+        return await asyncio.to_thread(self.db.expire_users, list(user_ids))
+
+    async def add_referral(self, user_id):
+        return await asyncio.to_thread(self.db.do_referral, user_id)
+
+    async def active_premium_ids(self):
+        return await asyncio.to_thread(self.db.get_active_vip_ids)
+
+    async def is_premium(self, user_id):
+        return self.db.check_vip(user_id) # Entitlement cache, else one indexed point read: cheaper inline than a thread hop
+
+class PostgresSubscriberStore(SubscriberStore):
+    """async_db_manager's `subscribers` table (DATABASE_URL), sharing its pool and entitlement cache."""
+
+    def __init__(self):
+        import async_db_manager
+        self.db = async_db_manager
+
+    async def open(self):
+        await self.db.initialize_db()
+
+    async def close(self):
+        await self.db.close_db_pool()
+
+    @staticmethod
+    def _record(row):
+        return {'user_id': row['chat_id'], 'username': row['username'], 'status': row['status'],
+                'expires_at': row['subscribed_until'].timestamp() if row['subscribed_until'] else None,
+                'referrals': row.get('referrals', 0), 'trial_used': bool(row.get('trial_used'))}
+
+    async def get_many(self, user_ids):
+        rows = await self.db.get_subscribers(user_ids)
+        return {user_id: self._record(row) for user_id, row in rows.items()}
+
+    async def upsert_many(self, rows):
+        await self.db.upsert_subscribers(rows)
+
+    async def extend_many(self, user_ids, seconds):
+        expires = await self.db.extend_subscriptions(user_ids, seconds)
+        return {user_id: subscribed_until.timestamp() for user_id, subscribed_until in expires.items()}
+
+    async def expire_due(self):
+        return await self.db.expire_due_subscriptions()
+
+    async def expire_many(self, user_ids):
+        return await self.db.expire_subscriptions(list(user_ids))
+
+    async def add_referral(self, user_id):
+        from database import REFERRALS_FOR_TRIAL, TRIAL_HOURS
+        return await self.db.add_referral(user_id, REFERRALS_FOR_TRIAL, TRIAL_HOURS * 3600)
+
+    async def active_premium_ids(self):
+        return await self.db.get_active_premium_subscribers()
+
+BACKENDS = {'sqlite': SQLiteSubscriberStore, 'postgres': PostgresSubscriberStore}
+
+def open_subscriber_store(backend=SUBSCRIBER_STORE_BACKEND):
+    """Returns an (unopened) store for `backend`; call `await store.open()` before use."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown SUBSCRIBER_STORE_BACKEND '{backend}'; expected one of: {', '.join(BACKENDS)}.")
+    logging.info(f"Subscriber store: {backend}.")
+    return BACKENDS[backend]()
@@ -0,0 +1,218 @@
+# throttling.py
+# Per-user and bot-wide update throttling, shared by the AsyncTeleBot (whale_main.py) and aiogram
+# (main.py) entry points. Runs before any handler, so a user hammering buttons or a raid of fresh
+# accounts is turned away in memory instead of reaching Postgres, SQLite or DexScreener.
+
+import os
+import time
+import logging
+from collections import OrderedDict, deque
+from metrics import THROTTLED_UPDATES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "true").lower() == "true"
+THROTTLE_USER_LIMIT = int(os.getenv("THROTTLE_USER_LIMIT", "8")) # Updates one user may send per window
+THROTTLE_USER_WINDOW_SECONDS = float(os.getenv("THROTTLE_USER_WINDOW_SECONDS", "10"))
+THROTTLE_GLOBAL_LIMIT = int(os.getenv("THROTTLE_GLOBAL_LIMIT", "100")) # Updates handled per window across all users
+THROTTLE_GLOBAL_WINDOW_SECONDS = float(os.getenv("THROTTLE_GLOBAL_WINDOW_SECONDS", "1"))
+THROTTLE_NOTICE_INTERVAL_SECONDS = float(os.getenv("THROTTLE_NOTICE_INTERVAL_SECONDS", "10")) # At most one "slow down" reply per user per interval
+THROTTLE_MAX_TRACKED_USERS = 50000 # Bounds memory used by per-user windows and counters
+
+# Precomputed replies; throttled users never cost more than one send per notice interval
+THROTTLE_REPLIES = {
+    'user': "⏳ You're going a bit fast. Please wait a few seconds and try again.",
+    'global': "⏳ The bot is very busy right now. Please try again in a minute.",
+}
+
+class Throttler:
+    """
+    Sliding-window limits per user and across all users, plus coalescing of duplicate callbacks.
+
+    `check(user_id)` admits an update or returns why it is throttled ('user' or 'global'). Only
+    admitted updates count against the windows, and the per-user limit is checked first, so a
+    user hammering the bot uses up their own window, not the shared one other users rely on.
+    `begin(key)`/`end(key)` track callbacks being handled; a second tap of the same button
+    while the first is still running is dropped before it counts against any window.
+    Per-user counters are kept (LRU-bounded) for `user_stats()` and `top_throttled()`.
+    """
+
+    def __init__(self, enabled=THROTTLE_ENABLED, user_limit=THROTTLE_USER_LIMIT, user_window=THROTTLE_USER_WINDOW_SECONDS,
+                 global_limit=THROTTLE_GLOBAL_LIMIT, global_window=THROTTLE_GLOBAL_WINDOW_SECONDS,
+                 notice_interval=THROTTLE_NOTICE_INTERVAL_SECONDS, max_tracked_users=THROTTLE_MAX_TRACKED_USERS,
+                 exempt_ids=()):
+        self.enabled = enabled
+        self.user_limit = user_limit
+        self.user_window = user_window
+        self.global_limit = global_limit
+        self.global_window = global_window
+        self.notice_interval = notice_interval
+        self.max_tracked_users = max_tracked_users
+        self.exempt_ids = {int(user_id) for user_id in exempt_ids if user_id}
+        self.stats = {'allowed': 0, 'throttled_user': 0, 'throttled_global': 0, 'coalesced': 0, 'notices': 0}
+        self._users = OrderedDict() # user_id -> {'hits': deque of admit times, counters..., 'notified_at'}
+        self._global_hits = deque()
+        self._in_flight = set()
+
+    def _user(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            user = {'hits': deque(), 'allowed': 0, 'throttled': 0, 'coalesced': 0, 'notified_at': 0.0}
+            self._users[user_id] = user
+            if len(self._users) > self.max_tracked_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return user
+
+    @staticmethod
+    def _expire(hits, now, window):
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+
+    def check(self, user_id):
+        """None if the update may be handled (and records it), else 'user' or 'global'."""
+        if not self.enabled or user_id is None or user_id in self.exempt_ids:
+            return None
+        now = time.monotonic()
+        user = self._user(user_id)
+        self._expire(user['hits'], now, self.user_window)
+        if len(user['hits']) >= self.user_limit:
+            reason = 'user'
+        else:
+            self._expire(self._global_hits, now, self.global_window)
+            reason = 'global' if len(self._global_hits) >= self.global_limit else None
+        if reason is not None:
+            user['throttled'] += 1
+            self.stats[f'throttled_{reason}'] += 1
+            THROTTLED_UPDATES.labels(reason).inc()
+            return reason
+        user['hits'].append(now)
+        self._global_hits.append(now)
+        user['allowed'] += 1
+        self.stats['allowed'] += 1
+        return None
+
+    def should_notify(self, user_id):
+        """True at most once per notice interval per user: whether to send the throttle reply."""
+        user = self._user(user_id)
+        now = time.monotonic()
+        if now - user['notified_at'] < self.notice_interval:
+            return False
+        user['notified_at'] = now
+        self.stats['notices'] += 1
+        return True
+
+    def begin(self, key, user_id=None):
+        """Marks `key` in flight; False if it already is (the duplicate should be dropped)."""
+        if not self.enabled:
+            return True
+        if key in self._in_flight:
+            self.stats['coalesced'] += 1
+            THROTTLED_UPDATES.labels('coalesced').inc()
+            if user_id is not None:
+                self._user(user_id)['coalesced'] += 1
+            return False
+        self._in_flight.add(key)
+        return True
+
+    def end(self, key):
+        self._in_flight.discard(key)
+
+    def user_stats(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            return {'allowed': 0, 'throttled': 0, 'coalesced': 0}
+        return {'allowed': user['allowed'], 'throttled': user['throttled'], 'coalesced': user['coalesced']}
+
+    def top_throttled(self, count=10):
+        """[(user_id, user_stats)] for the users throttled most often (among those still tracked)."""
+        ranked = sorted(((user_id, user) for user_id, user in self._users.items() if user['throttled'] or user['coalesced']),
+                        key=lambda item: -(item[1]['throttled'] + item[1]['coalesced']))
+        return [(user_id, self.user_stats(user_id)) for user_id, _ in ranked[:count]]
+
+    @property
+    def tracked_users(self):
+        return len(self._users)
+
+def _is_callback(event):
+    return hasattr(event, 'chat_instance') # CallbackQuery in both frameworks; Message has no such field
+
+def _callback_key(event):
+    return (event.from_user.id, event.data)
+
+class TelebotThrottlingMiddleware:
+    """AsyncTeleBot middleware (`bot.setup_middleware(...)`) for messages and callback queries."""
+
+    update_types = ['message', 'callback_query']
+    update_sensitive = False
+
+    def __init__(self, bot, throttler):
+        from telebot.asyncio_handler_backends import CancelUpdate
+        self.bot = bot
+        self.throttler = throttler
+        self._cancel = CancelUpdate
+
+    async def pre_process(self, event, data):
+        user_id = event.from_user.id if event.from_user else None
+        callback = _is_callback(event)
+        if callback and not self.throttler.begin(_callback_key(event), user_id):
+            await self._reply(event, None) # Stops the spinner on the duplicate; the first tap gets the real answer
+            return self._cancel()
+        reason = self.throttler.check(user_id)
+        if reason is not None:
+            if callback:
+                self.throttler.end(_callback_key(event))
+            notify = self.throttler.should_notify(user_id)
+            if notify or callback:
+                await self._reply(event, THROTTLE_REPLIES[reason] if notify else None)
+            return self._cancel() # Skips handlers and post_process
+
+    async def post_process(self, event, data, exception):
+        if _is_callback(event):
+            self.throttler.end(_callback_key(event))
+
+    async def _reply(self, event, text):
+        """Sends `text`; a None text only answers a callback query, so the button stops spinning."""
+        try:
+            if _is_callback(event):
+                await self.bot.answer_callback_query(event.id, text)
+            elif text is not None:
+                await self.bot.send_message(event.chat.id, text)
+        except Exception as e:
+            logging.warning(f"Could not send throttle notice to {event.from_user.id}: {e}")
+
+class AiogramThrottlingMiddleware:
+    """aiogram 3 outer middleware: `dp.message.outer_middleware(m)` and `dp.callback_query.outer_middleware(m)`."""
+
+    def __init__(self, throttler):
+        self.throttler = throttler
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user') or getattr(event, 'from_user', None)
+        user_id = user.id if user else None
+        key = _callback_key(event) if _is_callback(event) else None
+        if key is not None and not self.throttler.begin(key, user_id):
+            await self._answer(event, user_id, None) # Stops the spinner on the duplicate; the first tap gets the real answer
+            return None
+        try:
+            reason = self.throttler.check(user_id)
+            if reason is None:
+                return await handler(event, data)
+            notify = self.throttler.should_notify(user_id)
+            if notify or key is not None:
+                await self._answer(event, user_id, THROTTLE_REPLIES[reason] if notify else None)
+            return None
+        finally:
+            if key is not None:
+                self.throttler.end(key)
+
+    @staticmethod
+    async def _answer(event, user_id, text):
+        """Toast for callbacks, message otherwise; a None text only answers a callback query."""
+        try:
+            if text is not None or _is_callback(event):
+                await event.answer(text)
+        except Exception as e:
+            logging.warning(f"Could not send throttle notice to {user_id}: {e}")
@@ -0,0 +1,245 @@
+# token_metadata.py
+# Batched ERC-20 metadata (symbol/name/decimals) resolution with a bounded LRU/TTL cache.
+
+import os
+import json
+import time
+import logging
+import threading
+import unicodedata
+import requests
+from collections import OrderedDict
+from eth_abi import encode, decode
+from metrics import RPC_LATENCY
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11") # Same address on most EVM chains
+MULTICALL_MAX_CALLS = int(os.getenv("MULTICALL_MAX_CALLS", "600")) # Sub-calls per aggregate3 eth_call
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "50000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+TOKEN_CACHE_NEGATIVE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_NEGATIVE_TTL_SECONDS", "600")) # Retry unreadable tokens sooner
+TOKEN_CACHE_FILE = os.getenv("TOKEN_CACHE_FILE", "token_metadata_cache.json")
+TOKEN_CACHE_SAVE_INTERVAL_SECONDS = 60
+
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb") # aggregate3((address,bool,bytes)[])
+METADATA_SELECTORS = {
+    'symbol': bytes.fromhex("95d89b41"),
+    'name': bytes.fromhex("06fdde03"),
+    'decimals': bytes.fromhex("313ce567"),
+}
+UNKNOWN_SYMBOL = "???"
+TOKEN_STRING_MAX_LENGTHS = {'symbol': 32, 'name': 64} # Longer on-chain strings are cut (they end up in alerts)
+
+# --- ABI decoding helpers ---
+
+def sanitize_token_string(text, max_length):
+    """
+    Token names are attacker-controlled: drops control and format characters (newlines, zero-width,
+    bidi overrides), collapses whitespace and caps the length. Returns None if nothing is left.
+    """
+    text = "".join(" " if ch.isspace() else ch for ch in text if unicodedata.category(ch) not in ('Cc', 'Cf') or ch.isspace())
+    return " ".join(text.split())[:max_length].strip() or None
+
+def decode_string_result(data, max_length=TOKEN_STRING_MAX_LENGTHS['name']):
+    """Decodes a symbol()/name() return value, accepting both `string` and legacy `bytes32` tokens (e.g. MKR)."""
+    if not data:
+        return None
+    if len(data) == 32:
+        return sanitize_token_string(data.rstrip(b"\x00").decode("utf-8", errors="replace"), max_length)
+    try:
+        return sanitize_token_string(decode(['string'], data)[0], max_length)
+    except Exception:
+        return None
+
+def decode_decimals_result(data):
+    if not data or len(data) < 32:
+        return None
+    value = int.from_bytes(data[:32], 'big')
+    return value if value <= 255 else None
+
+class LRUTTLCache:
+    """Thread-safe LRU cache with per-entry expiry (wall-clock, so it survives a save/load)."""
+
+    def __init__(self, max_entries=TOKEN_CACHE_MAX_ENTRIES, ttl=TOKEN_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0}
+
+    def save(self, path):
+        with self._lock:
+            now = time.time()
+            items = [[k, exp, v] for k, (exp, v) in self._entries.items() if exp > now]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(items, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (ValueError, OSError) as e:
+            logging.error(f"Could not load cache file {path}: {e}")
+            return 0
+        now = time.time()
+        with self._lock:
+            for key, expires_at, value in items[-self.max_entries:]: # Saved oldest-first, so keep the newest
+                if expires_at > now:
+                    self._entries[key] = (expires_at, value)
+        return len(self._entries)
+
+class TokenMetadataResolver:
+    """
+    Resolves symbol/name/decimals for many tokens at once.
+
+    All cache misses in a call are fetched together through Multicall3 `aggregate3`
+    (one eth_call per MULTICALL_MAX_CALLS sub-calls). If Multicall3 is unavailable
+    (e.g. a bare local node) it falls back to a single JSON-RPC batch of eth_calls.
+    """
+
+    def __init__(self, web3, cache=None, cache_file=TOKEN_CACHE_FILE, multicall_address=MULTICALL3_ADDRESS):
+        self.w3 = web3
+        self.cache = cache if cache is not None else LRUTTLCache()
+        self.cache_file = cache_file
+        self.multicall_address = multicall_address
+        self.rpc_round_trips = 0
+        self._dirty = False
+        self._last_saved_at = time.time()
+        if cache_file:
+            loaded = self.cache.load(cache_file)
+            if loaded:
+                logging.info(f"Loaded {loaded} cached token metadata entries from {cache_file}.")
+
+    def _aggregate3(self, calls):
+        """calls: [(target, calldata)] -> [(success, returndata)]"""
+        payload = encode(['(address,bool,bytes)[]'], [[(target, True, data) for target, data in calls]])
+        raw = self.w3.eth.call({'to': self.multicall_address, 'data': '0x' + (AGGREGATE3_SELECTOR + payload).hex()})
+        self.rpc_round_trips += 1
+        return decode(['(bool,bytes)[]'], bytes(raw))[0]
+
+    def _jsonrpc_batch(self, calls):
+        endpoint = getattr(self.w3.provider, 'endpoint_uri', None)
+        if not endpoint:
+            raise RuntimeError("JSON-RPC batch fallback needs an HTTP provider.")
+        batch = [{'jsonrpc': '2.0', 'id': i, 'method': 'eth_call',
+                  'params': [{'to': target, 'data': '0x' + data.hex()}, 'latest']}
+                 for i, (target, data) in enumerate(calls)]
+        with RPC_LATENCY.labels('batch_eth_call').time():
+            response = requests.post(endpoint, json=batch, timeout=30)
+        response.raise_for_status()
+        self.rpc_round_trips += 1
+        by_id = {item.get('id'): item for item in response.json()}
+        results = []
+        for i in range(len(calls)):
+            item = by_id.get(i) or {}
+            result = item.get('result')
+            results.append((result is not None, bytes.fromhex(result[2:]) if result else b""))
+        return results
+
+    def _call_many(self, calls):
+        results = []
+        for start in range(0, len(calls), MULTICALL_MAX_CALLS):
+            chunk = calls[start:start + MULTICALL_MAX_CALLS]
+            try:
+                results.extend(self._aggregate3(chunk))
+            except Exception as e:
+                logging.warning(f"Multicall3 aggregate3 failed ({e}); falling back to JSON-RPC batch.")
+                results.extend(self._jsonrpc_batch(chunk))
+        return results
+
+    def resolve_many(self, addresses):
+        """Returns {address: {'address', 'symbol', 'name', 'decimals'}} for every address given."""
+        resolved = {}
+        missing = []
+        for address in dict.fromkeys(addresses): # De-duplicate, keep order
+            info = self.cache.get(address.lower())
+            if info is not None:
+                resolved[address] = info
+            else:
+                missing.append(address)
+        if not missing:
+            return resolved
+
+        calls = [(address, selector) for address in missing for selector in METADATA_SELECTORS.values()]
+        try:
+            results = self._call_many(calls)
+        except Exception as e:
+            logging.error(f"Token metadata lookup failed for {len(missing)} token(s): {e}")
+            results = [(False, b"")] * len(calls)
+
+        fields = list(METADATA_SELECTORS)
+        for i, address in enumerate(missing):
+            info = {'address': address, 'symbol': None, 'name': None, 'decimals': None}
+            for j, field in enumerate(fields):
+                success, data = results[i * len(fields) + j]
+                if not success:
+                    continue
+                data = bytes(data)
+                info[field] = decode_decimals_result(data) if field == 'decimals' else \
+                              decode_string_result(data, TOKEN_STRING_MAX_LENGTHS[field])
+            complete = info['symbol'] is not None
+            if not complete:
+                info['symbol'] = UNKNOWN_SYMBOL
+            self.cache.set(address.lower(), info, ttl=None if complete else TOKEN_CACHE_NEGATIVE_TTL_SECONDS)
+            resolved[address] = info
+        self._dirty = True
+        self.maybe_save()
+        return resolved
+
+    def resolve(self, address):
+        return self.resolve_many([address])[address]
+
+    def maybe_save(self, force=False):
+        """Persists the cache if it changed and the save interval elapsed (or force=True)."""
+        if not self.cache_file or not self._dirty:
+            return
+        if not force and time.time() - self._last_saved_at < TOKEN_CACHE_SAVE_INTERVAL_SECONDS:
+            return
+        try:
+            self.cache.save(self.cache_file)
+            self._dirty = False
+            self._last_saved_at = time.time()
+        except OSError as e:
+            logging.error(f"Could not save token metadata cache to {self.cache_file}: {e}")
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['rpc_round_trips'] = self.rpc_round_trips
+        return stats
@@ -0,0 +1,156 @@
+# webhook_server.py
+# Single asyncio HTTP server (aiohttp) for Telegram webhook ingestion plus /health and /ready, and a
+# separate internal listener for /metrics. Both run on the bot's own event loop, so no second WSGI
+# server or thread is needed.
+
+import os
+import hmac
+import asyncio
+import logging
+from aiohttp import web
+import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configuration ---
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower() # 'polling' or 'webhook'
+PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL") # Public https URL of this service
+WEBHOOK_PATH = "/" + os.getenv("WEBHOOK_PATH", os.getenv("TELEGRAM_WEBHOOK_PATH", "webhook")).strip("/")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN") # Sent back by Telegram in X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_DISPATCH_CONCURRENCY = int(os.getenv("WEBHOOK_DISPATCH_CONCURRENCY", "32"))
+WEBHOOK_QUEUE_MAX = int(os.getenv("WEBHOOK_QUEUE_MAX", "1000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")) # Passed to setWebhook
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1") # /metrics listener; keep it off the public interface
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9091")) # 0 disables /metrics
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class UpdateDispatcher:
+    """
+    Bounded-concurrency update processing. Updates wait in a bounded queue and are handled by
+    a fixed set of workers; when the queue is full `submit()` refuses the update, the webhook
+    answers 503 and Telegram redelivers it later (backpressure instead of unbounded tasks).
+    """
+
+    def __init__(self, handle_update, concurrency=WEBHOOK_DISPATCH_CONCURRENCY, queue_max=WEBHOOK_QUEUE_MAX):
+        self.handle_update = handle_update
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue(maxsize=queue_max)
+        self.stats = {'received': 0, 'processed': 0, 'errors': 0, 'rejected': 0}
+        self._workers = []
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def submit(self, update):
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            return False
+        self.stats['received'] += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.handle_update(update)
+                self.stats['processed'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logging.error(f"Error handling update {update.get('update_id')}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+def create_app(handle_update=None, secret_token=WEBHOOK_SECRET_TOKEN, path=WEBHOOK_PATH, ready_check=None):
+    """
+    Builds the public aiohttp app. `handle_update(update_dict)` is awaited for each Telegram update
+    (omit it to serve only /health and /ready, e.g. in polling mode); every webhook call must then
+    carry `secret_token`, so a webhook app can't be built without one. `ready_check()` returns
+    True once the bot's dependencies are initialized.
+    """
+    if handle_update is not None and not secret_token:
+        raise ValueError("WEBHOOK_SECRET_TOKEN is required in webhook mode; without it anyone could post forged updates.")
+    app = web.Application()
+
+    async def health(request):
+        return web.Response(text="OK")
+
+    async def ready(request):
+        is_ready = ready_check() if ready_check else True
+        if asyncio.iscoroutine(is_ready):
+            is_ready = await is_ready
+        return web.Response(text="READY" if is_ready else "STARTING", status=200 if is_ready else 503)
+
+    app.router.add_get('/health', health)
+    app.router.add_get('/ready', ready)
+
+    if handle_update is not None:
+        dispatcher = UpdateDispatcher(handle_update)
+        app['dispatcher'] = dispatcher
+
+        async def webhook(request):
+            if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+                logging.warning(f"Rejected webhook call with a bad secret token from {request.remote}.")
+                return web.Response(status=403)
+            try:
+                update = await request.json()
+            except ValueError:
+                return web.Response(status=400)
+            if not dispatcher.submit(update):
+                return web.Response(status=503, text="Busy") # Telegram retries non-2xx deliveries
+            return web.Response(text="OK")
+
+        app.router.add_post(path, webhook)
+
+        async def start_dispatcher(app):
+            dispatcher.start()
+
+        async def stop_dispatcher(app):
+            await dispatcher.stop()
+
+        app.on_startup.append(start_dispatcher)
+        app.on_cleanup.append(stop_dispatcher)
+    return app
+
+async def start_server(app, port=PORT, host='0.0.0.0'):
+    """Starts serving `app` on the running loop; returns the runner (call `await runner.cleanup()` to stop)."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"HTTP server listening on {host}:{port}.")
+    return runner
+
+def create_metrics_app():
+    """/metrics only, for the internal listener (start_metrics_server)."""
+    app = web.Application()
+
+    async def metrics_endpoint(request):
+        body, content_type = metrics.render()
+        # Set via headers: the exposition content type includes a charset, which content_type= rejects
+        return web.Response(body=body, headers={'Content-Type': content_type})
+
+    app.router.add_get('/metrics', metrics_endpoint)
+    return app
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serves /metrics on its own (by default loopback-only) listener; None if METRICS_PORT=0 or the port is taken."""
+    if not port:
+        return None
+    try:
+        return await start_server(create_metrics_app(), port=port, host=host)
+    except OSError as e: # e.g. a second worker on the same host; give each its own METRICS_PORT
+        logging.warning(f"Could not serve /metrics on {host}:{port}: {e}")
+        return None
+
+def webhook_url():
+    if not WEBHOOK_BASE_URL:
+        raise ValueError("WEBHOOK_BASE_URL (or RENDER_EXTERNAL_URL) is required in webhook mode.")
+    return WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH
@@ -1,5 +1,6 @@
-# whale_main.py (Polling Bot with Subscription Management)
+# whale_main.py (Polling/Webhook Bot with Subscription Management)
 
+from startup_profiler import startup_profiler # First, so --profile-startup times every import below
 import os
 import logging
 import asyncio
@@ -10,11 +11,23 @@ from telebot.async_telebot import AsyncTeleBot
 from telebot import types # For keyboards, etc.
 from datetime import datetime, timedelta
 
-# Import your scanner and DB manager
-from blockchain_scanner import scan_for_new_pools # Assuming this is your pool detector
-from db_manager import initialize_db, get_subscriber, create_or_update_subscriber, \
-                       update_subscription_status, get_active_premium_subscribers, \
-                       check_and_update_expired_subscriptions
+# Import your DB manager (the scanner stack - web3, eth_abi, numpy - loads in the background; see load_scanner_stack)
+from async_db_manager import initialize_db, get_subscriber, create_or_update_subscriber, \
+                             update_subscription_status, get_active_premium_subscribers, \
+                             check_and_update_expired_subscriptions, set_alert_mode, get_digest_subscribers, \
+                             set_payment_pending
+from alert_sender import AlertSender, TELEGRAM_GLOBAL_RATE
+from alert_outbox import AlertOutbox
+from cluster import Cluster, LeadershipLost, CLUSTER_ENABLED
+from expiry_scheduler import ExpiryScheduler
+from payment_verifier import PaymentVerifier, VERIFIED, STALLED, format_units
+from alert_digest import DigestBuffer, render_pools, is_immediate, DIGEST_WINDOW_SECONDS
+from throttling import Throttler, TelebotThrottlingMiddleware
+import webhook_server
+import async_db_manager
+from async_db_manager import ALERT_OUTBOX_CHANNEL
+from metrics import HANDLER_LATENCY, ALERT_FANOUT_SECONDS, POOLS_DETECTED, ALERTS_SENT, \
+                    observe_async, register_cache_stats, register_gauge_fn, profile_section, profiler
 
 # --- Logging Configuration ---
 logging.basicConfig(level=logging.INFO,
@@ -23,9 +36,18 @@ logging.basicConfig(level=logging.INFO,
 # --- Load Environment Variables ---
 load_dotenv()
 
+def channel_id_from_env(name):
+    """Channel alerts go through the outbox, which stores numeric chat ids (-100...), not @usernames."""
+    value = (os.getenv(name) or "").strip()
+    if value and not value.lstrip('-').isdigit():
+        logging.warning(f"{name}={value} is not a numeric chat id; no alerts will be posted there.")
+        return None
+    return int(value) if value else None
+
 # --- Configuration from .env ---
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-VIP_CHANNEL_ID = os.getenv('VIP_CHANNEL_ID') # Main channel for premium alerts
+VIP_CHANNEL_ID = channel_id_from_env('VIP_CHANNEL_ID') # Main channel for premium alerts (every alerted pool)
+PUBLIC_CHANNEL_ID = channel_id_from_env('PUBLIC_CHANNEL_ID') # Free channel; only pools the scorer routes 'public'
 ADMIN_ID = os.getenv('ADMIN_ID') # For admin-specific notifications
 ETH_MAIN_WALLET = os.getenv('ETH_MAIN') # ETH wallet for payments
 SOL_MAIN_WALLET = os.getenv('SOL_MAIN') # SOL wallet for payments
@@ -42,6 +64,10 @@ if not ETH_MAIN_WALLET or not SOL_MAIN_WALLET:
     logging.warning("Payment wallet addresses not fully set. Payment detection may not work.")
 
 bot = AsyncTeleBot(TELEGRAM_BOT_TOKEN)
+alert_sender = AlertSender(bot) # Concurrent, rate-limited alert fan-out
+alert_outbox = AlertOutbox(alert_sender) # Durable pool-alert queue; its workers do the actual sending
+throttler = Throttler(exempt_ids=[ADMIN_ID]) # Per-user/global update limits, checked before any handler touches the DB
+bot.setup_middleware(TelebotThrottlingMiddleware(bot, throttler))
 
 # --- Payment Plan Configuration ---
 PLAN_NAME = "⚡ Sniper Pass"
@@ -52,21 +78,24 @@ PLAN_DURATION_DAYS = 30 # A month for simplicity
 # --- Command Handlers ---
 
 @bot.message_handler(commands=['start', 'help'])
+@observe_async(HANDLER_LATENCY, 'start')
 async def send_welcome(message):
     chat_id = message.chat.id
     username = message.from_user.username if message.from_user.username else message.from_user.first_name
+    alert_sender.unmark_blocked(chat_id) # They're talking to us again, so alerts can reach them
 
     # Ensure user is in DB
-    create_or_update_subscriber(chat_id, username)
-    subscriber = get_subscriber(chat_id)
+    await create_or_update_subscriber(chat_id, username)
+    subscriber = await get_subscriber(chat_id)
 
     welcome_text = (
         f"👋 *Hello, {username}!* I'm IceAlphaHunter Bot.\n\n"
         "I provide premium alerts for new liquidity pools and other alpha.\n\n"
     )
 
-    if subscriber and subscriber['status'] == 'premium' and subscriber['subscribed_until'] > datetime.now():
-        remaining_time = subscriber['subscribed_until'] - datetime.now()
+    if subscriber and subscriber['status'] == 'premium' and subscriber['subscribed_until'] and \
+            subscriber['subscribed_until'] > datetime.now(subscriber['subscribed_until'].tzinfo):
+        remaining_time = subscriber['subscribed_until'] - datetime.now(subscriber['subscribed_until'].tzinfo)
         welcome_text += (
             "💎 You currently have an *active premium subscription*! 🎉\n"
             f"Expires in: {remaining_time.days} days, {remaining_time.seconds // 3600} hours.\n"
@@ -80,28 +109,65 @@ async def send_welcome(message):
         )
 
     await bot.send_message(chat_id, welcome_text, parse_mode='Markdown')
+    startup_profiler.mark("first /start answered")
 
 @bot.message_handler(commands=['subscribe'])
+@observe_async(HANDLER_LATENCY, 'subscribe')
 async def subscribe_command(message):
     chat_id = message.chat.id
     username = message.from_user.username if message.from_user.username else message.from_user.first_name
 
-    create_or_update_subscriber(chat_id, username) # Ensure user is in DB
+    await create_or_update_subscriber(chat_id, username) # Ensure user is in DB
+
+    try:
+        invoice = await payment_verifier.create_invoice(chat_id)
+    except Exception as e:
+        logging.error(f"Could not create invoice for {chat_id}: {e}")
+        await bot.send_message(chat_id, "⚠️ Could not generate your invoice right now. Please try /subscribe again in a minute.")
+        return
 
+    amounts = f"💵 *{format_units(invoice['usd_micro'], 6)} USDC or USDT* (ERC-20) to the ETH address\n"
+    if invoice['eth_wei'] is not None:
+        amounts += f"💠 *{format_units(invoice['eth_wei'], 18)} ETH* to the ETH address\n"
+    if invoice['sol_lamports'] is not None:
+        amounts += f"🟣 *{format_units(invoice['sol_lamports'], 9)} SOL* to the SOL address\n"
     invoice_text = (
         f"🧾 *INVOICE GENERATED for {PLAN_NAME} (30 days)* 📦\n"
         f"💵 Price: *${PLAN_PRICE_USD} USD*\n\n"
-        "To subscribe, please send funds to one of the following addresses:\n\n"
+        "To subscribe, send *exactly* one of these amounts (the last digits identify your invoice):\n"
+        f"{amounts}\n"
         f"💠 *ETH (ERC-20)*\n`{ETH_MAIN_WALLET}`\n\n"
         f"🟣 *SOL (Solana)*\n`{SOL_MAIN_WALLET}`\n\n"
+        f"⏰ This invoice is valid until {datetime.utcfromtimestamp(invoice['expires_at']).strftime('%Y-%m-%d %H:%M')} UTC.\n"
         "⚠️ *IMPORTANT: After sending payment, reply with `/paid YOUR_TRANSACTION_HASH`*\n"
         "Example: `/paid 0xabc123def456...` or `/paid 8dtuyskTtsB78DFDPWZ...`\n"
         "Your subscription will be activated after verification."
     )
     await bot.send_message(chat_id, invoice_text, parse_mode='Markdown')
-    update_subscription_status(chat_id, 'pending_payment') # Mark as pending
+    await set_payment_pending(chat_id, True) # Mark as pending (a running premium subscription is left as is)
+
+async def on_payment_settled(claim, status, amount_usd, reason):
+    """Called by payment_verifier once a /paid claim is verified, rejected or stalled."""
+    chat_id = claim['chat_id']
+    tx_hash = claim['tx_hash']
+    if status == VERIFIED:
+        await update_subscription_status(chat_id, 'premium', duration_days=PLAN_DURATION_DAYS, tx_hash=tx_hash)
+        await bot.send_message(chat_id, "✅ Payment verified! Your *premium subscription is now active*! 🎉 You will start receiving exclusive alpha alerts.", parse_mode='Markdown')
+        # Notify admin
+        if ADMIN_ID and int(ADMIN_ID) != chat_id: # Avoid double notification if admin is subscriber
+             who = f"@{claim['username']}" if claim.get('username') else "a user"
+             await bot.send_message(ADMIN_ID, f"🎉 New premium subscriber: {who} (ID: {chat_id})! TX: {tx_hash} (${amount_usd:.2f})")
+    elif status == STALLED:
+        await bot.send_message(chat_id, f"⏳ Your transaction `{tx_hash}` is not confirmed yet. Please send the same `/paid` command again in a few minutes.", parse_mode='Markdown')
+    else:
+        await bot.send_message(chat_id, f"❌ Payment *could not be verified*: {reason}\nPlease double-check your transaction hash or contact support.", parse_mode='Markdown')
+        await set_payment_pending(chat_id, False) # Only clears the pending flag; a premium subscription keeps running
+
+# Verifies /paid claims on-chain in the background (bounded worker pool, replay-protected)
+payment_verifier = PaymentVerifier(on_settled=on_payment_settled, plan_price_usd=PLAN_PRICE_USD)
 
 @bot.message_handler(commands=['paid'])
+@observe_async(HANDLER_LATENCY, 'paid')
 async def paid_command(message):
     chat_id = message.chat.id
     command_parts = message.text.split(maxsplit=1)
@@ -110,44 +176,37 @@ async def paid_command(message):
         return
 
     tx_hash = command_parts[1].strip()
-    await bot.send_message(chat_id, f"Received your payment claim with transaction hash: `{tx_hash}`. Verifying payment...", parse_mode='Markdown')
     logging.info(f"User {chat_id} claimed payment with TX: {tx_hash}")
-
-    # TODO: Implement actual payment verification logic here
-    # This would involve using web3.py to check ETH chain or Solana client to check SOL chain
-    # for transactions to ETH_MAIN_WALLET or SOL_MAIN_WALLET with the correct amount.
-    # For now, we'll simulate success.
-
-    # Example of (placeholder) verification:
-    is_payment_verified = True # Replace with actual verification
-    # if check_eth_payment(tx_hash, ETH_MAIN_WALLET, PLAN_PRICE_USD) or \
-    #    check_sol_payment(tx_hash, SOL_MAIN_WALLET, PLAN_PRICE_USD):
-    #     is_payment_verified = True
-    # else:
-    #     is_payment_verified = False
-
-    if is_payment_verified:
-        update_subscription_status(chat_id, 'premium', duration_days=PLAN_DURATION_DAYS, tx_hash=tx_hash)
-        await bot.send_message(chat_id, "✅ Payment verified! Your *premium subscription is now active*! 🎉 You will start receiving exclusive alpha alerts.", parse_mode='Markdown')
-        # Notify admin
-        if ADMIN_ID and int(ADMIN_ID) != chat_id: # Avoid double notification if admin is subscriber
-             await bot.send_message(ADMIN_ID, f"🎉 New premium subscriber: @{message.from_user.username} (ID: {chat_id})! TX: {tx_hash}", parse_mode='Markdown')
+    try:
+        result = await payment_verifier.submit(chat_id, tx_hash, username=message.from_user.username)
+    except Exception as e:
+        logging.error(f"Could not record payment claim {tx_hash} from {chat_id}: {e}")
+        result = 'busy'
+
+    if result == 'invalid':
+        await bot.send_message(chat_id, "That doesn't look like an ETH transaction hash (`0x` + 64 hex characters) or a Solana signature. Please check and try again.", parse_mode='Markdown')
+    elif result == 'no_invoice':
+        await bot.send_message(chat_id, "You don't have an open invoice. Use /subscribe to get one, pay the exact amount, then send `/paid`.", parse_mode='Markdown')
+    elif result == 'replay':
+        await bot.send_message(chat_id, "❌ This transaction hash has *already been used* for a subscription. Contact support if you think this is a mistake.", parse_mode='Markdown')
+    elif result == 'busy':
+        await bot.send_message(chat_id, "⏳ We're verifying a lot of payments right now. Please send your `/paid` command again in a minute.", parse_mode='Markdown')
     else:
-        await bot.send_message(chat_id, "❌ Payment *could not be verified*. Please double-check your transaction hash or contact support.", parse_mode='Markdown')
-        # Optionally, reset status if they claim a bad TX
-        update_subscription_status(chat_id, 'free')
+        await bot.send_message(chat_id, f"Received your payment claim with transaction hash: `{tx_hash}`. Verifying payment on-chain; you'll get a message here as soon as it settles.", parse_mode='Markdown')
 
 @bot.message_handler(commands=['status'])
+@observe_async(HANDLER_LATENCY, 'status')
 async def status_command(message):
     chat_id = message.chat.id
-    subscriber = get_subscriber(chat_id)
+    subscriber = await get_subscriber(chat_id)
 
     if not subscriber:
         await bot.send_message(chat_id, "You are not registered. Please use /start.", parse_mode='Markdown')
         return
 
     status_text = f"Your current subscription status:\n" \
-                  f"Status: *{subscriber['status'].capitalize()}*\n"
+                  f"Status: *{subscriber['status'].capitalize()}*\n" \
+                  f"Alerts: *{subscriber.get('alert_mode', 'realtime').capitalize()}* (switch with /realtime or /digest)\n"
 
     if subscriber['status'] == 'premium' and subscriber['subscribed_until']:
         remaining_time = subscriber['subscribed_until'] - datetime.now(subscriber['subscribed_until'].tzinfo)
@@ -156,7 +215,7 @@ async def status_command(message):
         else:
             status_text += "Expires: *Expired!* (Your subscription has ended.)\n"
             # In case it's expired but not yet updated by background task
-            update_subscription_status(chat_id, 'free')
+            await update_subscription_status(chat_id, 'free')
     elif subscriber['status'] == 'pending_payment':
         status_text += "Awaiting payment verification.\n"
     else:
@@ -165,94 +224,359 @@ async def status_command(message):
     await bot.send_message(chat_id, status_text, parse_mode='Markdown')
 
 
+@bot.message_handler(commands=['digest', 'realtime'])
+@observe_async(HANDLER_LATENCY, 'alert_mode')
+async def alert_mode_command(message):
+    chat_id = message.chat.id
+    mode = message.text.split()[0].lstrip('/').split('@')[0].lower()
+    if not await set_alert_mode(chat_id, mode):
+        await bot.send_message(chat_id, "You are not registered. Please use /start.", parse_mode='Markdown')
+        return
+    if mode == 'digest':
+        text = (f"🗞 *Digest mode on.* You'll get one summary of new pools every {max(1, round(DIGEST_WINDOW_SECONDS / 60))} minutes; "
+                "top-scored pools still arrive instantly. Use /realtime to switch back.")
+    else:
+        text = "⚡ *Realtime mode on.* You'll get alerts as soon as pools are detected. Use /digest for periodic summaries."
+    await bot.send_message(chat_id, text, parse_mode='Markdown')
+
+@bot.message_handler(commands=['throttled'])
+@observe_async(HANDLER_LATENCY, 'throttled')
+async def throttled_command(message):
+    """Admin only: the users the throttling middleware turned away most often."""
+    if not ADMIN_ID or message.from_user.id != int(ADMIN_ID):
+        return
+    stats = throttler.stats
+    lines = [f"🚦 Allowed {stats['allowed']}, throttled {stats['throttled_user']} (user) / {stats['throttled_global']} (global), "
+             f"coalesced {stats['coalesced']}; tracking {throttler.tracked_users} user(s)."]
+    for user_id, user_stats in throttler.top_throttled():
+        lines.append(f"{user_id}: {user_stats['throttled']} throttled, {user_stats['coalesced']} coalesced, {user_stats['allowed']} allowed")
+    await bot.send_message(message.chat.id, "\n".join(lines))
+
+@bot.message_handler(commands=['promo'])
+@observe_async(HANDLER_LATENCY, 'promo')
+async def promo_command(message):
+    """Admin only: `/promo <days> <chat_id> [chat_id ...]` grants premium to every listed chat in one statement."""
+    if not ADMIN_ID or message.from_user.id != int(ADMIN_ID):
+        return
+    parts = message.text.replace(',', ' ').split()[1:]
+    try:
+        days = float(parts[0])
+        chat_ids = [int(part) for part in parts[1:]]
+    except (IndexError, ValueError):
+        chat_ids = []
+    if not chat_ids:
+        await bot.send_message(message.chat.id, "Usage: /promo <days> <chat_id> [chat_id ...]")
+        return
+    try:
+        expires = await async_db_manager.extend_subscriptions(chat_ids, days * 86400)
+    except Exception as e:
+        logging.error(f"Promo grant to {len(chat_ids)} chat(s) failed: {e}")
+        await bot.send_message(message.chat.id, f"❌ Promo failed: {e}")
+        return
+    for chat_id, subscribed_until in expires.items():
+        expiry_scheduler.schedule(chat_id, subscribed_until.timestamp())
+    await bot.send_message(message.chat.id, f"🎁 Granted {days:g} day(s) of premium to {len(expires)} subscriber(s).")
+
+# --- Subscription Expiry ---
+async def notify_expired(chat_ids):
+    await alert_sender.send_batch(chat_ids, "⌛ Your *premium subscription has expired*. Use /subscribe to renew and keep receiving alpha alerts.",
+                                  parse_mode='Markdown')
+
+async def notify_renewal_reminder(chat_id, expires_at):
+    hours_left = max(0, int((expires_at - time.time()) // 3600))
+    await alert_sender.send_one(chat_id, f"⏰ Your premium subscription expires in about *{hours_left} hours*. Use /subscribe to renew.",
+                                parse_mode='Markdown')
+
+# Downgrades subscribers within seconds of expiry (replaces the old hourly sweep)
+expiry_scheduler = ExpiryScheduler(on_expired=notify_expired, on_reminder=notify_renewal_reminder)
+
 # --- Background Scanner Loop ---
-SCAN_INTERVAL_SECONDS = 10 # Scan for pools every 10 seconds
-SUBSCRIPTION_CHECK_INTERVAL_SECONDS = 3600 # Check for expired subscriptions every hour
+ALERT_BATCH_WAIT_SECONDS = 1 # How long the alert loop waits for pools before checking the digest again
+ALERT_BATCH_MAX_ATTEMPTS = 3 # Tries per batch when processing raises (e.g. a database error) before moving on
+ALERT_LOOP_ERROR_BACKOFF_SECONDS = 5
+NO_SUBSCRIBERS_NOTICE_INTERVAL_SECONDS = float(os.getenv("NO_SUBSCRIBERS_NOTICE_INTERVAL_SECONDS", "3600")) # At most one "no subscribers" admin notice per interval
+_no_subscribers_notified_at = 0.0
+
+# Built by load_scanner_stack()
+scanner_registry = None # Each source (chain + DEX) scans on its own cadence; see SCAN_SOURCES and *_SCAN_INTERVAL_SECONDS
+seen_pool_index = None # Opened by the leader before scanning; stays None with duplicate suppression disabled
+head_watcher = None # Wakes the Ethereum sources as soon as a block is announced; None = plain HTTP polling
+history = None # Columnar pool/delivery archive for backtests (history_archive.py); None with HISTORY_DIR=""
+
+def load_scanner_stack(loop=None):
+    """
+    Imports and builds the scanners, seen-pool index, head watcher and history archive. web3 and
+    friends are most of the startup time, so main() runs this in a worker thread while handlers
+    are already serving. Idempotent. In cluster mode the checkpoints and seen-pool index are shared
+    through Postgres, queried on `loop` (the bot's event loop).
+    """
+    global scanner_registry, seen_pool_index, head_watcher, history
+    if scanner_registry is not None:
+        return scanner_registry
+    with startup_profiler.phase("scanner stack"):
+        from scanner_registry import ScannerRegistry, build_sources, checkpoint_path # Per-chain/DEX pool detectors, one task each
+        from seen_pools import SeenPoolIndex, SEEN_POOLS_DB_PATH
+        from blockchain_scanner import FileCheckpoint
+        from head_watcher import HeadWatcher, ETHEREUM_WS_RPC
+        from history_archive import HistoryArchive, HISTORY_DIR
+        checkpoint_factory = None
+        if cluster is not None: # Any node may be elected next, so it must resume from the same state
+            from cluster import SharedCheckpoint, SharedSeenPoolIndex
+            seen_pool_index = SharedSeenPoolIndex(loop) if SEEN_POOLS_DB_PATH else None
+            checkpoint_factory = lambda name: SharedCheckpoint(name, loop, fallback=FileCheckpoint(checkpoint_path(name)))
+        else:
+            seen_pool_index = SeenPoolIndex() if SEEN_POOLS_DB_PATH else None
+        history = HistoryArchive() if HISTORY_DIR else None
+        alert_outbox.history = history # Deliveries settled before this (first seconds of a restart) are not archived
+        registry = ScannerRegistry(build_sources(checkpoint_factory=checkpoint_factory), seen_index=seen_pool_index)
+        if ETHEREUM_WS_RPC:
+            ethereum_scanners = [s['scanner'] for s in registry.sources if s['chain'] == 'ethereum']
+            head_watcher = HeadWatcher(addresses=[s.factory_address for s in ethereum_scanners],
+                                       topics=sorted({s.topic for s in ethereum_scanners}))
+            registry.attach_head_watcher(head_watcher, chain='ethereum')
+        scanner_registry = registry # Last, so a half-built stack is never visible
+    return scanner_registry
+
+digest_buffer = DigestBuffer() # Pools waiting for the next digest to 'digest' mode subscribers
+
+async def deliver_alerts(messages, chat_ids, pools, kind):
+    """
+    Queues each rendered message for every chat in chat_ids on the alert outbox and returns the
+    number of deliveries queued. If the outbox can't be written, sends directly instead.
+    """
+    if not messages or not chat_ids:
+        return 0
+    timestamps = [p['block_timestamp'] for p in pools if p.get('block_timestamp')] # Live blocks only
+    try:
+        return await alert_outbox.enqueue(messages, chat_ids, kind, block_timestamp=min(timestamps, default=None))
+    except Exception as e:
+        logging.error(f"Could not queue {kind} alerts in the outbox ({e}); sending directly.")
+    sent = 0
+    for alert_message in messages:
+        report = await alert_sender.send_batch(chat_ids, alert_message, parse_mode='Markdown', disable_web_page_preview=True)
+        sent += report['sent']
+    ALERTS_SENT.labels(kind).inc(sent)
+    return sent
 
 async def background_scanner_and_manager_loop():
     """
-    Combines the pool scanner and subscription management.
+    Alert fan-out for pools from every scan source (scanning itself runs in scanner_registry's
+    per-source tasks, so a slow chain never holds up the others). Expiries are handled by expiry_scheduler.
     """
-    last_subscription_check = time.time()
+    new_pools, attempts = [], 0
     while True:
-        logging.info("Starting scheduled new pool scan cycle.")
-        new_pools = scan_for_new_pools() # Get detected pools from blockchain_scanner
-
-        if new_pools:
-            logging.info(f"Processing {len(new_pools)} new pool(s) for alerts.")
-            active_premium_subscribers = get_active_premium_subscribers()
-            if not active_premium_subscribers:
-                logging.info("No active premium subscribers to send alerts to.")
-                if ADMIN_ID: # Notify admin if alerts are happening but no one is getting them
-                    await bot.send_message(ADMIN_ID, "⚠️ Detected new pools, but no active premium subscribers! Promote your bot!", parse_mode='Markdown')
-
-            for pool in new_pools:
-                # Basic filtering example: don't alert for WETH pairs (often existing tokens)
-                # You'll want more sophisticated filtering here!
-                if pool.get('is_weth_pair', False):
-                    logging.info(f"Skipping WETH pair {pool['pair_address']} for alert.")
-                    continue
-
-                token0_symbol = pool['token0_info']['symbol']
-                token1_symbol = pool['token1_info']['symbol']
-
-                # Enhanced Alert Message with Emojis
-                alert_message = (
-                    "🔥 *NEW LIQUIDITY POOL DETECTED!* 🔥\n\n"
-                    f"🔗 Pair Address: [`{pool['pair_address'][:6]}...`](https://etherscan.io/address/{pool['pair_address']})\n"
-                    f"💰 Tokens: `{token0_symbol}/{token1_symbol}`\n"
-                    f"➡️ Token0: [`{pool['token0_address'][:6]}...`](https://etherscan.io/address/{pool['token0_address']})\n"
-                    f"➡️ Token1: [`{pool['token1_address'][:6]}...`](https://etherscan.io/address/{pool['token1_address']})\n"
-                    f"📈 Total Pairs: `{pool['num_pairs_on_factory']}`\n"
-                    f"📦 Block: `{pool['block_number']}`\n"
-                    f"📝 TX: [View Transaction](https://etherscan.io/tx/{pool['transaction_hash']})\n\n"
-                    "🚨 *DYOR - Do Your Own Research! This is not financial advice.* 🚨"
-                )
-
-                for chat_id in active_premium_subscribers:
-                    await bot.send_message(chat_id, alert_message, parse_mode='Markdown', disable_web_page_preview=True)
-                    logging.info(f"Alert sent to premium subscriber {chat_id} for new pool {pool['pair_address']}.")
-        else:
-            logging.info("No new pools detected in this scan cycle.")
+        try:
+            if not attempts:
+                new_pools = await scanner_registry.next_batch(ALERT_BATCH_WAIT_SECONDS)
+            with profile_section("alert_loop"):
+                await process_new_pools(new_pools)
+            attempts = 0
+            await scanner_registry.commit_batch() # Alerts are in the outbox: now the scans may be checkpointed
+            if profiler is not None:
+                profiler.maybe_dump()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            attempts += 1
+            if attempts < ALERT_BATCH_MAX_ATTEMPTS:
+                logging.error(f"Alert loop error (attempt {attempts}/{ALERT_BATCH_MAX_ATTEMPTS}); retrying the batch: {e}")
+            else:
+                # Left handed out, so the next successful batch's commit_batch() checkpoints past it
+                logging.error(f"Alert loop error; giving up on a batch of {len(new_pools)} pool(s) after {attempts} attempts: {e}")
+                attempts = 0
+            await asyncio.sleep(ALERT_LOOP_ERROR_BACKOFF_SECONDS)
+
+@observe_async(ALERT_FANOUT_SECONDS)
+async def process_new_pools(new_pools):
+    """Fans one batch of new pools out to realtime/digest subscribers and flushes the digest if due."""
+    global _no_subscribers_notified_at
+    from scorer import ROUTE_DROP, ROUTE_PUBLIC # Loaded with the scanner stack, before any pool arrives
+    POOLS_DETECTED.inc(len(new_pools))
+
+    if new_pools:
+        if history is not None:
+            history.record_pools(new_pools) # Dropped pools too, so backtests see every candidate
+        logging.info(f"Processing {len(new_pools)} new pool(s) for alerts.")
+        active_premium_subscribers = await get_active_premium_subscribers()
+        if not active_premium_subscribers:
+            logging.info("No active premium subscribers to send alerts to.")
+            # Notify admin if alerts are happening but no one is getting them (not on every batch)
+            if ADMIN_ID and time.time() - _no_subscribers_notified_at >= NO_SUBSCRIBERS_NOTICE_INTERVAL_SECONDS:
+                _no_subscribers_notified_at = time.time()
+                await alert_sender.send_one(int(ADMIN_ID), "⚠️ Detected new pools, but no active premium subscribers! Promote your bot!",
+                                            parse_mode='Markdown')
+
+        # Routing comes from scorer.py: 'drop' (spam, honeypot signals, blocklisted) is never alerted,
+        # 'vip' goes to subscribers and 'public' to the public channel as well. Unscored pools count as 'vip'.
+        alert_pools = [p for p in new_pools if p.get('route') != ROUTE_DROP]
+        if len(alert_pools) < len(new_pools):
+            logging.info(f"Skipping {len(new_pools) - len(alert_pools)} low-score pool(s).")
+
+        digest_ids = await get_digest_subscribers()
+        realtime_recipients = [c for c in active_premium_subscribers if c not in digest_ids]
+        digest_recipients = [c for c in active_premium_subscribers if c in digest_ids]
+        immediate_pools = [p for p in alert_pools if is_immediate(p)]
+        digest_buffer.add([p for p in alert_pools if not is_immediate(p)])
+
+        # Realtime subscribers get everything from this batch in one message (full alert if there's only one pool);
+        # digest subscribers only get the top-scored pools now and the rest in the next digest.
+        queued = await deliver_alerts(render_pools(alert_pools), realtime_recipients, alert_pools, 'realtime')
+        queued += await deliver_alerts(render_pools(immediate_pools), digest_recipients, immediate_pools, 'immediate')
+        public_pools = [p for p in alert_pools if p.get('route') == ROUTE_PUBLIC]
+        for channel_id, channel_pools, kind in ((VIP_CHANNEL_ID, alert_pools, 'vip_channel'),
+                                                (PUBLIC_CHANNEL_ID, public_pools, 'public_channel')):
+            if channel_id and channel_pools:
+                queued += await deliver_alerts(render_pools(channel_pools), [channel_id], channel_pools, kind)
+        if alert_pools:
+            logging.info(f"Alerts for {len(alert_pools)} pool(s) queued as {queued} deliveries "
+                         f"({len(realtime_recipients)} realtime, {len(digest_recipients)} digest subscriber(s)).")
+
+    if digest_buffer.due():
+        digest_ids = await get_digest_subscribers() # A set, fetched once rather than per subscriber
+        digest_recipients = [c for c in await get_active_premium_subscribers() if c in digest_ids]
+        queued = await deliver_alerts(digest_buffer.render(), digest_recipients, [], 'digest')
+        logging.info(f"Digest queued as {queued} deliveries for {len(digest_recipients)} subscriber(s).")
+
+
+# --- Cluster Mode ---
+def on_cluster_rebalance(owned_shards, members):
+    """Delivers only this worker's shards, at its share of the bot-wide Telegram rate limit."""
+    alert_outbox.shards = owned_shards
+    alert_sender.set_global_rate(TELEGRAM_GLOBAL_RATE / max(1, len(members)))
+
+# With CLUSTER_ENABLED, every process delivers alerts for its shards and one elected leader runs the rest
+cluster = Cluster(on_rebalance=on_cluster_rebalance, listeners={ALERT_OUTBOX_CHANNEL: alert_outbox.wake}) \
+    if CLUSTER_ENABLED else None
 
-        # Check for expired subscriptions periodically
-        if time.time() - last_subscription_check >= SUBSCRIPTION_CHECK_INTERVAL_SECONDS:
-            logging.info("Checking for expired subscriptions...")
-            check_and_update_expired_subscriptions()
-            last_subscription_check = time.time()
+# --- Main entry point for running the bot ---
+app_ready = False # Flipped once the DB and RPC checks pass; reported by /ready
 
-        await asyncio.sleep(SCAN_INTERVAL_SECONDS)
+async def handle_webhook_update(update):
+    await bot.process_new_updates([types.Update.de_json(update)])
 
+async def check_rpc():
+    """Loads the scanner stack and checks the Ethereum RPC, off the event loop. Exits if the node is unreachable."""
+    try:
+        await asyncio.to_thread(load_scanner_stack, asyncio.get_running_loop())
+        if history is not None:
+            asyncio.create_task(history.run()) # Every process archives the deliveries it settles
+        import blockchain_scanner # Already imported by the scanner stack
+        with startup_profiler.phase("rpc handshake"):
+            connected = await asyncio.to_thread(blockchain_scanner.w3.is_connected)
+    except Exception as e:
+        logging.critical(f"Error initializing blockchain scanner: {e}. Exiting.")
+        exit(1)
+    if not connected:
+        logging.critical("Initial blockchain RPC connection FAILED. Exiting.")
+        exit(1)
+    logging.info("Initial blockchain RPC connection successful.")
+
+    # Expose the scanner-side caches on /metrics (read at scrape time)
+    for source in scanner_registry.sources:
+        resolver = getattr(source['scanner'], 'token_resolver', None)
+        if resolver is not None:
+            register_cache_stats(f"token_metadata:{source['chain']}", resolver.stats) # Same name for shared resolvers just re-registers
+    if seen_pool_index is not None:
+        register_cache_stats('seen_pools', seen_pool_index.stats) # hits = duplicates suppressed
+
+async def start_scanning(rpc_check):
+    """Starts the scanners and the alert loop once the scanner stack is loaded and the RPC answered."""
+    await rpc_check
+    if seen_pool_index is not None:
+        await asyncio.to_thread(seen_pool_index.open) # Before any scan can report pools
+    if head_watcher is not None:
+        asyncio.create_task(head_watcher.run())
+    if history is not None:
+        asyncio.create_task(history.run_compaction())
+    scanner_registry.start()
+    asyncio.create_task(background_scanner_and_manager_loop())
+    startup_profiler.mark("scanning started")
+    startup_profiler.report()
+
+async def run_leader(webhook_mode, rpc_check):
+    """Everything that must run in exactly one process: scanning, alert fan-out, expiries, payments and Telegram updates."""
+    # Catch anything that expired while we were down, and resume payment claims left pending
+    await asyncio.gather(check_and_update_expired_subscriptions(), payment_verifier.start())
+    asyncio.create_task(expiry_scheduler.run())
+    alert_outbox.purge_settled = True
+    asyncio.create_task(start_scanning(rpc_check)) # Updates are served while the scanner stack finishes loading
+
+    # Receive Telegram updates (a new leader re-points the webhook at itself)
+    startup_profiler.mark("receiving updates")
+    if webhook_mode:
+        await bot.set_webhook(url=webhook_server.webhook_url(), secret_token=webhook_server.WEBHOOK_SECRET_TOKEN,
+                              max_connections=webhook_server.WEBHOOK_MAX_CONNECTIONS)
+        logging.info(f"Telegram webhook set; receiving updates on {webhook_server.WEBHOOK_PATH}.")
+        await asyncio.Event().wait() # Serve until cancelled
+    else:
+        logging.info("Starting Telegram bot polling...")
+        await bot.delete_webhook()
+        await bot.infinity_polling()
 
-# --- Main entry point for running the bot ---
 async def main():
     logging.info("Starting IceAlphaHunter_Bot application...")
 
-    # 1. Initialize Database
+    # 0. Scanner stack import + RPC handshake run in the background from the start, alongside everything below
+    rpc_check = asyncio.create_task(check_rpc())
+
+    # 1. Health/readiness (and, in webhook mode, update ingestion) on this event loop
+    webhook_mode = webhook_server.BOT_MODE == 'webhook'
     try:
-        initialize_db()
-    except Exception as e:
-        logging.critical(f"Database initialization failed: {e}. Exiting.")
+        http_app = webhook_server.create_app(handle_update=handle_webhook_update if webhook_mode else None,
+                                             ready_check=lambda: app_ready and rpc_check.done())
+    except ValueError as e:
+        logging.critical(f"{e} Exiting.")
         exit(1)
+    await webhook_server.start_server(http_app)
+    await webhook_server.start_metrics_server() # Internal listener, not the public port
 
-    # 2. Initialize Blockchain Scanner connection
+    # 2. Initialize Database (concurrently with the RPC handshake)
     try:
-        from blockchain_scanner import w3 # Access the w3 object from scanner
-        if w3.is_connected():
-            logging.info("Initial blockchain RPC connection successful.")
-        else:
-            logging.critical("Initial blockchain RPC connection FAILED. Exiting.")
-            exit(1)
+        with startup_profiler.phase("db schema check"):
+            await initialize_db()
     except Exception as e:
-        logging.critical(f"Error initializing blockchain scanner: {e}. Exiting.")
+        logging.critical(f"Database initialization failed: {e}. Exiting.")
         exit(1)
 
-    # 3. Start background tasks
-    asyncio.create_task(background_scanner_and_manager_loop())
-
-    # 4. Start Telegram bot polling
-    logging.info("Starting Telegram bot polling...")
-    await bot.infinity_polling()
+    # 3. Expose cache/pool internals on /metrics (read at scrape time; scanner caches are added by check_rpc)
+    register_cache_stats('entitlements', async_db_manager.entitlements.stats)
+    register_gauge_fn('db_pool_connections_in_use', 'Checked-out asyncpg connections',
+                      lambda: async_db_manager.get_db_pool_stats().get('in_use', 0))
+    register_gauge_fn('alert_outbox_pending', 'Alert deliveries waiting in the outbox (refreshed every few seconds)',
+                      lambda: alert_outbox.stats['pending'])
+    register_gauge_fn('alert_outbox_oldest_pending_seconds', 'Age of the oldest undelivered alert in the outbox',
+                      lambda: alert_outbox.stats['oldest_pending_seconds'])
+    register_gauge_fn('alert_outbox_in_flight', 'Alert deliveries claimed and being sent',
+                      lambda: alert_outbox.stats['in_flight'])
+    register_gauge_fn('history_archive_buffered_rows', 'Pool/delivery rows waiting to be flushed to the history archive',
+                      lambda: history.stats['buffered'] if history is not None else 0)
+    register_gauge_fn('throttle_tracked_users', 'Users with a live throttling window or counters',
+                      lambda: throttler.tracked_users)
+    register_gauge_fn('webhook_queue_depth', 'Telegram updates waiting for a dispatcher worker',
+                      lambda: http_app['dispatcher'].queue.qsize() if 'dispatcher' in http_app else 0)
+    if cluster is not None:
+        register_gauge_fn('cluster_members', 'Live workers in the cluster', lambda: cluster.stats['members'])
+        register_gauge_fn('cluster_owned_shards', 'Delivery shards owned by this worker', lambda: cluster.stats['owned_shards'])
+        register_gauge_fn('cluster_is_leader', '1 if this worker is the cluster leader', lambda: cluster.stats['is_leader'])
+
+    # 4. Start delivering alerts (picks up deliveries left pending by a previous run first)
+    if cluster is not None:
+        alert_outbox.purge_settled = False
+        await cluster.join() # Claim only our shards from the first round on
+    alert_outbox.start()
+
+    global app_ready
+    app_ready = True
+
+    # 5. Scanning, expiries, payments and Telegram updates: here, or wherever the cluster elects
+    if cluster is None:
+        await run_leader(webhook_mode, rpc_check)
+        return
+    try:
+        await cluster.run(lambda: run_leader(webhook_mode, rpc_check))
+    except LeadershipLost as e:
+        logging.critical(f"{e}. Exiting so that only the new leader scans and polls.")
+        exit(1)
 
 if __name__ == '__main__':
     # Using asyncio.run to run the async main function